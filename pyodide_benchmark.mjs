@@ -0,0 +1,128 @@
+// Startup and attribution timings of the app under Pyodide in Node, with the Pyodide version of the desktop build
+// (the "pyodide" dependency in package.json). From the repository root, after npm install:
+//
+//     npm run bench:pyodide -- [workbook.xlsx] [--size 200] [--days 250] [--repeat 3] [--json startup.json] [--persistence]
+//
+// Times the Pyodide runtime, the packages the desktop build loads, and then runs tools/startup_benchmark.py
+// for the imports and the analysis steps. numpy and pandas come from the Pyodide distribution and the pure Python
+// wheels from PyPI, so the first run needs network access. Their download is timed separately as install_s, the
+// desktop build bundles them instead. streamlit itself is not loaded.
+//
+// --persistence also checks the store across restarts: one runtime puts a synthetic workbook into the store at
+// store.PYODIDE_STORE_DIR and a fresh runtime reads it back. Node has no IndexedDB, so /mnt is a temporary directory
+// of the host (NODEFS) instead of the IDBFS mount of the desktop build. This checks the store, its pickle format and
+// the FS.syncfs call under Pyodide, not IndexedDB itself.
+
+import { mkdtempSync, readFileSync, rmSync, writeFileSync } from 'node:fs';
+import { tmpdir } from 'node:os';
+import { dirname, join } from 'node:path';
+import { fileURLToPath } from 'node:url';
+import { parseArgs } from 'node:util';
+import { loadPyodide } from 'pyodide';
+
+const REPO_DIR = dirname(fileURLToPath(import.meta.url));
+
+const PYODIDE_PACKAGES = ['numpy', 'pandas', 'micropip'];
+const WHEELS = ['openpyxl', 'xlsxwriter', 'plotly'];
+
+async function timed(func) {
+    const start = performance.now();
+    const result = await func();
+    return [(performance.now() - start) / 1000, result];
+}
+
+async function loadApp(storeDir) {
+    // A fresh runtime with numpy and pandas, the repository on /repo and the host directory storeDir on /mnt
+    const pyodide = await loadPyodide();
+    await pyodide.loadPackage(PYODIDE_PACKAGES);
+    pyodide.FS.mkdirTree('/repo');
+    pyodide.FS.mount(pyodide.FS.filesystems.NODEFS, { root: REPO_DIR }, '/repo');
+    pyodide.FS.mkdirTree('/mnt');
+    pyodide.FS.mount(pyodide.FS.filesystems.NODEFS, { root: storeDir }, '/mnt');
+    pyodide.runPython(`
+import sys
+sys.path.insert(0, '/repo/tools')
+`);
+    return pyodide;
+}
+
+async function checkPersistence() {
+    const storeDir = mkdtempSync(join(tmpdir(), 'brinson-store-'));
+    try {
+        const writer = await loadApp(storeDir);
+        writer.runPython(`
+import store
+import benchmark
+store.FrameStore(store.PYODIDE_STORE_DIR).put('persistence_check', benchmark.make_synthetic_prepared(50, 20))
+`);
+        const reader = await loadApp(storeDir);
+        return reader.runPython(`
+import store
+import benchmark
+frames = store.FrameStore(store.PYODIDE_STORE_DIR).get('persistence_check')
+expected = benchmark.make_synthetic_prepared(50, 20)
+frames is not None and frames.keys() == expected.keys() and all(frames[name].equals(df) for name, df in expected.items())
+`);
+    } finally {
+        rmSync(storeDir, { recursive: true, force: true });
+    }
+}
+
+async function main() {
+    const { values, positionals } = parseArgs({
+        allowPositionals: true,
+        options: {
+            size: { type: 'string', default: '200' },
+            days: { type: 'string', default: '250' },
+            repeat: { type: 'string', default: '3' },
+            json: { type: 'string' },
+            persistence: { type: 'boolean', default: false },
+        },
+    });
+
+    const results = {};
+    let pyodide;
+    [results.load_pyodide_s, pyodide] = await timed(() => loadPyodide());
+    results.pyodide = pyodide.version;
+    [results.load_packages_s] = await timed(() => pyodide.loadPackage(PYODIDE_PACKAGES));
+    [results.install_s] = await timed(() => pyodide.runPythonAsync(`
+import micropip
+await micropip.install(${JSON.stringify(WHEELS)})
+`));
+
+    // The repository is mounted as it is (the tools import the app from it), the workbook is copied into the
+    // in-memory file system
+    pyodide.FS.mkdirTree('/repo');
+    pyodide.FS.mount(pyodide.FS.filesystems.NODEFS, { root: REPO_DIR }, '/repo');
+    let workbook = null;
+    if (positionals.length > 0) {
+        workbook = '/tmp/workbook.xlsx';
+        pyodide.FS.writeFile(workbook, readFileSync(positionals[0]));
+    }
+
+    pyodide.globals.set('options', JSON.stringify({
+        workbook,
+        n_instruments: Number(values.size),
+        n_days: Number(values.days),
+        repeat: Number(values.repeat),
+    }));
+    const output = await pyodide.runPythonAsync(`
+import sys
+import json
+sys.path.insert(0, '/repo/tools')
+import startup_benchmark
+json.dumps(startup_benchmark.run(**json.loads(options)))
+`);
+    Object.assign(results, JSON.parse(output));
+
+    if (values.persistence) {
+        [results.store_persistence_s, results.store_persisted] = await timed(checkPersistence);
+    }
+
+    console.log(JSON.stringify(results, null, 2));
+    if (values.json) {
+        writeFileSync(values.json, JSON.stringify(results, null, 2));
+    }
+}
+
+await main();
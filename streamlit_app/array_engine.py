@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+import attribution as attr
+import profiling
+
+# Array-backed alternative to the merge/groupby pipeline in data.py.
+#
+# Dates, instruments and GICS sectors are encoded as integer indices once. Weights and returns are then held as
+# dense date x instrument and date x sector arrays, together with boolean masks that record which rows exist in the
+# long format frames. The masks keep the results identical to the pandas engine when sheets have gaps.
+
+#! ---------------------------- Encoding ----------------------------
+
+def categories(values):
+    # Sorted distinct values. Hashing first keeps the sort down to the distinct values only
+    return np.sort(pd.unique(values))
+
+def encode(values, categories):
+    # Integer index of each value in categories, -1 when the value is not one of them
+    return pd.Index(categories).get_indexer(values)
+
+def to_dense(row_codes, col_codes, values, shape):
+    # Scatter long format values into a dense array, NaN where there is no row
+    dense = np.full(shape, np.nan)
+    present = np.zeros(shape, dtype=bool)
+    valid = (row_codes >= 0) & (col_codes >= 0)
+    dense[row_codes[valid], col_codes[valid]] = values[valid]
+    present[row_codes[valid], col_codes[valid]] = True
+    return dense, present
+
+def lag(values, present):
+    # Value of the previous existing row of the same column, the array equivalent of groupby(...).shift(1)
+    rows = np.arange(values.shape[0])[:, None]
+    last_present = np.maximum.accumulate(np.where(present, rows, -1), axis=0)
+    previous = np.vstack([np.full((1, values.shape[1]), -1), last_present[:-1]])
+    lagged = np.take_along_axis(values, np.clip(previous, 0, None), axis=0)
+    return np.where(present & (previous >= 0), lagged, np.nan)
+
+def aggregate(values, groups, n_groups):
+    # Sum the columns of a date x instrument array into a date x group array, skipping NaN
+    one_hot = np.zeros((len(groups), n_groups))
+    one_hot[np.arange(len(groups)), groups] = 1.0
+    return np.nan_to_num(values) @ one_hot
+
+#! ---------------------------- Benchmark ----------------------------
+
+def get_benchmark_arrays(prepared, dates, sectors):
+    shape = (len(dates), len(sectors))
+    weights, returns = prepared['benchmark_weights'], prepared['benchmark_returns']
+
+    weight, weight_present = to_dense(encode(weights['Date'].values, dates), encode(weights['GICS Sector'].values.astype(object), sectors), weights['Weight'].values.astype(float), shape)
+    ret, return_present = to_dense(encode(returns['Date'].values, dates), encode(returns['GICS Sector'].values.astype(object), sectors), returns['Return'].values.astype(float), shape)
+
+    # Benchmark rows only exist where both the weight and the return sheet have a value (inner merge)
+    present = weight_present & return_present
+    lagged_weight = lag(np.where(present, weight, np.nan), present)
+
+    return {
+        'present': present,
+        'weight': lagged_weight,
+        'return': np.where(present, ret, np.nan),
+        'weighted_returns': lagged_weight * ret,
+    }
+
+#! ---------------------------- Portfolio ----------------------------
+
+def get_instrument_panel(prepared, dates, benchmark, sectors):
+    weights, returns = prepared['portfolio_weights'], prepared['portfolio_returns']
+    instruments = categories(np.concatenate([weights['Instrument'].values, returns['Instrument'].values]).astype(object))
+    shape = (len(dates), len(instruments))
+
+    weight, weight_present = to_dense(encode(weights['Date'].values, dates), encode(weights['Instrument'].values.astype(object), instruments), weights['Weight'].values.astype(float), shape)
+    ret, return_present = to_dense(encode(returns['Date'].values, dates), encode(returns['Instrument'].values.astype(object), instruments), returns['Return'].values.astype(float), shape)
+    present = weight_present & return_present
+
+    instrument_sectors = (weights.drop_duplicates('Instrument').set_index('Instrument')['Sector 1']
+                          .reindex(instruments).values.astype(object))
+
+    # Multi-industry instruments are replaced by one column per mapped sector. The new columns carry the
+    # instrument weight times the mapping weight and the benchmark return of the mapped sector
+    mapping = prepared['multi_industry_weights']
+    mapped = encode(mapping['Instrument'].values.astype(object), instruments)
+    mapping_sectors = encode(mapping['GICS Sector'].values.astype(object), sectors)
+    mapping_weights = mapping['BM Weight'].values.astype(float)
+
+    replaced = np.zeros(len(instruments), dtype=bool)
+    replaced[mapped[mapped >= 0]] = True
+    usable = (mapped >= 0) & (mapping_sectors >= 0)
+    mapped, mapping_sectors, mapping_weights = mapped[usable], mapping_sectors[usable], mapping_weights[usable]
+
+    keep = ~replaced
+    panel_weight = np.hstack([weight[:, keep], weight[:, mapped] * mapping_weights])
+    panel_return = np.hstack([ret[:, keep], benchmark['return'][:, mapping_sectors]])
+    panel_present = np.hstack([present[:, keep], present[:, mapped] & benchmark['present'][:, mapping_sectors]])
+    panel_sectors = np.concatenate([encode(instrument_sectors[keep], sectors), mapping_sectors])
+
+    # Instruments without a sector drop out of the sector level groupby in the pandas engine as well
+    has_sector = panel_sectors >= 0
+    return panel_weight[:, has_sector], panel_return[:, has_sector], panel_present[:, has_sector], panel_sectors[has_sector]
+
+def get_portfolio_arrays(prepared, dates, benchmark, sectors):
+    weight, ret, present, instrument_sectors = get_instrument_panel(prepared, dates, benchmark, sectors)
+    n_sectors = len(sectors)
+
+    lagged_weight = lag(np.where(present, weight, np.nan), present)
+    weighted_returns = lagged_weight * ret
+
+    sector_weight = aggregate(lagged_weight, instrument_sectors, n_sectors)
+    sector_weighted_returns = aggregate(weighted_returns, instrument_sectors, n_sectors)
+    sector_return_sum = aggregate(np.where(present, ret, np.nan), instrument_sectors, n_sectors)
+    has_rows = aggregate(present.astype(float), instrument_sectors, n_sectors) > 0
+
+    # Sectors with zero total weight on a date are dropped, as in get_portfolio_data
+    sector_present = has_rows & (sector_weight != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sector_performance = sector_weighted_returns / sector_weight
+
+    return {
+        'present': sector_present,
+        'weight': sector_weight,
+        'return': sector_return_sum,
+        'weighted_returns': sector_weighted_returns,
+        'sector_performance': sector_performance,
+    }
+
+#! ---------------------------- Combined ----------------------------
+
+def get_axes(prepared):
+    dates = categories(np.concatenate([prepared[name]['Date'].values for name in ['portfolio_weights', 'portfolio_returns', 'benchmark_weights', 'benchmark_returns']]))
+
+    benchmark_sectors = np.concatenate([prepared['benchmark_weights']['GICS Sector'].values, prepared['benchmark_returns']['GICS Sector'].values])
+    portfolio_sectors = prepared['portfolio_weights']['Sector 1'].dropna().values
+    sectors = categories(np.concatenate([benchmark_sectors, portfolio_sectors]).astype(object))
+
+    return dates, sectors
+
+@profiling.profiled
+def get_data(prepared):
+    # Same outputs as data.get_data with the pandas engine, computed on dense arrays
+    dates, sectors = get_axes(prepared)
+    benchmark = get_benchmark_arrays(prepared, dates, sectors)
+    portfolio = get_portfolio_arrays(prepared, dates, benchmark, sectors)
+
+    def masked(side, key):
+        return np.nan_to_num(np.where(side['present'], side[key], 0.0))
+
+    columns = {
+        'Portfolio Weight': masked(portfolio, 'weight'),
+        'Portfolio Return': masked(portfolio, 'return'),
+        'Portfolio Weighted Returns': masked(portfolio, 'weighted_returns'),
+        'Portfolio Sector Performance': masked(portfolio, 'sector_performance'),
+        'Benchmark Weight': masked(benchmark, 'weight'),
+        'Benchmark Sector Performance': masked(benchmark, 'return'),
+        'Benchmark Weighted Returns': masked(benchmark, 'weighted_returns'),
+    }
+
+    # Daily totals across sectors, broadcast back to every sector of the date
+    portfolio_total = columns['Portfolio Weighted Returns'].sum(axis=1, keepdims=True)
+    benchmark_total = columns['Benchmark Weighted Returns'].sum(axis=1, keepdims=True)
+    columns['Portfolio Daily Total Return'] = np.broadcast_to(portfolio_total, portfolio_total.shape[:1] + (len(sectors),))
+    columns['Benchmark Daily Total Return'] = np.broadcast_to(benchmark_total, benchmark_total.shape[:1] + (len(sectors),))
+    columns['Total Excess Return'] = columns['Portfolio Daily Total Return'] - columns['Benchmark Daily Total Return']
+
+    columns['Allocation Effect'] = attr.calculate_allocation_effect(columns)
+    columns['Selection Effect'] = attr.calculate_selection_effect(columns)
+    columns['Sum of Effects'] = attr.sum_of_effects(columns['Allocation Effect'], columns['Selection Effect'])
+
+    # Only (date, sector) pairs that exist on either side become rows, ordered by date and sector
+    rows = portfolio['present'] | benchmark['present']
+    date_index, sector_index = np.nonzero(rows)
+
+    combined_df = pd.DataFrame({'Date': pd.to_datetime(dates[date_index]), 'GICS Sector': sectors[sector_index]})
+    for name, values in columns.items():
+        combined_df[name] = values[rows]
+
+    daily_columns = ['Portfolio Weight', 'Benchmark Weight', 'Portfolio Weighted Returns', 'Benchmark Weighted Returns',
+                     'Allocation Effect', 'Selection Effect', 'Sum of Effects']
+    row_dates = rows.any(axis=1)
+    daily_level_data = pd.DataFrame({name: np.where(rows, columns[name], 0.0).sum(axis=1)[row_dates] for name in daily_columns},
+                                    index=pd.DatetimeIndex(dates[row_dates], name='Date'))
+    daily_level_data['Excess Return'] = daily_level_data['Portfolio Weighted Returns'] - daily_level_data['Benchmark Weighted Returns']
+
+    return combined_df, daily_level_data
@@ -0,0 +1,125 @@
+import hashlib
+import functools
+from collections import OrderedDict
+import pandas as pd
+
+# In-memory cache for attribution results. The module is imported once per Streamlit server process,
+# so a module level cache survives the script reruns caused by widget interaction.
+
+def hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+def hash_uploads(uploads):
+    # (name, content hash) of every upload. Every file is hashed on its own, so the same bytes split differently over
+    # the files give different hashes. The app computes them once per rerun and shares them between its caches and
+    # the store, which keys workbooks on the same hash
+    return tuple((name, hash_bytes(uploads[name].getvalue())) for name in sorted(uploads))
+
+def make_key(upload_hashes, **settings):
+    # Key on the content of the files (hash_uploads) and the attribution settings used to produce the result
+    return (upload_hashes, tuple(sorted(settings.items())))
+
+def freeze(value):
+    # Hashable stand-in for a function argument. Dataframes are left out, the cache_key of the call stands for them
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return 'frame'
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return ('dict', tuple((key, freeze(v)) for key, v in value.items()))
+    return value
+
+def estimate_size(value):
+    # Approximate memory footprint of a cached value in bytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 0
+
+class ResultCache:
+    """
+    Least recently used cache with a cap on both the number of entries and their total size in bytes.
+    """
+    def __init__(self, max_entries=8, max_bytes=512 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        # Results that would not fit even in an empty cache are not stored
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            del self._entries[key]
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            key, _ = self._entries.popitem(last=False)
+            del self._sizes[key]
+
+results_cache = ResultCache()
+
+# Data behind the charts, filled lazily as charts are opened
+chart_cache = ResultCache(max_entries=32, max_bytes=256 * 1024 ** 2)
+
+# Date and sector bounds of the uploads for the filter widgets
+bounds_cache = ResultCache(max_entries=16)
+
+# Export files, generated when a download is requested
+export_cache = ResultCache(max_entries=16, max_bytes=256 * 1024 ** 2)
+
+def memoize(result_cache):
+    # Memoizes a function of dataframes per (function, cache_key, parameters). cache_key is passed by the caller and
+    # identifies the data in the frame arguments, e.g. the upload hashes and filters of the results they come from
+    # (see streamlit_app.get_results). Calls without one are not cached: hashing the frames would cost about as much
+    # as computing most results. Every call returns a copy (results like bytes are immutable), so a caller modifying
+    # the result does not change the cached value
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, cache_key=None, **kwargs):
+            if cache_key is None:
+                return func(*args, **kwargs)
+            key = (func.__module__, func.__qualname__, cache_key, freeze(args), freeze(tuple(sorted(kwargs.items()))))
+            result = result_cache.get(key)
+            if result is None:
+                result = func(*args, **kwargs)
+                result_cache.put(key, result)
+            return result.copy() if hasattr(result, 'copy') else result
+        return wrapper
+    return decorator
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import utils
+import data
+import visualization_data as viz_data
+
+# Currency attribution for books holding instruments in several currencies, from daily FX rates.
+#
+# The FX rates give the base currency price of one unit of each currency, so the currency return of day t is
+# rate_t / rate_t-1 - 1 (currencies without rates, i.e. the base currency, return zero). Every instrument return r
+# splits into its local return l = (1 + r) / (1 + c) - 1 and its currency part r - l = c * (1 + l). Multi-industry
+# splits earn the benchmark return of their sector as local return plus the currency return of the instrument.
+#
+# The benchmark sheets have no currency information. With optional benchmark currency weights the benchmark sector
+# returns are turned into local returns with the benchmark's currency return c_b = sum(w_b,k * c_k), without them the
+# benchmark is taken to be in the base currency (c_b = 0).
+#
+# Allocation and selection are then the usual Brinson effects on the local returns, and per currency k
+#   Currency Allocation Effect  = (w_p,k - w_b,k) * (c_k - c_b)
+#   Currency Interaction Effect = sum over the instruments i in k of w_i * c_k * l_i - w_b,k * c_b * R_b,local
+# With weights adding up to one, the four effects add up to the excess return in the base currency.
+#
+# Currency returns and exposures are dense date x currency arrays, the instruments are gathered from and summed into
+# them by integer position, so the currency dimension costs O(instruments x days) on top of the regular pipeline.
+#
+# The "FX Rates" and "Benchmark Currency Weights" sheets are optional sheets of data.read_performance_data, parsed in
+# the same pass as the other sheets into the 'fx_rates' and 'benchmark_currency_weights' frames.
+
+CURRENCY_EFFECT_COLUMNS = ['Currency Allocation Effect', 'Currency Interaction Effect']
+
+def get_positions(df, dates, currencies):
+    # Date and currency position of every row, -1 where the row has no currency
+    return dates.get_indexer(df['Date']), currencies.get_indexer(df['Ccy'].astype(object))
+
+def to_dense(df, value_column, dates, currencies):
+    matrix = np.zeros((len(dates), len(currencies)))
+    date_codes, currency_codes = get_positions(df, dates, currencies)
+    valid = (date_codes >= 0) & (currency_codes >= 0)
+    np.add.at(matrix, (date_codes[valid], currency_codes[valid]), np.nan_to_num(df[value_column].values[valid].astype(float)))
+    return matrix
+
+def gather(matrix, date_codes, currency_codes):
+    # Value of every row's date and currency, zero for rows without a currency
+    valid = currency_codes >= 0
+    return np.where(valid, matrix[date_codes, np.where(valid, currency_codes, 0)], 0.0)
+
+def currency_return_matrix(fx_rates, dates, currencies):
+    # Dates x currencies returns. Rates are carried forward over dates without a quote
+    rates = fx_rates.assign(Ccy=fx_rates['Ccy'].astype(str)).pivot_table(index='Date', columns='Ccy', values='Rate', aggfunc='last')
+    rates = rates.reindex(rates.index.union(dates)).ffill().reindex(index=dates, columns=currencies).values
+
+    returns = np.zeros(rates.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = rates[1:] / rates[:-1] - 1
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+def get_currency_attribution_data(prepared, sectors=None):
+    # Returns (combined_df, daily_level_data, currency_df). combined_df holds the local Brinson effects per sector.
+    # daily_level_data has the base currency returns in the weighted return columns, the local ones in 'Portfolio
+    # Local Return' and 'Benchmark Local Return', and all four effects in 'Sum of Effects'. currency_df has one row
+    # per date and currency held by the portfolio or the benchmark
+    dates = pd.DatetimeIndex(np.sort(pd.unique(pd.concat([prepared[name]['Date'] for name in ('portfolio_returns', 'benchmark_returns')]))))
+    currency_frames = [prepared[name]['Ccy'] for name in ('portfolio_returns', 'fx_rates', 'benchmark_currency_weights') if name in prepared]
+    currencies = pd.Index(sorted(pd.unique(pd.concat(currency_frames).dropna().astype(str))))
+    currency_returns = currency_return_matrix(prepared['fx_rates'], dates, currencies)
+
+    # Benchmark currency weights are lagged by one date like the sector weights
+    benchmark_weights = np.zeros((len(dates), len(currencies)))
+    if 'benchmark_currency_weights' in prepared:
+        benchmark_weights[1:] = to_dense(prepared['benchmark_currency_weights'], 'Weight', dates, currencies)[:-1]
+    benchmark_currency_return = (benchmark_weights * currency_returns).sum(axis=1)
+
+    # Local returns of the instruments and the benchmark sectors
+    returns = prepared['portfolio_returns']
+    row_currency_return = gather(currency_returns, *get_positions(returns, dates, currencies))
+    local = dict(prepared, portfolio_returns=returns.assign(Return=(1 + returns['Return'].values) / (1 + row_currency_return) - 1))
+
+    benchmark_df = data.get_benchmark_data(prepared)
+    benchmark_df['Return'] = (1 + benchmark_df['Return'].values) / (1 + benchmark_currency_return[dates.get_indexer(benchmark_df['Date'])]) - 1
+    benchmark_df['Weighted Returns'] = data.calculate_weighted_returns(benchmark_df)
+    benchmark_local_return = np.bincount(dates.get_indexer(benchmark_df['Date']), np.nan_to_num(benchmark_df['Weighted Returns'].values.astype(float)), len(dates))
+
+    # Brinson effects on the local returns, as in data.get_attribution_data
+    security_df = data.get_security_level_portfolio_data(local, benchmark_df)
+    portfolio_df = data.transform_to_sector_level_returns(security_df.copy())
+    portfolio_df['Date'] = utils.return_datetime_column(portfolio_df['Date'])
+    combined_df = data.combine_portfolio_and_benchmark_data(portfolio_df, benchmark_df)
+    combined_df = data.get_attribution_effects(data.clean_combined_data(combined_df))
+
+    # Currency exposures of the positions in the selected sectors, the benchmark is kept whole as for the sector filter
+    if sectors is not None:
+        combined_df = combined_df[combined_df['GICS Sector'].isin(sectors)].reset_index(drop=True)
+        security_df = security_df[security_df['GICS Sector'].isin(sectors)]
+    date_codes, currency_codes = get_positions(security_df, dates, currencies)
+    valid = currency_codes >= 0
+    weight = np.nan_to_num(security_df['Weight'].values.astype(float))
+    local_return = np.nan_to_num(security_df['Return'].values.astype(float))
+
+    portfolio_weights = np.zeros((len(dates), len(currencies)))
+    np.add.at(portfolio_weights, (date_codes[valid], currency_codes[valid]), weight[valid])
+    portfolio_cross = np.zeros((len(dates), len(currencies)))
+    np.add.at(portfolio_cross, (date_codes[valid], currency_codes[valid]),
+              (weight * gather(currency_returns, date_codes, currency_codes) * local_return)[valid])
+
+    allocation = (portfolio_weights - benchmark_weights) * (currency_returns - benchmark_currency_return[:, None])
+    interaction = portfolio_cross - benchmark_weights * (benchmark_currency_return * benchmark_local_return)[:, None]
+
+    held_dates, held_currencies = np.nonzero((portfolio_weights != 0) | (benchmark_weights != 0))
+    currency_df = pd.DataFrame({
+        'Date': dates[held_dates],
+        'Ccy': currencies[held_currencies],
+        'Portfolio Weight': portfolio_weights[held_dates, held_currencies],
+        'Benchmark Weight': benchmark_weights[held_dates, held_currencies],
+        'Currency Return': currency_returns[held_dates, held_currencies],
+        'Currency Allocation Effect': allocation[held_dates, held_currencies],
+        'Currency Interaction Effect': interaction[held_dates, held_currencies],
+    })
+
+    combined_df = data.expand_dtypes(combined_df)
+    daily_level_data = data.get_daily_level_data(combined_df)
+    rows = dates.get_indexer(daily_level_data.index)
+    daily_level_data['Portfolio Local Return'] = daily_level_data['Portfolio Weighted Returns']
+    daily_level_data['Benchmark Local Return'] = daily_level_data['Benchmark Weighted Returns']
+    daily_level_data['Currency Allocation Effect'] = allocation.sum(axis=1)[rows]
+    daily_level_data['Currency Interaction Effect'] = interaction.sum(axis=1)[rows]
+    daily_level_data['Sum of Effects'] += daily_level_data['Currency Allocation Effect'] + daily_level_data['Currency Interaction Effect']
+
+    # Base currency returns: the portfolio adds the currency part c * (1 + l) of every position
+    daily_level_data['Portfolio Weighted Returns'] += ((portfolio_weights * currency_returns).sum(axis=1) + portfolio_cross.sum(axis=1))[rows]
+    daily_level_data['Benchmark Weighted Returns'] = (1 + daily_level_data['Benchmark Local Return']) * (1 + benchmark_currency_return[rows]) - 1
+    daily_level_data['Excess Return'] = daily_level_data['Portfolio Weighted Returns'] - daily_level_data['Benchmark Weighted Returns']
+
+    return combined_df, daily_level_data, currency_df
+
+def get_compounded_currency_effects(currency_df):
+    # Currency effects compounded over the period per currency, as get_compounded_sector_effects does per sector
+    return viz_data.get_last_compounded_effects(currency_df, CURRENCY_EFFECT_COLUMNS, group_by='Ccy').reset_index()
+
+def get_currency_attribution(performance_data, fx_rates=None, store=None, start_date=None, end_date=None, sectors=None):
+    # Like data.get_data in currency mode. fx_rates is a long format frame (Date, Ccy, Rate), read from the "FX Rates"
+    # sheet of the workbook when not given
+    prepared = data.load_prepared_data(performance_data, store, start_date, end_date, sectors)
+    if fx_rates is not None:
+        prepared = dict(prepared, **data.filter_prepared_data({'fx_rates': fx_rates}, start_date, end_date))
+    elif 'fx_rates' not in prepared:
+        raise ValueError(f'The workbook has no "{data.FX_SHEET_NAME}" sheet')
+    return get_currency_attribution_data(prepared, sectors)
@@ -1,12 +1,339 @@
+import datetime as dt
+import numpy as np
 import pandas as pd
 import utils
+import cache
 import attribution as attr
+import array_engine
+import profiling
+
+PORTFOLIO_SHEET_NAMES = ["Portfolio Weights", "Portfolio Returns", "Multi-Industry Weights"]
+BENCHMARK_SHEET_NAMES = ["Benchmark Weights", "Benchmark Returns"]
+SHEET_NAMES = ["Portfolio Weights", "Portfolio Returns", "Benchmark Weights", "Benchmark Returns", "Multi-Industry Weights"]
+
+# Optional sheets of the other modes, parsed in the same pass as the pipeline sheets when the workbook has them and
+# kept with the prepared frames (and in the store): the classification levels of hierarchy.py, and the FX rates and
+# benchmark currency weights of currency.py
+CLASSIFICATION_SHEET_NAME = "Classification"
+FX_SHEET_NAME = "FX Rates"
+BENCHMARK_CURRENCY_SHEET_NAME = "Benchmark Currency Weights"
+OPTIONAL_SHEET_NAMES = [CLASSIFICATION_SHEET_NAME, FX_SHEET_NAME, BENCHMARK_CURRENCY_SHEET_NAME]
+
+PIPELINE_FRAME_NAMES = ['portfolio_weights', 'portfolio_returns', 'benchmark_weights', 'benchmark_returns', 'multi_industry_weights']
+
+# Version of the prepared frames, part of every store key. Bumped whenever the frames of a workbook change (version 2
+# added the classification, version 3 the currency sheets), so entries written by an older version are parsed again
+# and left to the eviction
+PREPARED_VERSION = 3
+
+#! ---------------------------- Workbook loading ----------------------------
+
+@profiling.profiled
+def read_performance_data(performance_data, sheet_names=SHEET_NAMES, start_date=None, end_date=None, sectors=None,
+                          optional_sheet_names=OPTIONAL_SHEET_NAMES):
+    # Open the workbook once and parse every sheet the pipeline needs in a single pass, together with the optional
+    # sheets the workbook has. Returns a dict of sheet name -> raw dataframe that the prepare_* functions consume
+    if start_date is None and end_date is None and sectors is None:
+        with pd.ExcelFile(performance_data) as workbook:
+            optional = [sheet_name for sheet_name in optional_sheet_names if sheet_name in workbook.sheet_names]
+            return pd.read_excel(workbook, sheet_name=list(sheet_names) + optional)
+    return read_filtered_sheets(performance_data, sheet_names, start_date, end_date, sectors, optional_sheet_names)
+
+@profiling.profiled
+def prepare_performance_data(sheets):
+    # Normalize every raw sheet into the long format frames used by the rest of the pipeline
+    prepare_functions = {
+        "Portfolio Weights": ('portfolio_weights', prepare_portfolio_weights),
+        "Portfolio Returns": ('portfolio_returns', prepare_portfolio_returns),
+        "Benchmark Weights": ('benchmark_weights', prepare_benchmark_weights),
+        "Benchmark Returns": ('benchmark_returns', prepare_benchmark_returns),
+        "Multi-Industry Weights": ('multi_industry_weights', prepare_multi_industry_weights),
+        CLASSIFICATION_SHEET_NAME: ('classification', prepare_classification),
+        FX_SHEET_NAME: ('fx_rates', lambda sheet: prepare_currency_sheet(sheet, 'Rate')),
+        BENCHMARK_CURRENCY_SHEET_NAME: ('benchmark_currency_weights', lambda sheet: prepare_currency_sheet(sheet, 'Weight')),
+    }
+
+    return {name: prepare(sheets[sheet_name]) for sheet_name, (name, prepare) in prepare_functions.items() if sheet_name in sheets}
+
+@profiling.profiled
+def load_prepared_data(performance_data, store=None, start_date=None, end_date=None, sectors=None, compact=False, key=None):
+    # Without a store the workbook is always parsed, only the selected dates and sectors when a filter is given.
+    # With one, the full prepared frames are looked up by workbook hash and the filter is applied to them, so the
+    # Excel parse only happens on the first load of a given file. key is that hash when the caller already has it.
+    # compact=True returns compact_prepared_data frames
+    if store is None:
+        prepared = prepare_performance_data(read_performance_data(performance_data, start_date=start_date, end_date=end_date, sectors=sectors))
+    else:
+        key = store_key(key or cache.hash_bytes(utils.read_file_bytes(performance_data)))
+        prepared = store.get(key)
+        if prepared is None:
+            prepared = prepare_performance_data(read_performance_data(performance_data))
+            store.put(key, prepared)
+        prepared = filter_prepared_data(prepared, start_date, end_date, sectors)
+
+    return compact_prepared_data(prepared) if compact else prepared
+
+def store_key(content_hash):
+    return f"{content_hash}-v{PREPARED_VERSION}"
+
+def prepare_classification(classification):
+    # One column per level, from the lowest to the highest, see hierarchy.py
+    return classification.dropna(how='all').reset_index(drop=True)
+
+def prepare_currency_sheet(sheet, value_name):
+    # Sheets with a date column and one column per currency, like the benchmark sheets, see currency.py
+    df = sheet.rename(columns={sheet.columns[0]: 'Date'}).melt(id_vars=['Date'], var_name='Ccy', value_name=value_name)
+    if not pd.api.types.is_datetime64_any_dtype(df['Date']):
+        df['Date'] = utils.return_datetime_column(df['Date'])
+    df[value_name] = pd.to_numeric(df[value_name])
+    return df.dropna(subset=[value_name]).reset_index(drop=True)
+
+#! ---------------------------- Date and sector filters ----------------------------
+
+# A date window keeps the dates from start_date to end_date plus the last date before start_date. That base date is
+# needed to lag the weights into the first day of the window, and since it has no lagged weights of its own it comes
+# out of the pipeline with zero returns and effects, just like the first day of a full run. The compounded returns
+# and the Carino linking therefore start from zero at the base date and cover exactly the selected window.
+#
+# A sector filter keeps the portfolio instruments of the selected sectors and all multi-industry instruments, whose
+# other sector parts are dropped. The benchmark is always kept whole because the allocation effect of every sector
+# needs the total benchmark return. Effects of the selected sectors are the same as in a full run, the portfolio
+# daily totals only cover the selected sectors.
+
+def parse_sheet_date(value):
+    # Date cells come either as 'day.month.year' strings or as real Excel dates
+    if isinstance(value, (dt.date, pd.Timestamp)):
+        return pd.Timestamp(value)
+    try:
+        return pd.Timestamp(dt.datetime.strptime(value, '%d.%m.%Y'))
+    except (ValueError, TypeError):
+        return None
+
+def select_window_dates(dates, start_date=None, end_date=None):
+    # Boolean mask of the dates to keep, see above. dates is anything pd.Series accepts
+    dates = pd.Series(dates)
+    keep = pd.Series(True, index=dates.index)
+    if end_date is not None:
+        keep &= dates <= pd.Timestamp(end_date)
+    if start_date is not None:
+        before = dates < pd.Timestamp(start_date)
+        keep &= ~before | (dates == dates[before].max())
+    return keep.values
+
+def read_sheet_window(worksheet, start_date=None, end_date=None, select_columns=None):
+    # Streams the rows of one sheet and keeps only the header rows and the date rows of the window. Rows are in date
+    # order (the weight lags rely on it as well), so reading stops at the first date after end_date.
+    # select_columns(header_rows) returns the indices of the columns to keep, given the rows above the first date
+    rows = iter(worksheet.iter_rows(values_only=True))
+    header_rows, date_rows, base_row, columns = [next(rows)], [], None, None
+    start = pd.Timestamp(start_date) if start_date is not None else None
+    end = pd.Timestamp(end_date) if end_date is not None else None
+
+    for row in rows:
+        if all(value is None for value in row):
+            continue
+        date = parse_sheet_date(row[0])
+        if date is None:
+            header_rows.append(row)
+            continue
+        if columns is None:
+            columns = select_columns(header_rows) if select_columns is not None else list(range(len(header_rows[0])))
+        if end is not None and date > end:
+            break
+        row = [row[i] if i < len(row) else None for i in columns]
+        if start is not None and date < start:
+            base_row = row
+            continue
+        if base_row is not None:
+            date_rows.append(base_row)
+            base_row = None
+        date_rows.append(row)
+
+    if columns is None:
+        columns = select_columns(header_rows) if select_columns is not None else list(range(len(header_rows[0])))
+    # Only dates before the window: keep the base date so the frame still has the expected layout
+    if base_row is not None:
+        date_rows.append(base_row)
+
+    rows = [[row[i] if i < len(row) else None for i in columns] for row in header_rows[1:]] + date_rows
+    return pd.DataFrame(rows, columns=[header_rows[0][i] for i in columns])
+
+def sheet_frame(header_rows, date_rows):
+    # Frame in the layout pd.read_excel gives the sheet: the first row as column names, then the other rows
+    width = len(header_rows[0])
+    rows = [[row[i] if i < len(row) else None for i in range(width)] for row in header_rows[1:] + date_rows]
+    return pd.DataFrame(rows, columns=list(header_rows[0]))
+
+def iter_sheet_blocks(worksheet, end_dates):
+    # Streams the rows of one sheet as one frame per block of dates, up to each of the sorted end_dates in turn. Every
+    # frame has the header rows and the same layout as the whole sheet, so the prepare_* functions take it as it is.
+    # Exactly one frame is yielded per end date, rows after the last one are not read
+    rows = iter(worksheet.iter_rows(values_only=True))
+    header_rows, pending = [next(rows)], None
+
+    for end in end_dates:
+        date_rows = []
+        if pending is not None and pending[0] <= end:
+            date_rows.append(pending[1])
+            pending = None
+        if pending is None:
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                date = parse_sheet_date(row[0])
+                if date is None:
+                    header_rows.append(row)
+                elif date > end:
+                    pending = (date, row)
+                    break
+                else:
+                    date_rows.append(row)
+        yield sheet_frame(header_rows, date_rows)
+
+def portfolio_column_selector(sectors, multi_industry_instruments):
+    # Columns of a portfolio sheet to keep: the row labels, the instruments of the selected sectors and the
+    # multi-industry instruments, and the last column that prepare_portfolio_* drops
+    def select_columns(header_rows):
+        instruments = header_rows[0]
+        sector_row = next((row for row in header_rows[1:] if row[0] == 'Sector 1'), None)
+        if sectors is None or sector_row is None:
+            return list(range(len(instruments)))
+        return [i for i in range(len(instruments))
+                if i == 0 or i == len(instruments) - 1 or sector_row[i] in sectors or instruments[i] in multi_industry_instruments]
+    return select_columns
+
+def read_filtered_sheets(performance_data, sheet_names, start_date=None, end_date=None, sectors=None, optional_sheet_names=()):
+    # Same result as read_performance_data followed by filter_prepared_data, without building the rows and columns
+    # outside the filter. openpyxl is the engine pandas uses for xlsx files as well
+    import openpyxl
+
+    if hasattr(performance_data, 'seek'):
+        performance_data.seek(0)
+    workbook = openpyxl.load_workbook(performance_data, read_only=True, data_only=True)
+    try:
+        sheets = {}
+        # The multi-industry mapping is needed first to know which portfolio columns to keep
+        if "Multi-Industry Weights" in sheet_names:
+            sheets["Multi-Industry Weights"] = read_sheet_window(workbook["Multi-Industry Weights"])
+        multi_industry_instruments = set(sheets["Multi-Industry Weights"].iloc[:, 0]) if "Multi-Industry Weights" in sheets else set()
+
+        for sheet_name in sheet_names:
+            if sheet_name in sheets:
+                continue
+            select_columns = portfolio_column_selector(sectors, multi_industry_instruments) if sheet_name in PORTFOLIO_SHEET_NAMES else None
+            sheets[sheet_name] = read_sheet_window(workbook[sheet_name], start_date, end_date, select_columns)
+        for sheet_name in optional_sheet_names:
+            if sheet_name in workbook.sheetnames:
+                sheets[sheet_name] = read_sheet_window(workbook[sheet_name], start_date, end_date)
+    finally:
+        workbook.close()
+
+    if "Multi-Industry Weights" in sheets and sectors is not None:
+        mapping = sheets["Multi-Industry Weights"]
+        sheets["Multi-Industry Weights"] = mapping[[mapping.columns[0]] + [column for column in mapping.columns[1:] if column in sectors]]
+
+    return sheets
+
+def get_bounds(prepared):
+    # Dates and sectors the filters can select from: the benchmark dates, and the benchmark sectors together with the
+    # sectors of the portfolio instruments, multi-industry instruments counting with the sectors of their mapping.
+    # Only the 'Instrument' and 'Sector 1' columns of the portfolio weights are used
+    mapping, portfolio = prepared['multi_industry_weights'], prepared['portfolio_weights']
+    single_industry = portfolio.loc[~portfolio['Instrument'].isin(mapping['Instrument']), 'Sector 1']
+    sectors = pd.concat([prepared['benchmark_returns']['GICS Sector'], mapping['GICS Sector'], single_industry]).dropna().unique()
+    return pd.DatetimeIndex(np.sort(prepared['benchmark_returns']['Date'].unique())), sorted(sectors)
+
+def read_workbook_bounds(performance_data):
+    # get_bounds of a workbook without parsing its portfolio date rows: the benchmark returns and the multi-industry
+    # mapping are small, of the portfolio weights only the rows above the first date are read
+    import openpyxl
+
+    if hasattr(performance_data, 'seek'):
+        performance_data.seek(0)
+    workbook = openpyxl.load_workbook(performance_data, read_only=True, data_only=True)
+    try:
+        prepared = prepare_performance_data({sheet_name: read_sheet_window(workbook[sheet_name])
+                                              for sheet_name in ["Benchmark Returns", "Multi-Industry Weights"]})
+        rows = workbook["Portfolio Weights"].iter_rows(values_only=True)
+        instruments = next(rows)
+        sector_row = next((row for row in rows if row[0] == 'Sector 1' or parse_sheet_date(row[0]) is not None), None)
+    finally:
+        workbook.close()
+
+    # The last column is the total that prepare_portfolio_weights drops
+    sectors = sector_row[1:len(instruments) - 1] if sector_row is not None and sector_row[0] == 'Sector 1' else []
+    prepared['portfolio_weights'] = pd.DataFrame({'Instrument': instruments[1:1 + len(sectors)], 'Sector 1': sectors})
+    return get_bounds(prepared)
+
+@profiling.profiled
+def filter_prepared_data(prepared, start_date=None, end_date=None, sectors=None):
+    # The same filter on frames that are already prepared, e.g. from the store or CSV / Parquet files
+    if start_date is None and end_date is None and sectors is None:
+        return prepared
+
+    filtered = {}
+    for name, df in prepared.items():
+        if 'Date' in df and (start_date is not None or end_date is not None):
+            dates = pd.Series(df['Date'].unique())
+            df = df[df['Date'].isin(dates[select_window_dates(dates, start_date, end_date)])]
+        if sectors is not None and name in ('portfolio_weights', 'portfolio_returns'):
+            df = df[df['Sector 1'].isin(sectors) | df['Instrument'].isin(prepared['multi_industry_weights']['Instrument'])]
+        if sectors is not None and name == 'multi_industry_weights':
+            df = df[df['GICS Sector'].isin(sectors)]
+        filtered[name] = df.reset_index(drop=True)
+
+    return filtered
+
+#! ---------------------------- Compact dtypes ----------------------------
+
+# Memory efficient mode: the string keys become categoricals and the values float32. All frames share one set of
+# categories per key, so merges and groupbys work on integer codes and the keys stay categorical through every step.
+# The outputs of get_attribution_data are converted back to the usual dtypes, the compact frames stay internal.
+
+FLOAT_COLUMNS = ['Weight', 'Return', 'BM Weight']
+
+@profiling.profiled
+def compact_prepared_data(prepared, float_dtype='float32'):
+    portfolio_frames = [prepared[name] for name in ('portfolio_weights', 'portfolio_returns') if name in prepared]
+    sector_values = [df['Sector 1'] for df in portfolio_frames]
+    sector_values += [prepared[name]['GICS Sector'] for name in ('benchmark_weights', 'benchmark_returns', 'multi_industry_weights') if name in prepared]
+    instrument_values = [df['Instrument'] for df in portfolio_frames]
+
+    # Multi-industry instruments are split into 'Instrument - GICS Sector' rows, those names are categories as well
+    if 'multi_industry_weights' in prepared:
+        mapping = prepared['multi_industry_weights']
+        instrument_values += [mapping['Instrument'], (mapping['Instrument'].astype(str) + ' - ' + mapping['GICS Sector'].astype(str))]
+
+    def category_dtype(values):
+        # Unique values of each column, rather than of a concatenated copy of all of them
+        uniques = set().union(*(pd.unique(column) for column in values))
+        return pd.CategoricalDtype(sorted(value for value in uniques if pd.notna(value)))
+
+    dtypes = {'Instrument': category_dtype(instrument_values), 'Sector 1': category_dtype(sector_values)}
+    dtypes['GICS Sector'] = dtypes['Sector 1']
+    for column in ('Instr. Type', 'Ccy'):
+        if portfolio_frames:
+            dtypes[column] = category_dtype([df[column] for df in portfolio_frames])
+
+    # The frames of the optional sheets have columns of their own and are kept as they are
+    compact = {}
+    for name, df in prepared.items():
+        if name not in PIPELINE_FRAME_NAMES:
+            compact[name] = df
+            continue
+        compact[name] = df.astype({column: dtype for column, dtype in dtypes.items() if column in df}
+                                  | {column: float_dtype for column in FLOAT_COLUMNS if column in df})
+    return compact
+
+def expand_dtypes(df):
+    # Categorical keys back to strings and float32 values back to float64
+    dtypes = {column: object if isinstance(dtype, pd.CategoricalDtype) else 'float64'
+              for column, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype) or dtype == 'float32'}
+    return df.astype(dtypes) if dtypes else df
 
 #! ---------------------------- Portfolio data functions ----------------------------
 
-def prepare_portfolio_weights(performance_data):
-    portfolio_weights = pd.read_excel(performance_data, sheet_name="Portfolio Weights")
-
+def prepare_portfolio_weights(portfolio_weights):
     # Transpose the data frame and reset the index
     df_transposed = portfolio_weights.set_index('Instrument').T
     df_transposed.reset_index(inplace=True)
@@ -18,88 +345,143 @@ def prepare_portfolio_weights(performance_data):
     # Reshape the data frame
     portofolio_weights = df_transposed.melt(id_vars=['Instrument', 'Instr. Type', 'Sector 1', 'Ccy'], var_name='Date', value_name='Weight')
     portofolio_weights['Date'] = pd.to_datetime(portofolio_weights['Date'], format='%d.%m.%Y')
+    portofolio_weights['Weight'] = pd.to_numeric(portofolio_weights['Weight'])
 
     return portofolio_weights
 
-def prepare_portfolio_returns(performance_data): 
-    portfolio_returns = pd.read_excel(performance_data, sheet_name="Portfolio Returns")
-
+def prepare_portfolio_returns(portfolio_returns): 
     df_transposed = portfolio_returns.set_index('Instrument').T
     df_transposed.reset_index(inplace=True)
     df_transposed.rename(columns={df_transposed.columns[0]: "Instrument"}, inplace=True)
     df_transposed = df_transposed.iloc[:-1]
     return_df = df_transposed.melt(id_vars=['Instrument', 'Instr. Type', 'Sector 1', 'Ccy'], var_name='Date', value_name='Return')
     return_df['Date'] = pd.to_datetime(return_df['Date'], format='%d.%m.%Y')
+    return_df['Return'] = pd.to_numeric(return_df['Return'])
 
     return return_df
 
+@profiling.profiled
 def combine_portfolio_data(portfolio_weights, portfolio_returns):
     portfolio_df = (pd.merge(portfolio_weights, portfolio_returns, on=['Instrument', 'Instr. Type', 'Sector 1', 'Ccy', 'Date'], how='inner')
                     .rename(columns={'Sector 1': 'GICS Sector'}))
     
     return portfolio_df
 
+@profiling.profiled
 def lag_portfolio_weights(df):
     # Lag the portfolio weights by one day for each instrument
-    df['Weight'] = df.groupby('Instrument')['Weight'].shift(1)
+    df['Weight'] = df.groupby('Instrument', observed=True)['Weight'].shift(1)
     return df
 
 # Function that turns security level daily returns to GICS Sector level daily returns
+@profiling.profiled
 def transform_to_sector_level_returns(portfolio_df):
     portfolio_df.drop(columns=['Instrument', 'Instr. Type', 'Ccy'], inplace=True)
-    sector_returns = portfolio_df.groupby(['Date', 'GICS Sector']).sum()
+    sector_returns = portfolio_df.groupby(['Date', 'GICS Sector'], observed=True).sum()
     sector_returns = sector_returns.reset_index()
 
     return sector_returns
 
 # Function that returns daily sector weights
 def calculate_daily_sector_weights(df):
-    sector_weights = df.groupby(['Date', 'GICS Sector'])['Weight'].sum()
+    sector_weights = df.groupby(['Date', 'GICS Sector'], observed=True)['Weight'].sum()
     sector_weights = sector_weights.reset_index()
 
     return sector_weights
 
-def handle_multi_industry_assets(portfolio_df, performance_data, benchmark_df):
-    # Prepare multi_ind dataframe
-    multi_ind_df = pd.read_excel(performance_data, sheet_name="Multi-Industry Weights")
-    multi_ind_df.rename(columns={multi_ind_df.columns[0]: "Instrument"}, inplace=True)
+def prepare_multi_industry_weights(multi_ind_df):
+    multi_ind_df = multi_ind_df.rename(columns={multi_ind_df.columns[0]: "Instrument"})
     multi_ind_df = multi_ind_df.melt(id_vars=['Instrument'], var_name='GICS Sector', value_name='BM Weight')
-    # Create new column that connects Instrument and GICS Sector columns
-    multi_ind_df['Instrument_GICS'] = multi_ind_df['Instrument'] + ' - ' + multi_ind_df['GICS Sector']
-
-    multi_ind_df = multi_ind_df.merge(portfolio_df, on=['Instrument'], how='inner', suffixes=('', '_Portfolio'))
-    multi_ind_df['New Weights'] = multi_ind_df['Weight'] * multi_ind_df['BM Weight']
-
-    # Store the original instrument names to be deleted later
-    original_instruments = multi_ind_df['Instrument'].unique()
 
-    # Drop unecessary columns
-    multi_ind_df.drop(columns=['Instrument', 'BM Weight', 'Weight', 'Return', 'GICS Sector_Portfolio'], inplace=True)
-    multi_ind_df = multi_ind_df.merge(benchmark_df, on=['Date', 'GICS Sector'], how='inner')
-    multi_ind_df = (multi_ind_df.drop(columns=['Weight', 'Weighted Returns'])
-                 .rename(columns={'New Weights': 'Weight', 'Instrument_GICS':'Instrument'}))
-
-    # Delete the original tickers from portfolio_df and then concat multi_ind_df to it
-    portfolio_df = portfolio_df[portfolio_df['Instrument'].isin(original_instruments) == False]
-    new_portfolio_df = pd.concat([portfolio_df, multi_ind_df]).sort_values(by=['Date', 'GICS Sector'], ignore_index=True)
+    return multi_ind_df
+
+@profiling.profiled
+def handle_multi_industry_assets(portfolio_df, multi_ind_df, benchmark_df):
+    # Replaces every multi-industry instrument with one 'Instrument - GICS Sector' row per sector of the mapping, weighted
+    # by the instrument's weight times the sector's BM Weight and earning the benchmark return of the sector.
+    #
+    # The mapping is applied as a sparse instrument x split matrix with a single entry per split column, so multiplying
+    # the instrument rows with it comes down to gathering each instrument's rows once per split and scaling them. All of
+    # it runs on integer positions and codes instead of merges on the string keys. Split rows are generated split by
+    # split, in the order the previous merge based implementation produced them, and splits on dates without a
+    # benchmark row are dropped
+    is_multi = portfolio_df['Instrument'].isin(multi_ind_df['Instrument']).values
+    if not is_multi.any():
+        return portfolio_df.sort_values(by=['Date', 'GICS Sector'], ignore_index=True)
+    portfolio_rest = portfolio_df[~is_multi]
+
+    # Rows of each multi-industry instrument in portfolio order, as offsets into a grouped index
+    multi_rows = np.flatnonzero(is_multi)
+    instruments = pd.Index(pd.unique(multi_ind_df['Instrument']))
+    row_codes = instruments.get_indexer(portfolio_df['Instrument'].values[multi_rows])
+    grouped_rows = multi_rows[np.argsort(row_codes, kind='stable')]
+    counts = np.bincount(row_codes, minlength=len(instruments))
+    offsets = np.cumsum(counts) - counts
+
+    # Split columns of the matrix: instrument, sector and BM Weight of every mapping row
+    split_codes = instruments.get_indexer(multi_ind_df['Instrument'])
+    lengths = counts[split_codes]
+    split_of_row = np.repeat(np.arange(len(multi_ind_df)), lengths)
+    position = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    source_rows = grouped_rows[offsets[split_codes][split_of_row] + position]
+
+    # Sector codes in sorted order, from the small frames plus one pass over the remaining portfolio rows
+    rest_codes, rest_sectors = pd.factorize(portfolio_rest['GICS Sector'], sort=True)
+    sectors = pd.Index(sorted(set(rest_sectors) | set(multi_ind_df['GICS Sector'].dropna()) | set(benchmark_df['GICS Sector'].dropna())))
+    rest_sector_codes = np.append(sectors.get_indexer(rest_sectors), len(sectors))[rest_codes]
+    split_sector_codes = sectors.get_indexer(multi_ind_df['GICS Sector'])[split_of_row]
+
+    # Benchmark row of every split, looked up in a dense date x sector table of benchmark row positions
+    benchmark_dates = pd.Index(pd.unique(benchmark_df['Date']))
+    benchmark_table = np.full((len(benchmark_dates) + 1, len(sectors) + 1), -1)
+    benchmark_table[benchmark_dates.get_indexer(benchmark_df['Date']), sectors.get_indexer(benchmark_df['GICS Sector'])] = np.arange(len(benchmark_df))
+    benchmark_rows = benchmark_table[benchmark_dates.get_indexer(portfolio_df['Date'].values[source_rows]), split_sector_codes]
+    has_benchmark = benchmark_rows >= 0
+    source_rows, split_of_row, benchmark_rows = source_rows[has_benchmark], split_of_row[has_benchmark], benchmark_rows[has_benchmark]
+    split_sector_codes = split_sector_codes[has_benchmark]
+
+    # In compact mode the split names are already categories of the Instrument column (see compact_prepared_data)
+    split_names = multi_ind_df['Instrument'].astype(str) + ' - ' + multi_ind_df['GICS Sector'].astype(str)
+    if isinstance(multi_ind_df['Instrument'].dtype, pd.CategoricalDtype):
+        split_names = split_names.astype(multi_ind_df['Instrument'].dtype)
+
+    split_columns = {
+        'Instrument': split_names.array.take(split_of_row),
+        'GICS Sector': multi_ind_df['GICS Sector'].array.take(split_of_row),
+        'Weight': portfolio_df['Weight'].values[source_rows] * multi_ind_df['BM Weight'].values[split_of_row],
+        'Return': benchmark_df['Return'].values[benchmark_rows],
+    }
+    split_df = pd.DataFrame({column: split_columns[column] if column in split_columns else portfolio_df[column].array.take(source_rows)
+                             for column in portfolio_df.columns})
+
+    # Delete the original tickers from portfolio_df and add the split rows. Stable sort by date and sector, missing
+    # values last, which is the order of sort_values(by=['Date', 'GICS Sector'])
+    new_portfolio_df = pd.concat([portfolio_rest, split_df], ignore_index=True)
+    dates = new_portfolio_df['Date'].values.view('i8').copy()
+    dates[new_portfolio_df['Date'].isna().values] = np.iinfo('i8').max
+    order = np.lexsort((np.concatenate([rest_sector_codes, split_sector_codes]), dates))
+
+    new_portfolio_df = new_portfolio_df.take(order)
+    new_portfolio_df.index = pd.RangeIndex(len(new_portfolio_df))
 
     return new_portfolio_df
 
-def get_portfolio_data(performance_data, benchmark_df):
-    # Call all the three functions above to get the portfolio data
-    portfolio_weights = prepare_portfolio_weights(performance_data)
-    portfolio_returns = prepare_portfolio_returns(performance_data)
-    portfolio_df = combine_portfolio_data(portfolio_weights, portfolio_returns)    
+@profiling.profiled
+def get_security_level_portfolio_data(prepared, benchmark_df):
+    # Instrument level daily rows with lagged weights and each instrument's contribution to its sector return
+    portfolio_df = combine_portfolio_data(prepared['portfolio_weights'], prepared['portfolio_returns'])
 
     # Handle multi-industry weights
-    portfolio_df = handle_multi_industry_assets(portfolio_df, performance_data, benchmark_df)
+    portfolio_df = handle_multi_industry_assets(portfolio_df, prepared['multi_industry_weights'], benchmark_df)
 
     portfolio_df = lag_portfolio_weights(portfolio_df)    
     portfolio_df['Weighted Returns'] = calculate_weighted_returns(portfolio_df)
     
     # Get sector level daily weights
-    sector_weights = calculate_daily_sector_weights(portfolio_df)
-    portfolio_df = portfolio_df.merge(sector_weights, on=['Date', 'GICS Sector'], how='left', suffixes=('', '_Sector'))
+    with profiling.stage('sector_weights_merge', portfolio_df) as record:
+        sector_weights = calculate_daily_sector_weights(portfolio_df)
+        portfolio_df = portfolio_df.merge(sector_weights, on=['Date', 'GICS Sector'], how='left', suffixes=('', '_Sector'))
+        record.set_output(portfolio_df)
 
     # Drop rows where Weight_Sector is 0
     portfolio_df = portfolio_df[portfolio_df['Weight_Sector'] != 0]
@@ -109,6 +491,22 @@ def get_portfolio_data(performance_data, benchmark_df):
     portfolio_df['Sector Return'] = portfolio_df['Asset Weight in Sector'] * portfolio_df['Return']
     portfolio_df.drop(columns=['Weight_Sector', 'Asset Weight in Sector'], inplace=True) # Columns no longer needed
 
+    return portfolio_df
+
+@profiling.profiled
+def get_portfolio_data(prepared, benchmark_df, level='sector', chunk_days=250):
+    # level='security' returns (sector_results, security_results) of the security level attribution instead, run
+    # over chunks of chunk_days dates with running totals (see security_attribution). prepared can then also be the
+    # workbook itself, which is streamed chunk by chunk without building the instrument x date frames
+    if level == 'security':
+        # Imported here, it builds on this module
+        import security_attribution
+        return security_attribution.get_security_attribution(prepared, chunk_days, benchmark_df)
+    if level != 'sector':
+        raise ValueError(f"Unknown attribution level: {level}")
+
+    portfolio_df = get_security_level_portfolio_data(prepared, benchmark_df)
+
     portfolio_df = transform_to_sector_level_returns(portfolio_df)
     portfolio_df['Date'] = utils.return_datetime_column(portfolio_df['Date'])
 
@@ -116,18 +514,16 @@ def get_portfolio_data(performance_data, benchmark_df):
 
 #! ---------------------------- Benchmark data functions ----------------------------
 
-def prepare_benchmark_weights(performance_data):
-    benchmark_weights = pd.read_excel(performance_data, sheet_name="Benchmark Weights")
-    benchmark_weights.rename(columns={benchmark_weights.columns[0]: "Date"}, inplace=True)
+def prepare_benchmark_weights(benchmark_weights):
+    benchmark_weights = benchmark_weights.rename(columns={benchmark_weights.columns[0]: "Date"})
     benchmark_weights = benchmark_weights.melt(id_vars=['Date'], var_name=['GICS Sector'], value_name='Weight')
 
     benchmark_weights['Date'] = pd.to_datetime(benchmark_weights['Date'], format='%d.%m.%Y')
 
     return benchmark_weights    
 
-def prepare_benchmark_returns(performance_data): 
-    benchmark_returns = pd.read_excel(performance_data, sheet_name="Benchmark Returns")
-    benchmark_returns.rename(columns={benchmark_returns.columns[0]: "Date"}, inplace=True)
+def prepare_benchmark_returns(benchmark_returns): 
+    benchmark_returns = benchmark_returns.rename(columns={benchmark_returns.columns[0]: "Date"})
 
     benchmark_returns = benchmark_returns.melt(id_vars=['Date'], var_name=['GICS Sector'],value_name='Return')
     benchmark_returns['Date'] = pd.to_datetime(benchmark_returns['Date'], format='%d.%m.%Y')
@@ -135,7 +531,7 @@ def prepare_benchmark_returns(performance_data):
 
 # Lagging benchmarkweights and calculating weighted returns
 def lag_benchmark_weights(df): 
-    df['Weight'] = df.groupby('GICS Sector')['Weight'].shift(1)
+    df['Weight'] = df.groupby('GICS Sector', observed=True)['Weight'].shift(1)
 
     return df
 
@@ -144,11 +540,9 @@ def combine_benchmark_data(benchmark_weights, benchmark_returns):
 
     return benchmark_df
 
-def get_benchmark_data(performance_data):
-    benchmark_weights = prepare_benchmark_weights(performance_data)
-    benchmark_returns = prepare_benchmark_returns(performance_data)
-    
-    benchmark_df = combine_benchmark_data(benchmark_weights, benchmark_returns)
+@profiling.profiled
+def get_benchmark_data(prepared):
+    benchmark_df = combine_benchmark_data(prepared['benchmark_weights'], prepared['benchmark_returns'])
         
     benchmark_df = lag_benchmark_weights(benchmark_df)
     benchmark_df['Weighted Returns'] = calculate_weighted_returns(benchmark_df)
@@ -158,18 +552,21 @@ def get_benchmark_data(performance_data):
 
 #! ---------------------------- Combined data functions ----------------------------
 
+@profiling.profiled
 def combine_portfolio_and_benchmark_data(portfolio_df, benchmark_df):
-    combined_df = (portfolio_df.merge(benchmark_df, on=['Date', 'GICS Sector'], how='outer', suffixes=('_Portfolio', '_Benchmark'))
-                   .sort_values(by=['Date', 'GICS Sector'], ignore_index=True)
-                    .fillna(0)
-                    .rename(columns={'Weight_Portfolio': 'Portfolio Weight',
-                                    'Weight_Benchmark': 'Benchmark Weight',
-                                    'Return_Portfolio': 'Portfolio Return',
-                                    'Return_Benchmark': 'Benchmark Return',
-                                    'Weighted Returns_Portfolio': 'Portfolio Weighted Returns',
-                                    'Weighted Returns_Benchmark': 'Benchmark Weighted Returns'}))
+    # The shared value columns are renamed on the inputs, which does not copy their data, and the merge result is
+    # sorted and filled in place, so no intermediate frame is kept alongside it. Sorting in the merge (sort=True) peaks
+    # higher on categorical keys. Only the values are filled, the keys can be categorical (see compact_prepared_data)
+    keys = ['Date', 'GICS Sector']
+    shared = [column for column in portfolio_df.columns if column in benchmark_df.columns and column not in keys]
+    combined_df = (portfolio_df.rename(columns={column: f'Portfolio {column}' for column in shared}, copy=False)
+                   .merge(benchmark_df.rename(columns={column: f'Benchmark {column}' for column in shared}, copy=False),
+                          on=keys, how='outer'))
+    combined_df.sort_values(by=keys, ignore_index=True, inplace=True)
+    combined_df.fillna({column: 0 for column in combined_df.columns if column not in keys}, inplace=True)
     return combined_df
 
+@profiling.profiled
 def clean_combined_data(df):
 
     # Calculate weighted returns
@@ -183,6 +580,7 @@ def clean_combined_data(df):
 
     return merged_df
 
+@profiling.profiled
 def get_attribution_effects(df):
     #! Include interaction effect if you opt to use it. Also include it in sum of effects
     df['Allocation Effect'] = attr.calculate_allocation_effect(df)
@@ -206,17 +604,42 @@ def calculate_daily_excess_return(df):
 
 #! ---------------------------- Function that gets called from app.py, returns basic form of data ----------------------------
 
-def get_data(performance_data):
-    # Read all the different sheets in xlsx and create unique dataframes from each
-    
-    benchmark_df = get_benchmark_data(performance_data)
-    portfolio_df = get_portfolio_data(performance_data, benchmark_df)
-
-    combined_df = combine_portfolio_and_benchmark_data(portfolio_df, benchmark_df)
-    combined_df = clean_combined_data(combined_df)
-
-    combined_df = get_attribution_effects(combined_df)
-
+@profiling.profiled
+def get_data(performance_data, store=None, engine='pandas', start_date=None, end_date=None, sectors=None, compact=False):
+    # Read all the different sheets in xlsx in one pass (or from the store) and create unique dataframes from each.
+    # Only the selected dates and sectors are loaded and run, see filter_prepared_data. compact=True runs on
+    # categorical keys and float32 values, see compact_prepared_data
+    prepared = load_prepared_data(performance_data, store, start_date, end_date, sectors, compact)
+
+    return get_attribution_data(prepared, engine, sectors)
+
+@profiling.profiled
+def get_attribution_data(prepared, engine='pandas', sectors=None):
+    # The array engine produces the same outputs from dense date x instrument arrays instead of merges
+    if engine == 'numpy':
+        combined_df, daily_level_data = array_engine.get_data(prepared)
+        if sectors is None:
+            return combined_df, daily_level_data
+    elif engine == 'pandas':
+        benchmark_df = get_benchmark_data(prepared)
+        portfolio_df = get_portfolio_data(prepared, benchmark_df)
+
+        combined_df = combine_portfolio_and_benchmark_data(portfolio_df, benchmark_df)
+        combined_df = clean_combined_data(combined_df)
+
+        combined_df = get_attribution_effects(combined_df)
+    else:
+        raise ValueError(f"Unknown attribution engine: {engine}")
+
+    # The benchmark rows of the other sectors were only needed for the benchmark daily totals
+    if sectors is not None:
+        combined_df = combined_df[combined_df['GICS Sector'].isin(sectors)].reset_index(drop=True)
+
+    combined_df = expand_dtypes(combined_df)
+    return combined_df, get_daily_level_data(combined_df)
+
+@profiling.profiled
+def get_daily_level_data(combined_df):
     # Daily level
     daily_level_data = combined_df[['Date', 
                                     'Portfolio Weight', 
@@ -229,4 +652,4 @@ def get_data(performance_data):
 
     daily_level_data['Excess Return'] = daily_level_data['Portfolio Weighted Returns'] - daily_level_data['Benchmark Weighted Returns']
 
-    return combined_df, daily_level_data
\ No newline at end of file
+    return daily_level_data
\ No newline at end of file
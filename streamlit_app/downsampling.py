@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# Downsampling of long daily series before they are sent to the browser as Plotly traces. Past DOWNSAMPLE_THRESHOLD
+# rows (about one point per pixel of a full width chart), a frame keeps at most that many rows:
+# - 'lttb' (Largest Triangle Three Buckets) keeps the points that preserve the visual shape of the line
+# - 'minmax' keeps the first, last, lowest and highest point of every bucket, so no peak is lost
+# All series of a frame share the index. Each series picks an equal share of the rows, the rows kept are the union.
+#
+# Only the rows of the window being plotted are downsampled, so a narrower date window shows more detail, down to
+# the full resolution once it has no more than DOWNSAMPLE_THRESHOLD rows.
+
+DOWNSAMPLE_THRESHOLD = 1000
+
+METHODS = ['lttb', 'minmax']
+
+def lttb_indices(x, y, n_out):
+    # Positions of the n_out points picked by LTTB, always including the first and last point
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        # Area of the triangle formed by the previous pick, each candidate and the average of the next bucket
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        selected[i + 1] = previous
+
+    return selected
+
+def minmax_indices(y, n_out):
+    # Positions of the lowest and highest point of n_out // 2 equal buckets, plus the first and last point
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+
+    values = pd.Series(y)
+    buckets = np.arange(n) * (n_out // 2) // n
+    grouped = values.groupby(buckets)
+    return np.unique(np.concatenate([[0, n - 1], grouped.idxmin().dropna().astype(int), grouped.idxmax().dropna().astype(int)]))
+
+def payload_bytes(df, columns):
+    # Approximate size of the trace data sent to the browser: the index and the columns as JSON
+    return len(df[columns].to_json(orient='split', date_format='iso', double_precision=15))
+
+def downsample(df, columns, max_points=DOWNSAMPLE_THRESHOLD, method='lttb'):
+    # Returns the rows to plot and a report of the points and payload before and after. Frames of up to max_points
+    # rows, or max_points=None, are returned as they are, without payload sizes
+    report = {'method': None, 'points_before': len(df) * len(columns)}
+    if max_points is None or len(df) <= max_points:
+        return df, dict(report, points_after=report['points_before'], bytes_before=None, bytes_after=None)
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+
+    x = df.index.asi8.astype(float) if isinstance(df.index, pd.DatetimeIndex) else np.arange(len(df), dtype=float)
+    per_series = max_points // len(columns)
+    picks = [lttb_indices(x, df[column].values.astype(float), per_series) if method == 'lttb'
+             else minmax_indices(df[column].values.astype(float), per_series) for column in columns]
+    sampled = df.iloc[np.unique(np.concatenate(picks))]
+
+    # Only the sampled rows are serialized, the payload of all rows is estimated from their bytes per row
+    bytes_after = payload_bytes(sampled, columns)
+    return sampled, dict(report, method=method, points_after=len(sampled) * len(columns),
+                         bytes_before=round(bytes_after * len(df) / len(sampled)), bytes_after=bytes_after)
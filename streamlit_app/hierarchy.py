@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import data
+
+# Attribution at several classification levels (e.g. GICS industry -> industry group -> sector) in one call.
+#
+# The workbook is attributed once at the lowest level: 'Sector 1' of the portfolio sheets and the benchmark sheet
+# columns hold the lowest level categories. Every higher level is then rolled up from the lowest level weights and
+# weighted returns with a single groupby, without running the merge pipeline again.
+#
+# The classification maps each lowest level category to its parents, one column per level from the lowest to the
+# highest, e.g. ['GICS Industry', 'GICS Industry Group', 'GICS Sector']. It can be passed as a dataframe or come from
+# an optional "Classification" sheet of the workbook, which data.read_performance_data parses in the same pass as the
+# other sheets and the store keeps with the other prepared frames.
+#
+# The hierarchy is a library mode, neither the app nor cli.py run it.
+
+# Lowest level category column as produced by the sector pipeline in data.py
+BASE_KEY = 'GICS Sector'
+
+def roll_up(base_df, parents):
+    # base_df is the lowest level combined frame, parents maps each of its rows to the higher level category
+    rows = base_df[['Date', 'Portfolio Weight', 'Portfolio Return', 'Portfolio Weighted Returns', 'Benchmark Weight',
+                    'Benchmark Weighted Returns', 'Benchmark Sector Performance']].assign(Group=parents.values)
+
+    grouped = rows.groupby(['Date', 'Group'], sort=True)
+    level_df = grouped[['Portfolio Weight', 'Portfolio Return', 'Portfolio Weighted Returns', 'Benchmark Weight', 'Benchmark Weighted Returns']].sum()
+
+    # Return of a group is its weighted return over its weight. Where the benchmark holds nothing of the group,
+    # fall back to the plain average of the child returns so the allocation effect still has a benchmark return
+    with np.errstate(divide='ignore', invalid='ignore'):
+        level_df['Portfolio Sector Performance'] = np.where(level_df['Portfolio Weight'] != 0, level_df['Portfolio Weighted Returns'] / level_df['Portfolio Weight'], 0.0)
+        level_df['Benchmark Sector Performance'] = np.where(level_df['Benchmark Weight'] != 0, level_df['Benchmark Weighted Returns'] / level_df['Benchmark Weight'],
+                                                            grouped['Benchmark Sector Performance'].mean())
+    level_df = level_df.reset_index()
+
+    # Daily totals do not depend on the level
+    daily_totals = base_df[['Date', 'Portfolio Daily Total Return', 'Benchmark Daily Total Return', 'Total Excess Return']].drop_duplicates('Date')
+    level_df = level_df.merge(daily_totals, on='Date', how='left')
+
+    return data.get_attribution_effects(level_df)
+
+def get_hierarchy_data(prepared, classification, engine='pandas'):
+    # Returns {level: (combined_df, daily_level_data)} for every column of the classification, lowest level first.
+    # Each combined_df has the level name as its category column in place of 'GICS Sector'
+    levels = list(classification.columns)
+    base_level = levels[0]
+
+    base_df, base_daily = data.get_attribution_data(prepared, engine)
+    results = {base_level: (base_df.rename(columns={BASE_KEY: base_level}), base_daily)}
+
+    # Categories missing from the classification keep their own name at every level
+    mapping = classification.drop_duplicates(base_level).set_index(base_level)
+    for level in levels[1:]:
+        parents = base_df[BASE_KEY].map(mapping[level]).fillna(base_df[BASE_KEY])
+        level_df = roll_up(base_df, parents).rename(columns={'Group': level})
+        results[level] = (level_df[[column if column != BASE_KEY else level for column in base_df.columns]], data.get_daily_level_data(level_df))
+
+    return results
+
+def get_hierarchy(performance_data, classification=None, store=None, engine='pandas'):
+    # Like data.get_data, for every level of the classification at once
+    prepared = data.load_prepared_data(performance_data, store)
+    if classification is None:
+        if 'classification' not in prepared:
+            raise ValueError(f'The workbook has no "{data.CLASSIFICATION_SHEET_NAME}" sheet')
+        classification = prepared['classification']
+    return get_hierarchy_data(prepared, classification, engine)
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import data
+import visualization_data as viz_data
+
+# Incremental (append-only) attribution. New days are run through the normal pipeline together with the last known
+# row of every instrument and benchmark sector, so weights are lagged correctly, and only the new rows are kept.
+# The state keeps running sums for the compounded returns, the Carino linked effects and the per-sector compounded
+# effects, so an append costs O(new days).
+#
+# Assumes portfolio weights and returns of an instrument are reported on the same days and that the
+# multi-industry mapping does not change between appends (pass a new one in the appended frames if it does).
+
+TIME_SERIES_FRAMES = {
+    'portfolio_weights': 'Instrument',
+    'portfolio_returns': 'Instrument',
+    'benchmark_weights': 'GICS Sector',
+    'benchmark_returns': 'GICS Sector',
+}
+
+def get_tail(prepared):
+    # Last row of every instrument / benchmark sector, the only history needed to lag the next day's weights
+    tail = {}
+    for name, key in TIME_SERIES_FRAMES.items():
+        df = prepared[name].sort_values('Date', kind='stable')
+        tail[name] = df.drop_duplicates(subset=key, keep='last').reset_index(drop=True)
+    tail['multi_industry_weights'] = prepared['multi_industry_weights']
+    return tail
+
+def cumulative(start, values):
+    # Running sum continued from start. Adding sequentially keeps the result identical to a cumsum over the full history
+    return np.cumsum(np.concatenate([[start], values]))[1:]
+
+class AttributionState:
+    """
+    Attribution results built up one batch of days at a time.
+    """
+    def __init__(self, engine='pandas'):
+        self.engine = engine
+        self.tail = None
+        self.last_date = None
+        self._combined_chunks = []
+        self._daily_chunks = []
+        self._linking_chunks = []
+
+        # Running sums of log(1 + return) of the daily portfolio and benchmark returns
+        self.log_portfolio = 0.0
+        self.log_benchmark = 0.0
+
+        # Per effect: sum of effect * Carino coefficient where the coefficient is defined, sum of effects where it is
+        # not, and the plain sum of effects used when the coefficient of the last day is undefined
+        self.scaled_sums = {effect: 0.0 for effect in viz_data.EFFECT_COLUMNS}
+        self.unscaled_sums = {effect: 0.0 for effect in viz_data.EFFECT_COLUMNS}
+        self.plain_sums = {effect: 0.0 for effect in viz_data.EFFECT_COLUMNS}
+
+        # Per sector running product of (1 + effect)
+        self.sector_products = {}
+
+    @property
+    def combined_df(self):
+        return pd.concat(self._combined_chunks, ignore_index=True)
+
+    @property
+    def daily_level_data(self):
+        return pd.concat(self._daily_chunks)
+
+    def _update(self, combined_df, daily_level_data):
+        self._combined_chunks.append(combined_df)
+        self._daily_chunks.append(daily_level_data)
+
+        # Compounded returns continue from the running log sums
+        log_portfolio = cumulative(self.log_portfolio, np.log(1 + daily_level_data['Portfolio Weighted Returns'].values))
+        log_benchmark = cumulative(self.log_benchmark, np.log(1 + daily_level_data['Benchmark Weighted Returns'].values))
+        self.log_portfolio, self.log_benchmark = log_portfolio[-1], log_benchmark[-1]
+
+        portfolio_compounded = np.exp(log_portfolio) - 1
+        benchmark_compounded = np.exp(log_benchmark) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coefficient = (np.log(1 + portfolio_compounded) - np.log(1 + benchmark_compounded)) / (portfolio_compounded - benchmark_compounded)
+        defined = np.isfinite(coefficient)
+
+        linking = pd.DataFrame({
+            'Portfolio Compounded Returns': portfolio_compounded,
+            'Benchmark Compounded Returns': benchmark_compounded,
+            'Coefficient': coefficient,
+        }, index=daily_level_data.index)
+
+        for effect in viz_data.EFFECT_COLUMNS:
+            values = daily_level_data[effect].values
+            scaled = cumulative(self.scaled_sums[effect], np.where(defined, values * coefficient, 0.0))
+            unscaled = cumulative(self.unscaled_sums[effect], np.where(defined, 0.0, values))
+            plain = cumulative(self.plain_sums[effect], values)
+            self.scaled_sums[effect], self.unscaled_sums[effect], self.plain_sums[effect] = scaled[-1], unscaled[-1], plain[-1]
+            linking[effect + ' Scaled'] = scaled
+            linking[effect + ' Unscaled'] = unscaled
+            linking[effect + ' Plain'] = plain
+        self._linking_chunks.append(linking)
+
+        # Per sector compounded effects, multiplied on in date order
+        for sector, sector_df in combined_df.groupby('GICS Sector', sort=False):
+            products = self.sector_products.setdefault(sector, {effect: 1.0 for effect in viz_data.EFFECT_COLUMNS})
+            for effect in viz_data.EFFECT_COLUMNS:
+                products[effect] = np.cumprod(np.concatenate([[products[effect]], 1 + sector_df[effect].values]))[-1]
+
+        self.last_date = daily_level_data.index.max()
+
+    #! ---------------------------- Results, same as the visualization_data functions on the full history ----------------------------
+
+    def daily_compounded_returns(self):
+        linking = pd.concat(self._linking_chunks)
+        comp_returns = linking[['Portfolio Compounded Returns', 'Benchmark Compounded Returns']]
+        return comp_returns - comp_returns.iloc[0]
+
+    def compounded_allocation_effects(self):
+        linking = pd.concat(self._linking_chunks)
+
+        # The Carino coefficients are scaled by the coefficient of the last day, which is why only this step is O(days)
+        last_coefficient = linking['Coefficient'].iloc[-1]
+        results = {}
+        for effect in viz_data.EFFECT_COLUMNS:
+            if np.isfinite(last_coefficient):
+                results[effect] = linking[effect + ' Scaled'] / last_coefficient + linking[effect + ' Unscaled']
+            else:
+                results[effect] = linking[effect + ' Plain']
+        results['Excess Returns'] = linking['Portfolio Compounded Returns'] - linking['Benchmark Compounded Returns']
+
+        results_df = pd.DataFrame(results, index=linking.index)
+        return results_df - results_df.iloc[0]
+
+    def compounded_sector_effects(self):
+        return pd.DataFrame({
+            'GICS Sector': list(self.sector_products.keys()),
+            'Allocation Effect': [products['Allocation Effect'] - 1 for products in self.sector_products.values()],
+            'Selection Effect': [products['Selection Effect'] - 1 for products in self.sector_products.values()],
+        })
+
+def initialize_state(prepared, engine='pandas'):
+    # Full run over the history available so far
+    state = AttributionState(engine)
+    combined_df, daily_level_data = data.get_attribution_data(prepared, engine)
+    state._update(combined_df, daily_level_data)
+    state.tail = get_tail(prepared)
+    return state
+
+def append_days(state, new_prepared):
+    # new_prepared holds only the new day(s), in the format of data.prepare_performance_data
+    window = {name: pd.concat([state.tail[name], new_prepared[name]], ignore_index=True) for name in TIME_SERIES_FRAMES}
+    window['multi_industry_weights'] = new_prepared.get('multi_industry_weights', state.tail['multi_industry_weights'])
+
+    combined_df, daily_level_data = data.get_attribution_data(window, state.engine)
+
+    # Rows of the carried over tail dates were already part of the state
+    combined_df = combined_df[combined_df['Date'] > state.last_date].reset_index(drop=True)
+    daily_level_data = daily_level_data[daily_level_data.index > state.last_date]
+    if not daily_level_data.empty:
+        state._update(combined_df, daily_level_data)
+
+    state.tail = get_tail(window)
+    return state
@@ -0,0 +1,156 @@
+import os
+import pandas as pd
+import utils
+import data
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, Parquet inputs need it
+    pq = None
+
+# CSV / Parquet ingestion of the datasets otherwise read from the workbook sheets.
+#
+# Files are expected in the long format produced by the prepare_* functions in data.py (one row per date and
+# instrument or sector), which is how warehouse exports usually look. A file without the long format columns is
+# treated as an export of the corresponding workbook sheet and goes through the same prepare_* function.
+
+DATASETS = {
+    'portfolio_weights': ("Portfolio Weights", ['Instrument', 'Instr. Type', 'Sector 1', 'Ccy', 'Date', 'Weight']),
+    'portfolio_returns': ("Portfolio Returns", ['Instrument', 'Instr. Type', 'Sector 1', 'Ccy', 'Date', 'Return']),
+    'benchmark_weights': ("Benchmark Weights", ['Date', 'GICS Sector', 'Weight']),
+    'benchmark_returns': ("Benchmark Returns", ['Date', 'GICS Sector', 'Return']),
+    'multi_industry_weights': ("Multi-Industry Weights", ['Instrument', 'GICS Sector', 'BM Weight']),
+}
+
+VALUE_COLUMNS = ['Weight', 'Return', 'BM Weight']
+
+CSV_CHUNK_ROWS = 1_000_000
+
+# The window also needs the last date before start_date (see data.filter_prepared_data). Rows from this far back are
+# read as well so the base date is found across weekends and holidays
+BASE_DATE_LOOKBACK = pd.Timedelta(days=14)
+
+def file_format(file):
+    # Works for paths and uploaded file objects alike
+    name = file if isinstance(file, (str, os.PathLike)) else getattr(file, 'name', '')
+    extension = os.path.splitext(str(name))[1].lower()
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    if extension in ('.csv', '.txt', '.gz'):
+        return 'csv'
+    raise ValueError(f"Unsupported file type: {name}")
+
+def parse_dates(series):
+    # Warehouse exports use ISO dates, workbook style exports day.month.year
+    try:
+        return pd.to_datetime(series, format='ISO8601')
+    except ValueError:
+        return utils.return_datetime_column(series)
+
+def filter_dates(df, start_date=None, end_date=None):
+    if start_date is not None:
+        df = df[df['Date'] >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        df = df[df['Date'] <= pd.Timestamp(end_date)]
+    return df
+
+def is_long_format(columns, name):
+    return set(DATASETS[name][1]).issubset(columns)
+
+def get_dtypes(name):
+    # Keys as strings and values as floats, dates are parsed separately
+    return {column: 'float64' if column in VALUE_COLUMNS else 'object' for column in DATASETS[name][1] if column != 'Date'}
+
+def read_csv_dataset(file, name, start_date=None, end_date=None):
+    header = pd.read_csv(file, nrows=0).columns
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+    if not is_long_format(header, name):
+        return data.prepare_performance_data({DATASETS[name][0]: pd.read_csv(file)})[name]
+
+    # Typed, chunked read: only the needed columns are parsed and rows outside the date range are dropped
+    # chunk by chunk, so the full file is never held in memory at once
+    columns = DATASETS[name][1]
+    chunks = []
+    for chunk in pd.read_csv(file, usecols=columns, dtype=get_dtypes(name), chunksize=CSV_CHUNK_ROWS):
+        if 'Date' in chunk:
+            chunk['Date'] = parse_dates(chunk['Date'])
+            chunk = filter_dates(chunk, start_date, end_date)
+        chunks.append(chunk)
+
+    return pd.concat(chunks, ignore_index=True)[columns]
+
+def read_parquet_dataset(file, name, start_date=None, end_date=None):
+    if pq is None:
+        raise ImportError("pyarrow is required to read Parquet files")
+
+    schema = pq.read_schema(file)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+    if not is_long_format(schema.names, name):
+        return data.prepare_performance_data({DATASETS[name][0]: pq.read_table(file).to_pandas()})[name]
+
+    # Column pruning and, when the Date column is a timestamp, predicate pushdown of the date range to the row groups
+    columns = DATASETS[name][1]
+    filters = []
+    date_is_timestamp = 'Date' in columns and str(schema.field('Date').type).startswith(('timestamp', 'date'))
+    if date_is_timestamp and start_date is not None:
+        filters.append(('Date', '>=', pd.Timestamp(start_date)))
+    if date_is_timestamp and end_date is not None:
+        filters.append(('Date', '<=', pd.Timestamp(end_date)))
+
+    df = pq.read_table(file, columns=columns, filters=filters or None).to_pandas()
+    df = df.astype(get_dtypes(name))
+    if 'Date' in df:
+        df['Date'] = parse_dates(df['Date']).astype('datetime64[ns]')
+
+    return df
+
+def read_dataset(file, name, start_date=None, end_date=None):
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date) - BASE_DATE_LOOKBACK
+
+    if file_format(file) == 'parquet':
+        df = read_parquet_dataset(file, name, start_date, end_date)
+    else:
+        df = read_csv_dataset(file, name, start_date, end_date)
+
+    # Sheet style exports are only filtered after they have been reshaped
+    if 'Date' in df:
+        df = filter_dates(df, start_date, end_date).reset_index(drop=True)
+    return df
+
+def load_datasets(files, start_date=None, end_date=None, sectors=None):
+    # files maps each dataset name in DATASETS to a path or file object. The result has the same format as
+    # data.prepare_performance_data and can be passed to data.get_attribution_data
+    missing = set(DATASETS) - set(files)
+    if missing:
+        raise ValueError(f"Missing datasets: {', '.join(sorted(missing))}")
+
+    prepared = {name: read_dataset(files[name], name, start_date, end_date) for name in DATASETS}
+    return data.filter_prepared_data(prepared, start_date, end_date, sectors)
+
+def read_dataset_columns(file, name, columns):
+    # Only the given columns of a long format file. Sheet style exports are read and reshaped whole
+    if file_format(file) == 'parquet':
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet files")
+        names = pq.read_schema(file).names
+    else:
+        names = pd.read_csv(file, nrows=0).columns
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+    if not is_long_format(names, name):
+        return read_dataset(file, name)[columns]
+    if file_format(file) == 'parquet':
+        return pq.read_table(file, columns=columns).to_pandas()
+    return pd.read_csv(file, usecols=columns, dtype={column: get_dtypes(name)[column] for column in columns})
+
+def load_bounds(files):
+    # data.get_bounds of the datasets, reading only the key columns of the portfolio weights
+    prepared = {name: read_dataset(files[name], name) for name in ('benchmark_returns', 'multi_industry_weights')}
+    prepared['portfolio_weights'] = read_dataset_columns(files['portfolio_weights'], 'portfolio_weights', ['Instrument', 'Sector 1'])
+    return data.get_bounds(prepared)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import visualization_data as viz_data
+
+# Attribution over arbitrary sub-periods (rolling windows, months, quarters, MTD/QTD/YTD) from one pass over the
+# daily results of data.get_attribution_data.
+#
+# Everything a window needs is a difference of two prefix sums over the days:
+# - compounded returns from the sums of log(1 + daily return), as in visualization_data.daily_compounded_returns
+# - per sector compounded effects from the sums of log(1 + daily effect), as in get_compounded_sector_effects
+# - Carino linked effects from the sums of k_t * effect_t, divided by the K of the window, where
+#   k(p, b) = (ln(1 + p) - ln(1 + b)) / (p - b) with the limit 1 / (1 + p) when p == b.
+#
+# The linking uses the daily k_t of the textbook Carino method. Unlike the coefficient of
+# visualization_data.compounded_allocation_effects, which is computed from the returns compounded since the start of
+# the period, it does not depend on where the window starts, so every window is O(1) for all sectors at once. The
+# linked effects of a window add up to its compounded excess return (when the daily effects add up to the daily
+# excess return).
+#
+# A window from start to end covers the days from the first date >= start to the last date <= end. The date before
+# it is the base date, as for the date filters of data.load_prepared_data.
+
+def carino_k(portfolio_return, benchmark_return):
+    portfolio_return, benchmark_return = np.asarray(portfolio_return, dtype=float), np.asarray(benchmark_return, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = (np.log1p(portfolio_return) - np.log1p(benchmark_return)) / (portfolio_return - benchmark_return)
+    return np.where(portfolio_return == benchmark_return, 1 / (1 + portfolio_return), k)
+
+def prefix_sums(values):
+    # Cumulative sums along the first axis with a leading zero row: the sum over days i..j is sums[j + 1] - sums[i]
+    values = np.asarray(values, dtype=float)
+    return np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+
+class PeriodAttribution:
+    """
+    Prefix sums over the daily results, built once in O(days x sectors). Any window is then O(1) per sector.
+    """
+    def __init__(self, combined_df, daily_level_data, group_by='GICS Sector'):
+        daily = daily_level_data.sort_index()
+        self.dates = pd.DatetimeIndex(daily.index)
+        self.group_by = group_by
+
+        portfolio, benchmark = daily['Portfolio Weighted Returns'].values, daily['Benchmark Weighted Returns'].values
+        self.log_portfolio = prefix_sums(np.log1p(portfolio))
+        self.log_benchmark = prefix_sums(np.log1p(benchmark))
+        k = carino_k(portfolio, benchmark)
+
+        # Days x groups matrices of the daily effects, zero where a group has no row on a date
+        self.groups = pd.Index(pd.unique(combined_df[group_by]))
+        date_codes = self.dates.get_indexer(combined_df['Date'])
+        group_codes = self.groups.get_indexer(combined_df[group_by])
+
+        self.scaled_effects = {}
+        self.log_effects = {}
+        for effect in viz_data.EFFECT_COLUMNS:
+            matrix = np.zeros((len(self.dates), len(self.groups)))
+            np.add.at(matrix, (date_codes, group_codes), combined_df[effect].values)
+            self.scaled_effects[effect] = prefix_sums(matrix * k[:, None])
+            self.log_effects[effect] = prefix_sums(np.log1p(matrix))
+
+    def window_bounds(self, starts, ends):
+        # Index of the first and one past the last day of every window
+        first = self.dates.searchsorted(pd.DatetimeIndex(pd.to_datetime(starts)), side='left')
+        last = self.dates.searchsorted(pd.DatetimeIndex(pd.to_datetime(ends)), side='right')
+        return first, np.maximum(last, first)
+
+    def windows(self, starts, ends):
+        # Totals of many windows in one vectorized step, one row per window
+        first, last = self.window_bounds(np.atleast_1d(starts), np.atleast_1d(ends))
+        portfolio = np.expm1(self.log_portfolio[last] - self.log_portfolio[first])
+        benchmark = np.expm1(self.log_benchmark[last] - self.log_benchmark[first])
+
+        results = pd.DataFrame({
+            'Start Date': self.dates[np.minimum(first, len(self.dates) - 1)],
+            'End Date': self.dates[np.maximum(last - 1, 0)],
+            'Days': last - first,
+            'Portfolio Return': portfolio,
+            'Benchmark Return': benchmark,
+            'Excess Return': portfolio - benchmark,
+        })
+        window_k = carino_k(portfolio, benchmark)
+        for effect in viz_data.EFFECT_COLUMNS:
+            results[effect] = (self.scaled_effects[effect][last] - self.scaled_effects[effect][first]).sum(axis=1) / window_k
+        return results
+
+    def sector_windows(self, starts, ends):
+        # Per group effects of many windows, one row per window and group: compounded as in
+        # get_compounded_sector_effects and Carino linked
+        first, last = self.window_bounds(np.atleast_1d(starts), np.atleast_1d(ends))
+        window_k = carino_k(np.expm1(self.log_portfolio[last] - self.log_portfolio[first]),
+                            np.expm1(self.log_benchmark[last] - self.log_benchmark[first]))
+
+        results = pd.DataFrame({
+            'Start Date': np.repeat(self.dates[np.minimum(first, len(self.dates) - 1)], len(self.groups)),
+            'End Date': np.repeat(self.dates[np.maximum(last - 1, 0)], len(self.groups)),
+            self.group_by: np.tile(self.groups, len(first)),
+        })
+        for effect in viz_data.EFFECT_COLUMNS:
+            results[effect] = np.expm1(self.log_effects[effect][last] - self.log_effects[effect][first]).ravel()
+            results['Linked ' + effect] = ((self.scaled_effects[effect][last] - self.scaled_effects[effect][first]) / window_k[:, None]).ravel()
+        return results
+
+    def window(self, start=None, end=None):
+        # Totals and per group effects of a single window, the whole history by default
+        start = self.dates[0] if start is None else start
+        end = self.dates[-1] if end is None else end
+        return self.windows([start], [end]).iloc[0], self.sector_windows([start], [end]).drop(columns=['Start Date', 'End Date'])
+
+    #! ---------------------------- Standard periods ----------------------------
+
+    def rolling(self, months=1, by_sector=False):
+        # Trailing windows of `months` months ending on every date. Dates with less history than that are left out
+        ends = self.dates[self.dates - pd.DateOffset(months=months) >= self.dates[0]]
+        starts = ends - pd.DateOffset(months=months) + pd.Timedelta(days=1)
+        return self.sector_windows(starts, ends) if by_sector else self.windows(starts, ends)
+
+    def calendar(self, freq='M', by_sector=False):
+        # One window per calendar month ('M'), quarter ('Q') or year ('Y'), covering the days of the period
+        periods = self.dates.to_period(freq)
+        bounds = pd.Series(self.dates, index=periods).groupby(level=0).agg(['min', 'max'])
+        results = self.sector_windows(bounds['min'], bounds['max']) if by_sector else self.windows(bounds['min'], bounds['max'])
+        results.insert(0, 'Period', np.repeat(bounds.index.astype(str), len(self.groups) if by_sector else 1))
+        return results
+
+    def to_date(self, freq='M', as_of=None, by_sector=False):
+        # Month, quarter or year to date (MTD / QTD / YTD) as of the given date, the last date by default
+        as_of = self.dates[-1] if as_of is None else pd.Timestamp(as_of)
+        start = pd.Period(as_of, freq).start_time
+        return self.sector_windows([start], [as_of]) if by_sector else self.windows([start], [as_of])
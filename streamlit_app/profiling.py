@@ -0,0 +1,143 @@
+import json
+import time
+import functools
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+import pandas as pd
+
+# Opt-in profiling of the pipeline stages. Instrumented functions and `with stage(...)` blocks only record while a
+# profile() block is active in the current thread or task (each Streamlit session runs in its own thread). When
+# profiling is off the only cost is one context variable lookup per call.
+#
+#     with profiling.profile() as report:
+#         data.get_data(workbook)
+#     report.to_dict()
+
+_active_report = contextvars.ContextVar('active_report', default=None)
+
+def count_rows(value):
+    # Rows of a dataframe, or of all dataframes in a tuple / list / dict
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        counts = [count_rows(v) for v in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    return None
+
+class StageRecord:
+    """
+    Timing, rows and peak memory of one stage call.
+    """
+    def __init__(self, name, depth, rows_in=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.peak_bytes = None
+        self.start = None
+
+    def set_output(self, value):
+        self.rows_out = count_rows(value)
+
+    def to_dict(self):
+        return {'stage': self.name, 'depth': self.depth, 'seconds': self.seconds, 'rows_in': self.rows_in,
+                'rows_out': self.rows_out, 'peak_mb': None if self.peak_bytes is None else self.peak_bytes / 1024 ** 2}
+
+class ProfileReport:
+    """
+    Stage records in call order. Peak memory is only traced with memory=True, which slows the run down noticeably.
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self._stack = []
+
+    def enter(self, name, rows_in=None):
+        record = StageRecord(name, len(self._stack), rows_in)
+        self.records.append(record)
+        if self.memory:
+            # The peak is reset for the new stage, the enclosing stage keeps the peak reached so far
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._stack.append({'record': record, 'start_bytes': tracemalloc.get_traced_memory()[0], 'peak': 0})
+        else:
+            self._stack.append({'record': record})
+        record.start = time.perf_counter()
+        return record
+
+    def exit(self, record):
+        record.seconds = time.perf_counter() - record.start
+        entry = self._stack.pop()
+        if self.memory:
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            record.peak_bytes = peak - entry['start_bytes']
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+    def to_dict(self):
+        return {'memory': self.memory, 'stages': [record.to_dict() for record in self.records]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_frame(self):
+        # Stage names indented by depth, for display
+        df = pd.DataFrame([record.to_dict() for record in self.records], columns=['stage', 'depth', 'seconds', 'rows_in', 'rows_out', 'peak_mb'])
+        df['stage'] = ['  ' * depth + name for name, depth in zip(df['stage'], df['depth'])]
+        return df.drop(columns='depth')
+
+class _NullRecord:
+    # Stands in for a record when profiling is off
+    def set_output(self, value):
+        pass
+
+_null_record = _NullRecord()
+
+@contextmanager
+def profile(memory=False):
+    report = ProfileReport(memory)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    token = _active_report.set(report)
+    try:
+        yield report
+    finally:
+        _active_report.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+@contextmanager
+def stage(name, rows_in=None):
+    # Records the enclosed block as one stage. Call set_output on the yielded record to count the rows out
+    report = _active_report.get()
+    if report is None:
+        yield _null_record
+        return
+    record = report.enter(name, count_rows(rows_in))
+    try:
+        yield record
+    finally:
+        report.exit(record)
+
+def profiled(func):
+    # Records every call of func as a stage named after it, with the rows of its dataframe arguments and result
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        report = _active_report.get()
+        if report is None:
+            return func(*args, **kwargs)
+        record = report.enter(func.__name__, count_rows(list(args) + list(kwargs.values())))
+        try:
+            result = func(*args, **kwargs)
+            record.set_output(result)
+            return result
+        finally:
+            report.exit(record)
+    return wrapper
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+import data
+import visualization_data as viz_data
+import incremental
+
+# Security level Brinson attribution. Within a sector the selection effect splits exactly into per-instrument
+# contributions: w_i * (r_i - R_b,sector), which sum to the sector's w_p * (R_p - R_b).
+#
+# Dates are processed in chunks by a generator pipeline. Each chunk carries the last row of every instrument and
+# benchmark sector from the previous chunk so weights lag correctly, and only running aggregates are kept between
+# chunks. Given a workbook, the sheets are streamed side by side and only one chunk of rows is parsed at a time, so
+# the full instrument x date panel is never materialized. Already prepared frames are split once into chunks.
+
+TIME_SERIES_SHEETS = ["Portfolio Weights", "Portfolio Returns", "Benchmark Weights", "Benchmark Returns"]
+
+def chunk_end_dates(dates, chunk_days):
+    # Last date of every chunk of chunk_days sorted dates. The last chunk runs to the end, whatever its dates
+    return list(dates[chunk_days - 1:-1:chunk_days]) + [pd.Timestamp.max]
+
+def iter_prepared_chunks(prepared, chunk_days=250):
+    # Prepared frames of every chunk_days dates. Each frame is sorted by date once and cut at the chunk ends
+    frames = {name: prepared[name].sort_values('Date', kind='stable', ignore_index=True) for name in incremental.TIME_SERIES_FRAMES}
+    dates = np.sort(pd.unique(np.concatenate([df['Date'].values for df in frames.values()])))
+    ends = np.array(chunk_end_dates(dates, chunk_days)[:-1], dtype='datetime64[ns]')
+    bounds = {name: np.concatenate([[0], np.searchsorted(df['Date'].values, ends, side='right'), [len(df)]]) for name, df in frames.items()}
+
+    for i in range(len(ends) + 1):
+        chunk = {name: df.iloc[bounds[name][i]:bounds[name][i + 1]] for name, df in frames.items()}
+        chunk['multi_industry_weights'] = prepared['multi_industry_weights']
+        yield chunk
+
+def iter_workbook_chunks(performance_data, chunk_days=250):
+    # Prepared frames of every chunk_days dates of a workbook, read while iterating. The chunks follow the dates of
+    # the benchmark returns, which only take one cheap pass over a small sheet
+    import openpyxl
+
+    if hasattr(performance_data, 'seek'):
+        performance_data.seek(0)
+    workbook = openpyxl.load_workbook(performance_data, read_only=True, data_only=True)
+    try:
+        dates = [data.parse_sheet_date(row[0]) for row in workbook["Benchmark Returns"].iter_rows(min_row=2, max_col=1, values_only=True)]
+        ends = chunk_end_dates(sorted(date for date in dates if date is not None), chunk_days)
+        multi_industry_weights = data.prepare_multi_industry_weights(data.read_sheet_window(workbook["Multi-Industry Weights"]))
+
+        streams = [data.iter_sheet_blocks(workbook[sheet_name], ends) for sheet_name in TIME_SERIES_SHEETS]
+        for blocks in zip(*streams):
+            chunk = data.prepare_performance_data(dict(zip(TIME_SERIES_SHEETS, blocks)))
+            chunk['multi_industry_weights'] = multi_industry_weights
+            yield chunk
+    finally:
+        workbook.close()
+
+def date_range(prepared):
+    # First and last date over the time series frames, (None, None) when they are all empty
+    dates = [prepared[name]['Date'] for name in incremental.TIME_SERIES_FRAMES if not prepared[name].empty]
+    return (min(d.min() for d in dates), max(d.max() for d in dates)) if dates else (None, None)
+
+def iter_windows(chunks):
+    # Yields (window, since) pairs: each chunk plus the carried over tail, and the last date of the previous chunks
+    # (rows up to and including it were already emitted)
+    tail, since = None, None
+    for chunk in chunks:
+        window = chunk if tail is None else dict(chunk, **{name: pd.concat([tail[name], chunk[name]], ignore_index=True)
+                                                           for name in incremental.TIME_SERIES_FRAMES})
+        yield window, since
+        tail, since = incremental.get_tail(window), date_range(chunk)[1] or since
+
+def process_chunk(window, since, benchmark_df=None):
+    # Sector rows with effects and security rows with selection contributions for the dates after `since`. The
+    # benchmark rows are taken from benchmark_df when given, otherwise they are lagged within the window
+    if benchmark_df is None:
+        benchmark_df = data.get_benchmark_data(window)
+    else:
+        first, last = date_range(window)
+        benchmark_df = benchmark_df[benchmark_df['Date'].between(first, last)]
+    security_df = data.get_security_level_portfolio_data(window, benchmark_df)
+
+    portfolio_df = data.transform_to_sector_level_returns(security_df.copy())
+    sector_df = data.combine_portfolio_and_benchmark_data(portfolio_df, benchmark_df)
+    sector_df = data.get_attribution_effects(data.clean_combined_data(sector_df))
+
+    security_df = security_df.merge(benchmark_df[['Date', 'GICS Sector', 'Return']], on=['Date', 'GICS Sector'], how='left', suffixes=('', '_Benchmark'))
+    security_df['Selection Contribution'] = security_df['Weight'] * (security_df['Return'] - security_df['Return_Benchmark'].fillna(0))
+
+    if since is not None:
+        sector_df = sector_df[sector_df['Date'] > since]
+        security_df = security_df[security_df['Date'] > since]
+
+    return sector_df, security_df
+
+class RunningAggregates:
+    """
+    Running totals per sector and per security, updated one chunk of dates at a time.
+    """
+    def __init__(self):
+        self.log_portfolio = 0.0
+        self.log_benchmark = 0.0
+        self.last_coefficient = np.nan
+        self.sectors = None
+        self.securities = None
+
+    def carino_coefficients(self, sector_df):
+        # Carino coefficient of each date in the chunk, continuing the compounded returns of the previous chunks
+        daily = sector_df.groupby('Date')[['Portfolio Weighted Returns', 'Benchmark Weighted Returns']].sum()
+        log_portfolio = incremental.cumulative(self.log_portfolio, np.log(1 + daily['Portfolio Weighted Returns'].values))
+        log_benchmark = incremental.cumulative(self.log_benchmark, np.log(1 + daily['Benchmark Weighted Returns'].values))
+        self.log_portfolio, self.log_benchmark = log_portfolio[-1], log_benchmark[-1]
+
+        portfolio_compounded = np.exp(log_portfolio) - 1
+        benchmark_compounded = np.exp(log_benchmark) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coefficient = (np.log(1 + portfolio_compounded) - np.log(1 + benchmark_compounded)) / (portfolio_compounded - benchmark_compounded)
+        self.last_coefficient = coefficient[-1]
+
+        return pd.Series(coefficient, index=daily.index)
+
+    @staticmethod
+    def linked_parts(values, coefficient):
+        # Effect times Carino coefficient where the coefficient is defined, the plain effect where it is not.
+        # The first part is divided by the last coefficient of the whole period once all chunks are in
+        defined = np.isfinite(coefficient)
+        return np.where(defined, values * coefficient, 0.0), np.where(defined, 0.0, values)
+
+    def update(self, sector_df, security_df):
+        if sector_df.empty:
+            return
+        coefficient = self.carino_coefficients(sector_df)
+
+        sector_rows = pd.DataFrame({'GICS Sector': sector_df['GICS Sector'].values})
+        row_coefficient = sector_df['Date'].map(coefficient).values
+        for effect in viz_data.EFFECT_COLUMNS:
+            sector_rows[effect + ' Log Growth'] = np.log1p(sector_df[effect].values)
+            sector_rows[effect + ' Scaled'], sector_rows[effect + ' Unscaled'] = self.linked_parts(sector_df[effect].values, row_coefficient)
+            sector_rows[effect] = sector_df[effect].values
+        sectors = sector_rows.groupby('GICS Sector', sort=False).sum()
+
+        security_rows = security_df[['GICS Sector', 'Instrument', 'Weight', 'Selection Contribution']].copy()
+        security_rows['Days Held'] = security_df['Weight'].fillna(0).ne(0).astype(int)
+        scaled, unscaled = self.linked_parts(security_df['Selection Contribution'].fillna(0).values, security_df['Date'].map(coefficient).values)
+        security_rows['Selection Contribution Scaled'], security_rows['Selection Contribution Unscaled'] = scaled, unscaled
+        security_rows['Days'] = 1
+        securities = security_rows.groupby(['GICS Sector', 'Instrument'], sort=False).sum()
+
+        self.sectors = sectors if self.sectors is None else self.sectors.add(sectors, fill_value=0)
+        self.securities = securities if self.securities is None else self.securities.add(securities, fill_value=0)
+
+    def linked(self, df, column):
+        # Same fallback as compounded_allocation_effects: without a last coefficient every scaling factor is 1
+        if np.isfinite(self.last_coefficient):
+            return df[column + ' Scaled'] / self.last_coefficient + df[column + ' Unscaled']
+        return df[column]
+
+    def results(self):
+        sector_results = pd.DataFrame(index=self.sectors.index)
+        for effect in viz_data.EFFECT_COLUMNS:
+            # Compounded over the period, as in visualization_data.get_compounded_sector_effects, and Carino linked
+            sector_results[effect] = np.expm1(self.sectors[effect + ' Log Growth'])
+            sector_results['Linked ' + effect] = self.linked(self.sectors, effect)
+
+        security_results = pd.DataFrame({
+            'Average Weight': self.securities['Weight'] / self.securities['Days'],
+            'Days Held': self.securities['Days Held'].astype(int),
+            'Selection Contribution': self.securities['Selection Contribution'],
+            'Linked Selection Contribution': self.linked(self.securities, 'Selection Contribution'),
+        }, index=self.securities.index)
+
+        return sector_results.reset_index(), security_results.reset_index()
+
+def get_security_attribution(source, chunk_days=250, benchmark_df=None):
+    # Returns (sector_results, security_results) for the whole period. source is either a workbook (path or file-like
+    # object), streamed chunk by chunk, or a dict of prepared frames. benchmark_df, as from data.get_benchmark_data,
+    # saves lagging the benchmark in every chunk
+    chunks = iter_prepared_chunks(source, chunk_days) if isinstance(source, dict) else iter_workbook_chunks(source, chunk_days)
+    aggregates = RunningAggregates()
+    for sector_df, security_df in (process_chunk(window, since, benchmark_df) for window, since in iter_windows(chunks)):
+        aggregates.update(sector_df, security_df)
+    return aggregates.results()
@@ -0,0 +1,173 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import data
+import periods
+import visualization_data as viz_data
+
+# Resampling tests of the compounded sector effects, to tell skill from noise where
+# visualization_data.get_compounded_sector_effects only gives the point estimates.
+#
+# - Block bootstrap: the days are resampled in blocks of consecutive days (keeping the autocorrelation within a block)
+#   and every sector's effect is compounded over the resampled days. Compounding only needs the sum of log(1 + effect)
+#   over the days, so a resample is a sum of block sums taken from prefix sums: O(blocks x sectors), not O(days).
+# - Random portfolios: the same period with random weights that keep the portfolio's constraints. For allocation, long
+#   only sector weights adding up to the portfolio's invested weight of every day. For selection, long only weights
+#   over the instruments the portfolio held in each sector, adding up to its actual sector weight of every day. The
+#   percentile of the actual effect among the random portfolios says how unusual it is.
+#
+# Resamples are generated as batched arrays, one batch per task on a process pool. Every batch has its own seed
+# spawned from `seed`, so the results do not depend on the number of workers.
+
+#! ---------------------------- Process pool ----------------------------
+
+_shared = None
+
+def init_worker(shared):
+    global _shared
+    _shared = shared
+
+def run_batch(func, size, seed_sequence):
+    return func(_shared, size, seed_sequence)
+
+def run_resamples(func, shared, n_resamples, batch_size, seed=0, workers=None):
+    # func(shared, size, seed_sequence) returns a (size, ...) array. shared is sent to every worker once
+    sizes = [batch_size] * (n_resamples // batch_size) + ([n_resamples % batch_size] if n_resamples % batch_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = min(workers or os.cpu_count(), len(sizes))
+
+    if workers <= 1:
+        return np.concatenate([func(shared, size, seed_sequence) for size, seed_sequence in zip(sizes, seeds)])
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(shared,)) as executor:
+        return np.concatenate(list(executor.map(run_batch, [func] * len(sizes), sizes, seeds)))
+
+#! ---------------------------- Block bootstrap ----------------------------
+
+def effect_matrix(df, columns, dates, groups, group_by='GICS Sector'):
+    # Days x groups x columns, zero where a group has no row on a date
+    matrix = np.zeros((len(dates), len(groups), len(columns)))
+    np.add.at(matrix, (dates.get_indexer(df['Date']), groups.get_indexer(df[group_by])), df[columns].values.astype(float))
+    return matrix
+
+def bootstrap_batch(shared, size, seed_sequence):
+    # Compounded effects of `size` block bootstrap resamples, resamples x groups x effects
+    log_sums, block_length = shared
+    n_days = len(log_sums) - 1
+    n_blocks = -(-n_days // block_length)
+
+    rng = np.random.default_rng(seed_sequence)
+    starts = rng.integers(0, n_days - block_length + 1, size=(size, n_blocks))
+    # The last block is cut so every resample has exactly n_days days
+    lengths = np.full(n_blocks, block_length)
+    lengths[-1] = n_days - block_length * (n_blocks - 1)
+
+    return np.expm1((log_sums[starts + lengths] - log_sums[starts]).sum(axis=1))
+
+def bootstrap_sector_effects(combined_df, n_resamples=10000, block_length=20, confidence=0.95, seed=0, workers=None,
+                             batch_size=1000, group_by='GICS Sector'):
+    # Compounded effect per group with its bootstrap confidence interval, and the share of resamples above zero
+    effects = viz_data.EFFECT_COLUMNS
+    dates = pd.DatetimeIndex(np.sort(combined_df['Date'].unique()))
+    groups = pd.Index(pd.unique(combined_df[group_by]))
+    log_sums = periods.prefix_sums(np.log1p(effect_matrix(combined_df, effects, dates, groups, group_by)))
+    block_length = max(1, min(block_length, len(dates)))
+
+    resamples = run_resamples(bootstrap_batch, (log_sums, block_length), n_resamples, batch_size, seed, workers)
+    lower, upper = np.quantile(resamples, [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+
+    results = pd.DataFrame({group_by: groups})
+    for i, effect in enumerate(effects):
+        results[effect] = np.expm1(log_sums[-1, :, i])
+        results[effect + ' Lower'] = lower[:, i]
+        results[effect + ' Upper'] = upper[:, i]
+        results[effect + ' Share Positive'] = (resamples[:, :, i] > 0).mean(axis=0)
+    return results
+
+#! ---------------------------- Random portfolios ----------------------------
+
+def random_allocation_batch(shared, size, seed_sequence):
+    # Compounded allocation effects of `size` random sector weightings, portfolios x groups. Every portfolio keeps its
+    # weights for the whole period, scaled to the invested weight of each day
+    invested, benchmark_weights, benchmark_excess = shared
+    rng = np.random.default_rng(seed_sequence)
+    shares = rng.dirichlet(np.ones(benchmark_weights.shape[1]), size=size)
+
+    effects = (invested[None, :, None] * shares[:, None, :] - benchmark_weights[None]) * benchmark_excess[None]
+    return np.expm1(np.log1p(effects).sum(axis=1))
+
+def random_selection_batch(shared, size, seed_sequence):
+    # Compounded selection effects of `size` random portfolios, portfolios x groups. Within every group the weights
+    # are drawn once over the instruments held there and scaled to the actual group weight of each day. The
+    # instruments are sorted by group, bounds[g]:bounds[g + 1] are the columns of group g
+    returns, bounds, group_weights, benchmark_returns = shared
+    rng = np.random.default_rng(seed_sequence)
+    draws = rng.standard_gamma(1.0, size=(size, returns.shape[1]))
+
+    log_effects = np.zeros((size, group_weights.shape[1]))
+    for group in range(group_weights.shape[1]):
+        start, end = bounds[group], bounds[group + 1]
+        if start == end:
+            continue
+        shares = draws[:, start:end] / draws[:, start:end].sum(axis=1, keepdims=True)
+        group_returns = returns[:, start:end] @ shares.T
+        log_effects[:, group] = np.log1p(group_weights[:, group, None] * (group_returns - benchmark_returns[:, group, None])).sum(axis=0)
+    return np.expm1(log_effects)
+
+def security_returns(security_df, dates, groups):
+    # Days x instruments returns of the instruments held at some point, sorted by group, and the column bounds of
+    # every group
+    held = security_df[security_df['Weight'].fillna(0) != 0].drop_duplicates('Instrument')
+    held = held.assign(group=groups.get_indexer(held['GICS Sector'])).sort_values('group', kind='stable')
+    held = held[held['group'] >= 0]
+    instruments = pd.Index(held['Instrument'])
+    rows = security_df[security_df['Instrument'].isin(instruments)]
+
+    returns = np.zeros((len(dates), len(instruments)))
+    returns[dates.get_indexer(rows['Date']), instruments.get_indexer(rows['Instrument'])] = np.nan_to_num(rows['Return'].values.astype(float))
+    return returns, np.searchsorted(held['group'].values, np.arange(len(groups) + 1))
+
+def percentile_of(simulated, actual):
+    # Percentile rank of the actual effect among the simulated ones, ties count half
+    return ((simulated < actual).mean(axis=0) + 0.5 * (simulated == actual).mean(axis=0)) * 100
+
+def random_portfolio_sector_effects(combined_df, security_df=None, n_portfolios=10000, seed=0, workers=None, batch_size=250):
+    # Percentile of the actual compounded allocation effect of every sector among random portfolios, and of the
+    # selection effect when the security level rows (data.get_security_level_portfolio_data) are given
+    dates = pd.DatetimeIndex(np.sort(combined_df['Date'].unique()))
+    groups = pd.Index(pd.unique(combined_df['GICS Sector']))
+    columns = ['Portfolio Weight', 'Benchmark Weight', 'Benchmark Sector Performance', 'Benchmark Daily Total Return', 'Allocation Effect', 'Selection Effect']
+    matrix = effect_matrix(combined_df, columns, dates, groups)
+    portfolio_weights, benchmark_weights, benchmark_returns = matrix[:, :, 0], matrix[:, :, 1], matrix[:, :, 2]
+    benchmark_total = combined_df.groupby('Date')['Benchmark Daily Total Return'].first().reindex(dates).values
+
+    actual = np.expm1(np.log1p(matrix[:, :, 4:]).sum(axis=0))
+    results = pd.DataFrame({'GICS Sector': groups, 'Allocation Effect': actual[:, 0]})
+
+    # As in attribution.calculate_allocation_effect. A group without a benchmark row has a zero benchmark return, the
+    # weight put into it still earns Wp * (0 - Rb_total)
+    benchmark_excess = benchmark_returns - benchmark_total[:, None]
+    shared = (portfolio_weights.sum(axis=1), benchmark_weights, benchmark_excess)
+    simulated = run_resamples(random_allocation_batch, shared, n_portfolios, batch_size, seed, workers)
+    results['Allocation Effect Percentile'] = percentile_of(simulated, actual[:, 0])
+
+    if security_df is not None:
+        returns, bounds = security_returns(security_df, dates, groups)
+        shared = (returns, bounds, portfolio_weights, benchmark_returns)
+        simulated = run_resamples(random_selection_batch, shared, n_portfolios, batch_size, seed, workers)
+        results['Selection Effect'] = actual[:, 1]
+        results['Selection Effect Percentile'] = percentile_of(simulated, actual[:, 1])
+
+    return results
+
+#! ---------------------------- Combined ----------------------------
+
+def get_sector_significance(prepared, n_resamples=10000, block_length=20, confidence=0.95, seed=0, workers=None, n_portfolios=10000):
+    # Bootstrap intervals (n_resamples block bootstrap resamples) and random portfolio percentiles (n_portfolios random
+    # portfolios of each kind) of every sector's compounded effects, one row per sector
+    combined_df, _ = data.get_attribution_data(prepared)
+    security_df = data.get_security_level_portfolio_data(prepared, data.get_benchmark_data(prepared))
+
+    bootstrap = bootstrap_sector_effects(combined_df, n_resamples, block_length, confidence, seed, workers)
+    random_portfolios = random_portfolio_sector_effects(combined_df, security_df, n_portfolios, seed, workers)
+    return bootstrap.merge(random_portfolios.drop(columns=viz_data.EFFECT_COLUMNS), on='GICS Sector')
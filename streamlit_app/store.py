@@ -0,0 +1,187 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import functools
+import pandas as pd
+import cache
+import utils
+import data
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional, e.g. it is not part of the stlite desktop build. Entries are then pickled
+    feather = None
+
+# Under Pyodide (the stlite desktop build) the store lives in /mnt, and only when /mnt is an IndexedDB backed mount
+# (IDBFS), so parsed workbooks survive restarts of the app. Newer @stlite/desktop releases mount one from the
+# stlite.desktop.idbfsMountpoints setting of package.json, 0.31.0 has no such setting. Anywhere else the file system
+# is in memory, where the store would only hold a second copy of the frames. Browser storage is smaller than a disk.
+# Files on IDBFS are written to memory first, see sync_filesystem
+IS_PYODIDE = sys.platform == 'emscripten'
+PYODIDE_MOUNT = '/mnt'
+PYODIDE_STORE_DIR = PYODIDE_MOUNT + '/brinson_attribution'
+PYODIDE_MAX_BYTES = 256 * 1024 ** 2
+
+DEFAULT_STORE_DIR = os.environ.get('BRINSON_STORE_DIR', PYODIDE_STORE_DIR if IS_PYODIDE else
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'brinson_attribution'))
+
+FILE_FORMATS = {'feather': '.feather', 'pickle': '.pkl'}
+
+def is_indexeddb_mount(path):
+    # Whether path is on an IDBFS mount of the Pyodide file system
+    import pyodide_js
+    try:
+        node = pyodide_js.FS.lookupPath(path).node
+    except Exception:  # A JavaScript error, the path does not exist
+        return False
+    return node.mount.type == pyodide_js.FS.filesystems.IDBFS
+
+def sync_filesystem():
+    # Copies the in-memory IDBFS files to IndexedDB (FS.syncfs), so a new entry survives the app being closed right
+    # after the upload. Asynchronous, a failed sync only loses cached entries. Nothing to do outside Pyodide
+    if not IS_PYODIDE:
+        return
+    import pyodide_js
+    from pyodide.ffi import create_once_callable
+    pyodide_js.FS.syncfs(False, create_once_callable(lambda error: None))
+
+class FrameStore:
+    """
+    On-disk store of the prepared long format frames of a workbook, keyed by workbook hash.
+
+    Each entry is a directory of uncompressed Feather files, so later loads memory-map them instead of parsing
+    the XLSX file. Without pyarrow the frames are pickled instead. Once the store grows past max_bytes the least
+    recently used entries are removed.
+    """
+    def __init__(self, root=DEFAULT_STORE_DIR, max_bytes=2 * 1024 ** 3, file_format=None):
+        file_format = file_format or ('feather' if feather is not None else 'pickle')
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown store format: {file_format}")
+        if file_format == 'feather' and feather is None:
+            raise ImportError("pyarrow is required for the feather store format")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.file_format = file_format
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry_path(key))
+
+    def keys(self):
+        return [name for name in os.listdir(self.root) if not name.startswith('.') and os.path.isdir(self._entry_path(name))]
+
+    def entry_size(self, key):
+        path = self._entry_path(key)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    @property
+    def total_bytes(self):
+        return sum(self.entry_size(key) for key in self.keys())
+
+    def get(self, key):
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            return None
+
+        frames = {}
+        for file_name in os.listdir(path):
+            name, extension = os.path.splitext(file_name)
+            if extension == FILE_FORMATS['pickle']:
+                frames[name] = pd.read_pickle(os.path.join(path, file_name))
+            elif feather is None:
+                # An entry written by a build with pyarrow, parsed again and rewritten by the caller
+                return None
+            else:
+                table = feather.read_table(os.path.join(path, file_name), memory_map=True)
+                frames[name] = table.to_pandas(split_blocks=True)
+
+        # The directory modification time doubles as the last access time for eviction
+        os.utime(path)
+        return frames
+
+    def put(self, key, frames):
+        # Write into a temporary directory first so a half-written entry is never visible to readers
+        tmp_path = tempfile.mkdtemp(prefix='.', dir=self.root)
+        for name, df in frames.items():
+            file_path = os.path.join(tmp_path, name + FILE_FORMATS[self.file_format])
+            if self.file_format == 'feather':
+                feather.write_feather(df, file_path, compression='uncompressed')
+            else:
+                df.to_pickle(file_path)
+
+        path = self._entry_path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        self.evict(keep=key)
+        sync_filesystem()
+
+    def remove(self, key):
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def evict(self, keep=None):
+        # Remove least recently used entries until the store fits into max_bytes
+        entries = sorted(self.keys(), key=lambda k: os.path.getmtime(self._entry_path(k)))
+        sizes = {key: self.entry_size(key) for key in entries}
+        total = sum(sizes.values())
+        for key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+            total -= sizes[key]
+
+@functools.lru_cache(maxsize=None)
+def default_store():
+    # Created once per process, the app's reruns all share it. Returns None when the store directory cannot be
+    # created, or under Pyodide without an IndexedDB mount, in which case workbooks are always parsed
+    if IS_PYODIDE and not is_indexeddb_mount(PYODIDE_MOUNT):
+        return None
+    try:
+        return FrameStore(max_bytes=PYODIDE_MAX_BYTES) if IS_PYODIDE else FrameStore()
+    except OSError:
+        return None
+
+def warm(directory, store):
+    # Parse every workbook in the directory that is not in the store yet
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.xlsx') or file_name.startswith('~$'):
+            continue
+        path = os.path.join(directory, file_name)
+        key = cache.hash_bytes(utils.read_file_bytes(path))
+        if data.store_key(key) in store:
+            print(f"cached  {file_name}")
+            continue
+        data.load_prepared_data(path, store)
+        print(f"stored  {file_name}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the persistent store of parsed performance workbooks.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help="Store directory")
+    parser.add_argument('--max-gb', type=float, default=2.0, help="Maximum size of the store in gigabytes")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    warm_parser = subparsers.add_parser('warm', help="Pre-parse every workbook in a directory into the store")
+    warm_parser.add_argument('directory')
+    subparsers.add_parser('evict', help="Remove least recently used entries until the store fits into --max-gb")
+    subparsers.add_parser('clear', help="Remove every entry from the store")
+
+    args = parser.parse_args(argv)
+    store = FrameStore(args.store, max_bytes=int(args.max_gb * 1024 ** 3))
+
+    if args.command == 'warm':
+        warm(args.directory, store)
+    elif args.command == 'evict':
+        store.evict()
+    elif args.command == 'clear':
+        for key in store.keys():
+            store.remove(key)
+
+if __name__ == "__main__":
+    sys.exit(main())
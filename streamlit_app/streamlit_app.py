@@ -1,84 +1,292 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import visualizations as viz
 import data as data
 import visualization_data as viz_data
 import utils
-import time
+import cache
+import store
+import ingest
+import profiling
+import periods
+import downsampling
+import inspect
 import datetime
 
+# The desktop build runs the Streamlit bundled with @stlite/desktop 0.31.0 (package.json). Widgets and arguments are
+# kept to those of Streamlit 1.18, the first release with everything the app already used there (use_container_width
+# of st.download_button). Newer ones like st.toggle (1.26) or the hide_index of st.dataframe (1.23) are not used
+
+def load_prepared_data(uploads, upload_hashes, start_date=None, end_date=None, sectors=None):
+    # Either a single workbook or one CSV / Parquet file per dataset. The store looks the workbook up under its hash
+    # from cache.hash_uploads and cuts the selected dates and sectors from the stored frames, only without a store
+    # are they pushed into the workbook read (see data.load_prepared_data)
+    if 'performance_data' in uploads:
+        return data.load_prepared_data(uploads['performance_data'], store.default_store(), start_date, end_date, sectors,
+                                       key=dict(upload_hashes)['performance_data'])
+    return ingest.load_datasets(uploads, start_date, end_date, sectors)
+
+def compute_results(uploads, upload_hashes, start_date=None, end_date=None, sectors=None):
+    # Fetch sector and daily level data. The chart data is derived from them lazily, see CHARTS
+    prepared = load_prepared_data(uploads, upload_hashes, start_date, end_date, sectors)
+    combined_df, daily_level_data = data.get_attribution_data(prepared, sectors=sectors)
+
+    return {'combined_df': combined_df, 'daily_level_data': daily_level_data}
+
+# Title, function returning the chart data from the results, name of the visualizations function plotting it, and
+# whether the chart is shown before it is switched on. A chart and its data are only computed while its section is on,
+# the data is memoized in visualization_data under the key of the results
+CHARTS = [
+    ("Compounded Returns",
+     lambda results: viz_data.daily_compounded_returns(results['daily_level_data'], cache_key=results['cache_key']),
+     'plot_daily_compounded_returns', True),
+    ("Sector Effects - Allocation and Selection",
+     lambda results: viz_data.get_compounded_sector_effects(results['combined_df'], cache_key=results['cache_key']),
+     'plot_allocation_effects_per_sector', True),
+    ("Portfolio vs Benchmark Average Sector Weights",
+     lambda results: viz_data.average_sector_weights(results['combined_df'], cache_key=results['cache_key']),
+     'plot_sector_weights_comparison', False),
+    ("Attribution Effects and Excess Returns Over Time",
+     lambda results: viz_data.compounded_allocation_effects(results['daily_level_data'], cache_key=results['cache_key']),
+     'plot_attribution_effects', False),
+]
+
+def select_window(chart_data, title):
+    # Date window of a long daily chart. The plots downsample only the rows in the window, so narrowing it brings back
+    # the full resolution
+    first, last = chart_data.index.min().date(), chart_data.index.max().date()
+    start, end = st.slider("Zoom", min_value=first, max_value=last, value=(first, last), key=title + ' zoom')
+    return chart_data.loc[pd.Timestamp(start):pd.Timestamp(end)]
+
+def show_chart(results, title, get_chart_data, plot_name, shown):
+    # Plotly is only imported with the first chart, which shortens the startup of the desktop build (Pyodide)
+    import visualizations as viz
+    st.subheader(title)
+    if not st.checkbox("Show", value=shown, key=title):
+        return
+
+    chart_data = get_chart_data(results)
+    if isinstance(chart_data.index, pd.DatetimeIndex) and len(chart_data) > downsampling.DOWNSAMPLE_THRESHOLD:
+        chart_data = select_window(chart_data, title)
+    fig = getattr(viz, plot_name)(chart_data)
+    st.plotly_chart(fig, use_container_width=True)
+
+    report = viz.downsampling_report(fig)
+    if report is not None and report['method'] is not None:
+        st.caption(f"Showing {report['points_after']:,} of {report['points_before']:,} points "
+                   f"({report['bytes_before'] / 1024:,.0f} KB of chart data reduced to {report['bytes_after'] / 1024:,.0f} KB). "
+                   "Narrow the zoom window for full resolution.")
+
+def get_results(uploads, upload_hashes, start_date=None, end_date=None, sectors=None):
+    # Reruns on the same files and filters are served from the cache instead of recomputing the attribution
+    key = cache.make_key(upload_hashes, start_date=start_date, end_date=end_date, sectors=sectors)
+    results = cache.results_cache.get(key)
+
+    if results is None:
+        with st.spinner("Loading..."):
+            results = compute_results(uploads, upload_hashes, start_date, end_date, list(sectors) if sectors is not None else None)
+        # The memoized chart data and exports of these results are keyed on it as well
+        results['cache_key'] = key
+        cache.results_cache.put(key, results)
+
+    return results
+
+def get_bounds(uploads, upload_hashes):
+    # Dates and sectors of the uploads from a scan of the small sheets and the portfolio headers, so the filters are
+    # known before any attribution is run
+    key = cache.make_key(upload_hashes)
+    bounds = cache.bounds_cache.get(key)
+    if bounds is None:
+        if 'performance_data' in uploads:
+            bounds = data.read_workbook_bounds(uploads['performance_data'])
+        else:
+            bounds = ingest.load_bounds(uploads)
+        cache.bounds_cache.put(key, bounds)
+    return bounds
+
+def select_filters(bounds):
+    # Date range and sector widgets. Returns None for a filter left at its full extent
+    dates, all_sectors = bounds
+
+    with st.sidebar:
+        st.subheader('Filters')
+        date_range = st.date_input("Date Range", value=(dates.min().date(), dates.max().date()),
+                                   min_value=dates.min().date(), max_value=dates.max().date())
+        selected_sectors = st.multiselect("Sectors", all_sectors, default=all_sectors)
+
+    # The date input returns a single date while the end of the range is being picked
+    start_date, end_date = date_range if len(date_range) == 2 else (date_range[0], None)
+    start_date = pd.Timestamp(start_date) if pd.Timestamp(start_date) > dates.min() else None
+    end_date = pd.Timestamp(end_date) if end_date is not None and pd.Timestamp(end_date) < dates.max() else None
+    sectors = tuple(selected_sectors) if selected_sectors and len(selected_sectors) < len(all_sectors) else None
+
+    return start_date, end_date, sectors
+
+# Period breakdowns offered in the app: label -> function of a periods.PeriodAttribution
+PERIODS = {
+    'Monthly': lambda period_attribution: period_attribution.calendar('M'),
+    'Quarterly': lambda period_attribution: period_attribution.calendar('Q'),
+    'Yearly': lambda period_attribution: period_attribution.calendar('Y'),
+    'MTD / QTD / YTD': lambda period_attribution: pd.concat([period_attribution.to_date(freq).assign(Period=label)
+                                                             for freq, label in [('M', 'MTD'), ('Q', 'QTD'), ('Y', 'YTD')]]),
+    'Rolling 1M': lambda period_attribution: period_attribution.rolling(1),
+    'Rolling 3M': lambda period_attribution: period_attribution.rolling(3),
+    'Rolling 12M': lambda period_attribution: period_attribution.rolling(12),
+}
+
+def show_table(df, label):
+    # The label column is shown as the index in place of the row numbers, without hide_index (see the top)
+    st.dataframe(df.set_index(label), use_container_width=True)
+
+def show_periods(results):
+    # Sub-period attribution from one pass over the daily results, only built while the section is on
+    st.subheader("Period Attribution")
+    if not st.checkbox("Show", value=False, key="Period Attribution"):
+        return
+    period = st.selectbox("Periods", list(PERIODS))
+    period_attribution = periods.PeriodAttribution(results['combined_df'], results['daily_level_data'])
+    table = PERIODS[period](period_attribution)
+    show_table(table, 'Period' if 'Period' in table else 'End Date')
+
+# Chart dataset functions of visualization_data and the results frame each one takes
+CHART_DATA = [('daily_compounded_returns', 'daily_level_data'), ('get_compounded_sector_effects', 'combined_df'),
+              ('average_sector_weights', 'combined_df'), ('compounded_allocation_effects', 'daily_level_data')]
+
+def profile_run(uploads, upload_hashes, filters, memory=False):
+    # One uncached run of the attribution and of every chart dataset inside a profile. The chart functions are
+    # called unmemoized, a memo hit would not show their cost
+    with profiling.profile(memory) as report:
+        results = compute_results(uploads, upload_hashes, *filters)
+        for name, key in CHART_DATA:
+            with profiling.stage(name, results[key]) as record:
+                record.set_output(inspect.unwrap(getattr(viz_data, name))(results[key]))
+    return report
+
+def show_profiling(uploads, upload_hashes, filters):
+    # Optional panel with wall time, rows in / out and peak memory per pipeline stage
+    st.subheader('Profiling')
+    if not st.checkbox("Profile Pipeline"):
+        return
+    memory = st.checkbox("Trace Memory", help="Records peak memory per stage, makes the profiled run slower")
+    if st.button("Run Profile", use_container_width=True):
+        with st.spinner("Profiling..."):
+            st.session_state['profile_report'] = profile_run(uploads, upload_hashes, filters, memory)
+
+    report = st.session_state.get('profile_report')
+    if report is not None:
+        show_table(report.to_frame(), 'stage')
+        st.download_button(label='Download Profile', data=report.to_json(), file_name='profile.json', mime='application/json',
+                           use_container_width=True)
+
+# Download name -> (file name, function returning the frames to export as sheet name -> dataframe)
+EXPORTS = {
+    'Sector-Level Data': ('sector_data', lambda results: {'Sector Level Data': results['combined_df'].set_index('Date')}),
+    'Daily-Level Data': ('daily_data', lambda results: {'Daily Data': results['daily_level_data']}),
+    'Attribution Effects': ('attribution_data', lambda results: {'Attribution Data': viz_data.compounded_allocation_effects(
+        results['daily_level_data'], cache_key=results['cache_key'])}),
+    'All Data': ('attribution_results', lambda results: all_export_sheets(results)),
+}
+
+def all_export_sheets(results):
+    # Every export as one multi-sheet workbook, so the data is written once
+    sheets = {}
+    for name in ['Sector-Level Data', 'Daily-Level Data', 'Attribution Effects']:
+        sheets.update(EXPORTS[name][1](results))
+    return sheets
+
+EXPORT_FORMATS = {
+    'Excel': ('xlsx', 'application/vnd.ms-excel'),
+    'CSV': ('csv', 'text/csv'),
+}
+# Only offered where pyarrow is installed
+if utils.HAS_PYARROW:
+    EXPORT_FORMATS['Parquet'] = ('parquet', 'application/octet-stream')
+
+def export_file(sheets, export_format, cache_key=None):
+    # Excel exports are one workbook with a sheet per frame. CSV and Parquet hold a single frame
+    if export_format == 'Excel':
+        return utils.to_excel_workbook(sheets, cache_key=cache_key)
+    df = sheets[next(iter(sheets))]
+    return (utils.to_csv_download if export_format == 'CSV' else utils.to_parquet_download)(df, cache_key=cache_key)
+
+def show_downloads(results):
+    # Files are only generated once a download is prepared. They are memoized under the key of the results and the
+    # export, so the reruns caused by clicking the download button reuse the prepared file
+    st.subheader('Download Attribution Data')
+    name = st.selectbox("Data", list(EXPORTS))
+    formats = ['Excel'] if name == 'All Data' else list(EXPORT_FORMATS)
+    # Frames longer than an Excel sheet can only be exported as CSV (or Parquet)
+    if name in ('Sector-Level Data', 'All Data') and len(results['combined_df']) >= utils.EXCEL_MAX_ROWS:
+        formats.remove('Excel')
+    if not formats:
+        st.caption(f"The sector level data is too large for Excel, download it separately as {' or '.join(f for f in EXPORT_FORMATS if f != 'Excel')}.")
+        return
+    export_format = st.radio("Format", formats, horizontal=True)
+
+    request = (name, export_format)
+    if st.button("Prepare Download", use_container_width=True):
+        st.session_state['export_request'] = request
+
+    if st.session_state.get('export_request') == request:
+        file_name, get_sheets = EXPORTS[name]
+        extension, mime = EXPORT_FORMATS[export_format]
+        with st.spinner("Preparing..."):
+            content = export_file(get_sheets(results), export_format, cache_key=(results['cache_key'], name))
+        st.download_button(label=f'Download {name}', data=content, file_name=f'{file_name}.{extension}', mime=mime, use_container_width=True)
+
 def main():
     #! App configuration
     st.set_page_config(layout='wide', page_title='Performance Attribution', initial_sidebar_state='expanded')
 
     # Show the description of the app before any the file has been uploaded
-    if 'performance_data' not in st.session_state or st.session_state.performance_data is None:
+    upload_keys = ['performance_data'] + list(ingest.DATASETS)
+    if not any(st.session_state.get(key) is not None for key in upload_keys):
         st.title('Performance Attribution Analysis')
         st.markdown("""
             This app performs performance attribution analysis, comparing portfolio performance against a benchmark.
-            Upload the relevant Excel files to the fields in the side bar to get started.
+            Upload the relevant Excel, CSV or Parquet files to the fields in the side bar to get started.
         """)
 
     # Sidebar for file upload
     with st.sidebar:
         st.header('Upload Data Files')
-        performance_data = st.file_uploader("Performance Data", type=['xlsx'], key="performance_data")
-        
-    # Check if the file has been uploaded and display the results
-    if performance_data is not None:
+        input_format = st.radio("Input Format", ['Excel Workbook', 'CSV / Parquet Files'], horizontal=True)
 
-        with st.spinner("Loading..."):
-            time.sleep(3)
+        if input_format == 'Excel Workbook':
+            performance_data = st.file_uploader("Performance Data", type=['xlsx'], key="performance_data")
+            uploads = {'performance_data': performance_data} if performance_data is not None else None
+        else:
+            files = {name: st.file_uploader(sheet_name, type=['csv', 'parquet'], key=name)
+                     for name, (sheet_name, _) in ingest.DATASETS.items()}
+            uploads = files if all(file is not None for file in files.values()) else None
 
-        # Fetch sector and daily level data
-        combined_df, daily_level_data = data.get_data(performance_data)
+    # Check if the files have been uploaded and display the results
+    if uploads is not None:
+
+        # The uploads are hashed once per rerun, for the bounds, the results and the store. Only the selected dates
+        # and sectors are run
+        upload_hashes = cache.hash_uploads(uploads)
+        filters = select_filters(get_bounds(uploads, upload_hashes))
+        results = get_results(uploads, upload_hashes, *filters)
 
         st.title("Analysis Results")
 
         col1, col2 = st.columns(2)
 
         with col1:
-            st.subheader("Compounded Returns")
-            st.plotly_chart(viz.plot_daily_compounded_returns(viz_data.daily_compounded_returns(daily_level_data)), use_container_width=True)
+            show_chart(results, *CHARTS[0])
 
         with col2:
-            st.subheader("Sector Effects - Allocation and Selection")
-            st.plotly_chart(viz.plot_allocation_effects_per_sector(viz_data.get_compounded_sector_effects(combined_df)), use_container_width=True)
+            show_chart(results, *CHARTS[1])
 
-        st.subheader("Portfolio vs Benchmark Average Sector Weights")
-        st.plotly_chart(viz.plot_sector_weights_comparison(viz_data.average_sector_weights(combined_df)), use_container_width=True)
+        for chart in CHARTS[2:]:
+            show_chart(results, *chart)
 
-        st.subheader("Attribution Effects and Excess Returns Over Time")
-        st.plotly_chart(viz.plot_attribution_effects(viz_data.compounded_allocation_effects(daily_level_data)), use_container_width=True)
+        show_periods(results)
 
         with st.sidebar:
-            st.subheader('Download Attribution Data')
-
-            st.download_button(
-                label='Download Sector-Level Data',
-                data=utils.to_excel_download(combined_df.set_index('Date'), 'Sector Level Data'),
-                file_name='sector_data.xlsx',
-                mime='application/vnd.ms-excel',
-                use_container_width=True
-            )
-
-            st.download_button(
-                label='Download Daily-Level Data',
-                data=utils.to_excel_download(daily_level_data, 'Daily Data'),
-                file_name='daily_data.xlsx',
-                mime='application/vnd.ms-excel',
-                use_container_width=True
-            )
-
-            st.download_button(
-                label='Download Attribution Effects',
-                data=utils.to_excel_download(viz_data.compounded_allocation_effects(daily_level_data), 'Attribution Data'),
-                file_name='attribution_data.xlsx',
-                mime='application/vnd.ms-excel',
-                use_container_width=True
-            )
-
+            show_downloads(results)
+            show_profiling(uploads, upload_hashes, filters)
 
     else:
         st.info("Please upload required files and select the dates to proceed with the analysis.")
@@ -2,6 +2,8 @@ import datetime as dt
 import pandas as pd
 import numpy as np
 import io
+import importlib.util
+import cache
 
 def return_datetime_column(df_series):
     # Turn the df_series into a datetime 
@@ -12,11 +14,76 @@ def return_datetime_column(df_series):
 def calculate_compounded_change(series_from_df):
     return np.exp(np.log(1 + series_from_df).cumsum()) - 1
 
+# Largest sheet Excel can open, bigger frames can only be exported as CSV or Parquet
+EXCEL_MAX_ROWS = 1_048_576
+
+# Parquet exports need pyarrow, which e.g. the stlite desktop build does not have. Checked without importing it
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+def write_excel_sheet(workbook, dataframe, sheet_name, index=True):
+    # Rows are written in order, which xlsxwriter's constant_memory mode requires. pandas' to_excel writes column by column
+    # Index levels first, named as reset_index would name them
+    levels = range(dataframe.index.nlevels) if index else []
+    names = [name if name is not None else 'index' if len(levels) == 1 else f'level_{i}' for i, name in enumerate(dataframe.index.names)] if index else []
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(column) for column in names + list(dataframe.columns)], workbook.add_format({'bold': True}))
+
+    # The index levels and columns are iterated side by side, one Python value at a time, so no converted copy of the
+    # frame is built. Missing values (NaN and NaT are not equal to themselves) become None, which xlsxwriter leaves blank
+    columns = [dataframe.index.get_level_values(i) for i in levels] + [dataframe.iloc[:, i] for i in range(dataframe.shape[1])]
+    for row, values in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row, 0, [None if value != value else value for value in values])
+
+def write_excel_workbook(target, sheets, index=True):
+    """
+    Writes a dict of sheet name -> dataframe to one workbook at target (a path or file-like object).
+    constant_memory keeps only the current row in memory.
+    """
+    # Imported here so the library modules load without the Excel writer, see benchmark_import in tools/benchmark.py
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    try:
+        for sheet_name, dataframe in sheets.items():
+            write_excel_sheet(workbook, dataframe, sheet_name, index)
+    finally:
+        workbook.close()
+
+@cache.memoize(cache.export_cache)
+def to_excel_workbook(sheets, index=True):
+    """
+    Converts a dict of sheet name -> dataframe to the bytes of one Excel file. Memoized per cache_key, see cache.memoize.
+    """
+    output = io.BytesIO()
+    write_excel_workbook(output, sheets, index)
+    return output.getvalue()
+
 def to_excel_download(dataframe, sheet_name='Sheet1'):
     """
     Converts a dataframe to an Excel file in memory and returns the bytes.
     """
+    return to_excel_workbook({sheet_name: dataframe})
+
+@cache.memoize(cache.export_cache)
+def to_csv_download(dataframe):
+    return dataframe.to_csv().encode()
+
+@cache.memoize(cache.export_cache)
+def to_parquet_download(dataframe):
+    # Needs pyarrow, see HAS_PYARROW
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        dataframe.to_excel(writer, sheet_name=sheet_name, index=True)
-    return output.getvalue()
\ No newline at end of file
+    dataframe.to_parquet(output)
+    return output.getvalue()
+
+def read_file_bytes(file):
+    """
+    Returns the raw bytes of a file path or file-like object (e.g. a Streamlit upload) without consuming it.
+    """
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    if hasattr(file, 'read'):
+        position = file.tell()
+        content = file.read()
+        file.seek(position)
+        return content
+    with open(file, 'rb') as f:
+        return f.read()
@@ -2,8 +2,17 @@ import pandas as pd
 import numpy as np
 import utils
 import attribution
+import cache
+import profiling
+
+EFFECT_COLUMNS = ['Allocation Effect', 'Selection Effect']
+
+# The chart datasets are memoized per (cache_key, parameters) when the caller passes a cache_key, so a chart opened
+# again or a download of the same data reuses the earlier result. Profiled calls include the memo lookups
 
 # Function that returns daily compounded returns 
+@profiling.profiled
+@cache.memoize(cache.chart_cache)
 def daily_compounded_returns(daily_data):
     # calculate the daily compounded returns for the portfolio and benchmark
     p_comp_returns = utils.calculate_compounded_change(daily_data['Portfolio Weighted Returns'])
@@ -17,39 +26,32 @@ def daily_compounded_returns(daily_data):
     
     return comp_returns
 
-def average_sector_weights(sector_level_data):
+@profiling.profiled
+@cache.memoize(cache.chart_cache)
+def average_sector_weights(sector_level_data, group_by='GICS Sector'):
     # Calculate the average sector weights for the portfolio and benchmark
-    p_avg_sector_weights = sector_level_data.groupby('GICS Sector')['Portfolio Weight'].mean()
-    b_avg_sector_weights = sector_level_data.groupby('GICS Sector')['Benchmark Weight'].mean()
+    p_avg_sector_weights = sector_level_data.groupby(group_by)['Portfolio Weight'].mean()
+    b_avg_sector_weights = sector_level_data.groupby(group_by)['Benchmark Weight'].mean()
     
     # Return as a separate dataframe
     avg_sector_weights = pd.DataFrame({'Portfolio Average Sector Weight': p_avg_sector_weights, 'Benchmark Average Sector Weight': b_avg_sector_weights})
     
     return avg_sector_weights
 
-def get_last_compounded_effects(df, effect_column):
-    last_effects = {}
-    for sector in df['GICS Sector'].unique():
-        sector_df = df[df['GICS Sector'] == sector]
-        last_effects[sector] = (1 + sector_df[effect_column]).cumprod().iloc[-1] - 1
-    return last_effects
-
-def get_compounded_sector_effects(df):
-    # Manually calculate the last compounded effect for each sector
-    allocation_last = get_last_compounded_effects(df, 'Allocation Effect')
-    selection_last = get_last_compounded_effects(df, 'Selection Effect')
-    # interaction_last = get_last_compounded_effects(df, 'Interaction Effect')
-
-    # Combine the results into a single DataFrame
-    results_df = pd.DataFrame({
-        'GICS Sector': allocation_last.keys(),
-        'Allocation Effect': allocation_last.values(),
-        'Selection Effect': selection_last.values(),
-        # 'Interaction Effect': interaction_last.values()
-    })
+def get_last_compounded_effects(df, effect_columns=EFFECT_COLUMNS, group_by='GICS Sector'):
+    # Compounded effect over the whole period for every group and effect column in one grouped pass.
+    # group_by can be any classification column (or list of columns), groups keep their order of appearance
+    growth = df.assign(**{column: 1 + df[column] for column in effect_columns})
+    return growth.groupby(group_by, sort=False)[effect_columns].prod() - 1
 
-    return results_df
+@profiling.profiled
+@cache.memoize(cache.chart_cache)
+def get_compounded_sector_effects(df, group_by='GICS Sector'):
+    # interaction effect can be added to the effect columns if it is used
+    return get_last_compounded_effects(df, EFFECT_COLUMNS, group_by).reset_index()
 
+@profiling.profiled
+@cache.memoize(cache.chart_cache)
 def compounded_allocation_effects(df):
     # Create a dataframe from two compounded returns
     comp_change_df = pd.DataFrame({
@@ -1,6 +1,7 @@
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+import downsampling
 
 # Defining a consistent color palette
 color_palette = {
@@ -12,7 +13,18 @@ color_palette = {
     'Excess Returns': 'rgba(184,214,225,255)' 
 }
 
-def plot_daily_compounded_returns(df):
+def add_downsampling_report(fig, report):
+    # The points and payload before and after downsampling travel with the figure, see downsampling.downsample
+    fig.update_layout(meta={'downsampling': report})
+    return fig
+
+def downsampling_report(fig):
+    return (fig.layout.meta or {}).get('downsampling')
+
+def plot_daily_compounded_returns(df, max_points=downsampling.DOWNSAMPLE_THRESHOLD, method='lttb'):
+    # Long histories are downsampled to max_points per series, max_points=None plots every day
+    df, report = downsampling.downsample(df, ['Portfolio Compounded Returns', 'Benchmark Compounded Returns'], max_points, method)
+
     # Updated color scheme
     portfolio_color = color_palette['Portfolio']
     benchmark_color = color_palette['Benchmark']
@@ -51,7 +63,7 @@ def plot_daily_compounded_returns(df):
         )
     )
 
-    return fig
+    return add_downsampling_report(fig, report)
 
 # Plot for sector weight comparison
 def plot_sector_weights_comparison(df):
@@ -130,13 +142,14 @@ def plot_allocation_effects_per_sector(df):
 
     return fig
 
-def plot_attribution_effects(df):
+def plot_attribution_effects(df, max_points=downsampling.DOWNSAMPLE_THRESHOLD, method='lttb'):
     # Dictionary to map the old effect names to the new shorter names
     effect_names_map = {
         'Allocation Effect': 'Allocation',
         'Selection Effect': 'Selection',
         'Excess Returns': 'Excess Returns'  # Keeping this the same
     }
+    df, report = downsampling.downsample(df, list(effect_names_map), max_points, method)
 
     traces = []
     for effect in effect_names_map.keys():
@@ -155,4 +168,4 @@ def plot_attribution_effects(df):
         hovermode='x unified'
     )
 
-    return fig
+    return add_downsampling_report(fig, report)
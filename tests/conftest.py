@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the app modules and the tools (e.g. benchmark.make_synthetic_prepared) as flat modules, the way
+# the tools do. app_path then adds the streamlit_app directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import app_path  # noqa: E402,F401
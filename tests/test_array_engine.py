@@ -0,0 +1,26 @@
+import pytest
+import pandas as pd
+import benchmark
+import data
+
+# The dense array engine must give the same results as the pandas pipeline, up to floating point summation order
+
+TOLERANCE = {'check_exact': False, 'rtol': 1e-9, 'atol': 1e-12}
+
+@pytest.mark.parametrize('n_instruments, n_days, n_sectors, multi_industry_fraction, seed',
+                         [(60, 80, 11, 0.1, 0), (200, 120, 11, 0.3, 3), (50, 40, 5, 0.0, 1)])
+def test_numpy_engine_matches_pandas(n_instruments, n_days, n_sectors, multi_industry_fraction, seed):
+    prepared = benchmark.make_synthetic_prepared(n_instruments, n_days, n_sectors, multi_industry_fraction, seed)
+    pandas_combined, pandas_daily = data.get_attribution_data(prepared, 'pandas')
+    numpy_combined, numpy_daily = data.get_attribution_data(prepared, 'numpy')
+
+    pd.testing.assert_frame_equal(pandas_combined, numpy_combined, **TOLERANCE)
+    pd.testing.assert_frame_equal(pandas_daily, numpy_daily, **TOLERANCE)
+
+def test_numpy_engine_matches_pandas_from_workbook():
+    workbook = benchmark.make_synthetic_workbook(60, 80, 11, 0.1, 0)
+    pandas_combined, pandas_daily = data.get_data(workbook)
+    numpy_combined, numpy_daily = data.get_data(workbook, engine='numpy')
+
+    pd.testing.assert_frame_equal(pandas_combined, numpy_combined, **TOLERANCE)
+    pd.testing.assert_frame_equal(pandas_daily, numpy_daily, **TOLERANCE)
@@ -0,0 +1,100 @@
+import io
+import pytest
+import numpy as np
+import pandas as pd
+import openpyxl
+import benchmark
+import data
+import currency
+import store
+
+# With weights adding up to one, allocation, selection and the two currency effects add up to the excess return in
+# the base currency on every date, whether the benchmark is in the base currency or has currency weights of its own
+
+TOLERANCE = {'check_exact': False, 'check_dtype': False, 'rtol': 1e-9, 'atol': 1e-12}
+
+ARGS = (60, 50, 11, 0.1, 5)
+
+def add_benchmark_currency_weights(prepared, seed=0):
+    # Random benchmark weights over every currency, including the base currency, adding up to one on each date
+    rng = np.random.default_rng(seed)
+    currencies = ['EUR'] + sorted(prepared['fx_rates']['Ccy'].unique())
+    dates = np.sort(prepared['benchmark_returns']['Date'].unique())
+    weights = rng.dirichlet(np.ones(len(currencies)), len(dates))
+    return dict(prepared, benchmark_currency_weights=pd.DataFrame({
+        'Date': np.repeat(dates, len(currencies)), 'Ccy': np.tile(currencies, len(dates)), 'Weight': weights.ravel()}))
+
+@pytest.fixture(scope='module')
+def prepared():
+    return benchmark.make_synthetic_currencies(benchmark.make_synthetic_prepared(*ARGS), n_currencies=4, seed=1)
+
+@pytest.mark.parametrize('benchmark_currencies', [False, True])
+def test_effects_add_up_to_the_excess_return(prepared, benchmark_currencies):
+    if benchmark_currencies:
+        prepared = add_benchmark_currency_weights(prepared)
+    combined_df, daily_level_data, currency_df = currency.get_currency_attribution_data(prepared)
+
+    # The currencies move, so the currency effects are not trivially zero
+    assert (daily_level_data['Currency Allocation Effect'].abs() > 1e-6).any()
+    assert (daily_level_data['Currency Interaction Effect'].abs() > 1e-8).any()
+    np.testing.assert_allclose(daily_level_data['Sum of Effects'], daily_level_data['Excess Return'], rtol=1e-9, atol=1e-12)
+
+    # The per currency effects add up to the daily currency effects
+    daily_currency = currency_df.groupby('Date')[currency.CURRENCY_EFFECT_COLUMNS].sum().reindex(daily_level_data.index, fill_value=0)
+    pd.testing.assert_frame_equal(daily_currency, daily_level_data[currency.CURRENCY_EFFECT_COLUMNS], **TOLERANCE)
+
+def wide_sheet(df, value_name):
+    # Long (Date, Ccy, value) frame as a sheet with a date column and one column per currency
+    wide = df.pivot(index='Date', columns='Ccy', values=value_name)
+    return [['Date'] + list(wide.columns)] + [[date.strftime('%d.%m.%Y')] + list(row) for date, row in zip(wide.index, wide.values)]
+
+def currency_workbook(prepared):
+    # The synthetic workbook with the instrument currencies and the two currency sheets of prepared
+    workbook = openpyxl.load_workbook(benchmark.make_synthetic_workbook(*ARGS))
+    instrument_currency = prepared['portfolio_weights'].drop_duplicates('Instrument').set_index('Instrument')['Ccy']
+    for sheet_name in ('Portfolio Weights', 'Portfolio Returns'):
+        sheet = workbook[sheet_name]
+        header = [cell.value for cell in sheet[1]]
+        ccy_row = next(row for row in sheet.iter_rows(min_row=2) if row[0].value == 'Ccy')
+        for column, instrument in enumerate(header):
+            if instrument in instrument_currency.index:
+                ccy_row[column].value = instrument_currency[instrument]
+
+    for sheet_name, name, value_name in ((data.FX_SHEET_NAME, 'fx_rates', 'Rate'),
+                                         (data.BENCHMARK_CURRENCY_SHEET_NAME, 'benchmark_currency_weights', 'Weight')):
+        sheet = workbook.create_sheet(sheet_name)
+        for row in wide_sheet(prepared[name], value_name):
+            sheet.append(row)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+def test_currency_sheets_read_with_the_workbook(prepared, tmp_path, monkeypatch):
+    prepared = add_benchmark_currency_weights(prepared)
+    workbook = currency_workbook(prepared)
+    expected = currency.get_currency_attribution_data(prepared)
+
+    with pytest.raises(ValueError):
+        currency.get_currency_attribution(benchmark.make_synthetic_workbook(*ARGS))
+
+    # The workbook is opened once, for all the sheets
+    load_workbook = openpyxl.load_workbook
+    opened = []
+    monkeypatch.setattr(openpyxl, 'load_workbook', lambda *args, **kwargs: opened.append(1) or load_workbook(*args, **kwargs))
+    frame_store = store.FrameStore(str(tmp_path))
+    for results in (currency.get_currency_attribution(workbook), currency.get_currency_attribution(workbook, store=frame_store),
+                    currency.get_currency_attribution(workbook, store=frame_store)):
+        for result, expected_result in zip(results, expected):
+            pd.testing.assert_frame_equal(result, expected_result, **TOLERANCE)
+    # Without the store and on the store miss, the hit parses nothing
+    assert len(opened) == 2
+
+    # The filtered read streams the currency sheets in the same pass as well
+    start_date = prepared['benchmark_returns']['Date'].sort_values().iloc[20]
+    filtered = currency.get_currency_attribution(workbook, start_date=start_date)
+    expected = currency.get_currency_attribution_data(data.filter_prepared_data(prepared, start_date))
+    for result, expected_result in zip(filtered, expected):
+        pd.testing.assert_frame_equal(result, expected_result, **TOLERANCE)
+    assert len(opened) == 3
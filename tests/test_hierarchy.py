@@ -0,0 +1,96 @@
+import io
+import pytest
+import numpy as np
+import pandas as pd
+import openpyxl
+import benchmark
+import data
+import hierarchy
+import store
+
+# Every higher level is rolled up from the lowest level run. It must give the same results as running the pipeline
+# directly on inputs labelled with the higher level categories, whose benchmark weights are the sums of the child
+# weights and whose benchmark returns are the child returns weighted by the lagged child weights.
+#
+# Multi-industry instruments are left out: their split parts earn the benchmark return of their own lowest level
+# category, which a direct run at a higher level cannot reproduce.
+
+TOLERANCE = {'check_exact': False, 'rtol': 1e-9, 'atol': 1e-12}
+
+ARGS = (60, 40, 11, 0.0, 3)
+
+def make_classification(categories):
+    return pd.DataFrame({
+        'GICS Industry': categories,
+        'GICS Industry Group': [f'Group {i % 4}' for i in range(len(categories))],
+        'GICS Sector': [f'Sector {i % 2}' for i in range(len(categories))],
+    })
+
+def direct_prepared(prepared, parents):
+    # The prepared frames of the same data classified at the level of parents (lowest level category -> parent)
+    benchmark_df = prepared['benchmark_weights'].merge(prepared['benchmark_returns'], on=['Date', 'GICS Sector']).sort_values('Date')
+    benchmark_df['Lagged Weight'] = benchmark_df.groupby('GICS Sector')['Weight'].shift(1).fillna(0)
+    benchmark_df['Weighted Return'] = benchmark_df['Lagged Weight'] * benchmark_df['Return']
+    benchmark_df['GICS Sector'] = benchmark_df['GICS Sector'].map(parents)
+    grouped = benchmark_df.groupby(['Date', 'GICS Sector'])[['Weight', 'Lagged Weight', 'Weighted Return', 'Return']]
+    level = grouped.agg({'Weight': 'sum', 'Lagged Weight': 'sum', 'Weighted Return': 'sum', 'Return': 'mean'}).reset_index()
+    # Without lagged weights (the first date) the parent return is the plain average, as in hierarchy.roll_up
+    level['Return'] = np.where(level['Lagged Weight'] != 0, level['Weighted Return'] / level['Lagged Weight'], level['Return'])
+
+    return dict(prepared,
+                portfolio_weights=prepared['portfolio_weights'].assign(**{'Sector 1': prepared['portfolio_weights']['Sector 1'].map(parents)}),
+                portfolio_returns=prepared['portfolio_returns'].assign(**{'Sector 1': prepared['portfolio_returns']['Sector 1'].map(parents)}),
+                benchmark_weights=level[['Date', 'GICS Sector', 'Weight']],
+                benchmark_returns=level[['Date', 'GICS Sector', 'Return']])
+
+@pytest.fixture(scope='module')
+def prepared():
+    return benchmark.make_synthetic_prepared(*ARGS)
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_levels_match_direct_runs(prepared, engine):
+    classification = make_classification(list(prepared['benchmark_returns']['GICS Sector'].unique()))
+    results = hierarchy.get_hierarchy_data(prepared, classification, engine)
+    assert list(results) == list(classification.columns)
+
+    for level in classification.columns[1:]:
+        parents = classification.set_index('GICS Industry')[level]
+        expected_df, expected_daily = data.get_attribution_data(direct_prepared(prepared, parents), engine)
+        level_df, level_daily = results[level]
+
+        level_df = level_df.rename(columns={level: 'GICS Sector'}).sort_values(['Date', 'GICS Sector'], ignore_index=True)
+        expected_df = expected_df.sort_values(['Date', 'GICS Sector'], ignore_index=True)
+        pd.testing.assert_frame_equal(level_df[expected_df.columns], expected_df, **TOLERANCE)
+        pd.testing.assert_frame_equal(level_daily[expected_daily.columns], expected_daily, **TOLERANCE)
+
+def workbook_with_classification(classification):
+    workbook = openpyxl.load_workbook(benchmark.make_synthetic_workbook(*ARGS))
+    sheet = workbook.create_sheet(data.CLASSIFICATION_SHEET_NAME)
+    sheet.append(list(classification.columns))
+    for row in classification.itertuples(index=False):
+        sheet.append(list(row))
+    output = io.BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+def test_classification_sheet_read_with_the_workbook(prepared, tmp_path, monkeypatch):
+    classification = make_classification(list(prepared['benchmark_returns']['GICS Sector'].unique()))
+    workbook = workbook_with_classification(classification)
+    expected = hierarchy.get_hierarchy_data(prepared, classification)
+
+    # The filtered read streams the sheet as well
+    filtered = data.read_performance_data(workbook, start_date='2015-01-10')
+    pd.testing.assert_frame_equal(data.prepare_performance_data(filtered)['classification'], classification)
+    with pytest.raises(ValueError):
+        hierarchy.get_hierarchy(benchmark.make_synthetic_workbook(*ARGS))
+
+    # The sheet comes from the single pass over the workbook and is stored with the other prepared frames
+    frame_store = store.FrameStore(str(tmp_path))
+    for attempt in range(2):
+        results = hierarchy.get_hierarchy(workbook, store=frame_store)
+        for level, (level_df, level_daily) in expected.items():
+            pd.testing.assert_frame_equal(results[level][0], level_df, **TOLERANCE)
+            pd.testing.assert_frame_equal(results[level][1], level_daily, **TOLERANCE)
+        # Later loads come from the store only
+        monkeypatch.setattr(pd, 'read_excel', None)
@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+import pandas as pd
+import benchmark
+import data
+import incremental
+import visualization_data as viz_data
+
+# Days appended one batch at a time must give the same results as one run over the full history
+
+TOLERANCE = {'check_exact': False, 'rtol': 1e-9, 'atol': 1e-12}
+
+def select_days(prepared, first, last):
+    return {name: df if name == 'multi_industry_weights' else df[df['Date'].between(first, last)].reset_index(drop=True)
+            for name, df in prepared.items()}
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_appends_match_full_run(engine):
+    prepared = benchmark.make_synthetic_prepared(80, 60, 11, 0.2, 4)
+    dates = np.sort(prepared['benchmark_weights']['Date'].unique())
+
+    state = incremental.initialize_state(select_days(prepared, dates[0], dates[39]), engine)
+    for first, last in [(40, 40), (41, 45), (46, 59)]:
+        incremental.append_days(state, select_days(prepared, dates[first], dates[last]))
+    combined_df, daily_level_data = data.get_attribution_data(prepared, engine)
+
+    pd.testing.assert_frame_equal(state.combined_df, combined_df, **TOLERANCE)
+    pd.testing.assert_frame_equal(state.daily_level_data, daily_level_data, **TOLERANCE)
+    pd.testing.assert_frame_equal(state.daily_compounded_returns(), viz_data.daily_compounded_returns(daily_level_data), **TOLERANCE)
+    pd.testing.assert_frame_equal(state.compounded_allocation_effects(), viz_data.compounded_allocation_effects(daily_level_data), **TOLERANCE)
+    pd.testing.assert_frame_equal(state.compounded_sector_effects(), viz_data.get_compounded_sector_effects(combined_df), **TOLERANCE)
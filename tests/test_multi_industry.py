@@ -0,0 +1,16 @@
+import pytest
+import pandas as pd
+import benchmark
+import data
+
+# The vectorized multi-industry decomposition must give exactly the frame of the previous merge based implementation
+
+@pytest.mark.parametrize('multi_industry_fraction', [0.0, 0.1, 0.5])
+def test_decomposition_matches_merge(multi_industry_fraction):
+    prepared = benchmark.make_synthetic_prepared(n_instruments=120, n_days=60, multi_industry_fraction=multi_industry_fraction)
+    benchmark_df = data.get_benchmark_data(prepared)
+    portfolio_df = data.combine_portfolio_data(prepared['portfolio_weights'], prepared['portfolio_returns'])
+
+    expected = benchmark.handle_multi_industry_assets_merge(portfolio_df, prepared['multi_industry_weights'], benchmark_df)
+    result = data.handle_multi_industry_assets(portfolio_df, prepared['multi_industry_weights'], benchmark_df)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_exact=True)
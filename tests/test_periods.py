@@ -0,0 +1,121 @@
+import pytest
+import numpy as np
+import pandas as pd
+import benchmark
+import data
+import periods
+import visualization_data as viz_data
+
+# Every window query of PeriodAttribution must give what a run over the window's own slice of combined_df and
+# daily_level_data gives: the returns and per sector effects compounded day by day, and the effects linked with the
+# daily textbook Carino coefficient, sum(k_t * effect_t) / K. The slices start from scratch, so any leak of the days
+# before the window into the prefix sums shows up.
+
+TOLERANCE = {'check_exact': False, 'rtol': 1e-9, 'atol': 1e-12}
+TOLERANCE_CLOSE = {'rtol': 1e-9, 'atol': 1e-12}
+
+# 320 business days from 2015-01-01, over a year end
+ARGS = (60, 320, 11, 0.1, 4)
+
+def carino(portfolio_return, benchmark_return):
+    if np.isclose(portfolio_return, benchmark_return, rtol=0, atol=1e-15):
+        return 1 / (1 + portfolio_return)
+    return (np.log(1 + portfolio_return) - np.log(1 + benchmark_return)) / (portfolio_return - benchmark_return)
+
+def brute_force(combined_df, daily_level_data, start, end):
+    # Totals and per sector effects of the window from start to end, from its slices only
+    daily = daily_level_data[(daily_level_data.index >= start) & (daily_level_data.index <= end)]
+    window_df = combined_df[(combined_df['Date'] >= start) & (combined_df['Date'] <= end)]
+
+    portfolio = (1 + daily['Portfolio Weighted Returns']).prod() - 1
+    benchmark_return = (1 + daily['Benchmark Weighted Returns']).prod() - 1
+    k = np.array([carino(p, b) for p, b in zip(daily['Portfolio Weighted Returns'], daily['Benchmark Weighted Returns'])])
+    k_by_date = pd.Series(k, index=daily.index)
+    window_k = carino(portfolio, benchmark_return)
+
+    totals = {'Start Date': daily.index[0], 'End Date': daily.index[-1], 'Days': len(daily), 'Portfolio Return': portfolio,
+              'Benchmark Return': benchmark_return, 'Excess Return': portfolio - benchmark_return}
+    sectors = viz_data.get_compounded_sector_effects(window_df).set_index('GICS Sector')
+    for effect in viz_data.EFFECT_COLUMNS:
+        totals[effect] = (k * daily[effect].values).sum() / window_k
+        scaled = window_df[effect].values * k_by_date.reindex(window_df['Date']).values
+        sectors['Linked ' + effect] = pd.Series(scaled, index=window_df['GICS Sector'].values).groupby(level=0).sum() / window_k
+    return pd.Series(totals), sectors
+
+@pytest.fixture(scope='module')
+def run():
+    combined_df, daily_level_data = data.get_attribution_data(benchmark.make_synthetic_prepared(*ARGS))
+    return combined_df, daily_level_data, periods.PeriodAttribution(combined_df, daily_level_data)
+
+def check_window(run, totals, sectors, start, end):
+    # totals is a row of windows(), sectors the rows of sector_windows() of the window requested from start to end
+    combined_df, daily_level_data, _ = run
+    expected_totals, expected_sectors = brute_force(combined_df, daily_level_data, pd.Timestamp(start), pd.Timestamp(end))
+    for column, value in expected_totals.items():
+        if column in ('Start Date', 'End Date', 'Days'):
+            assert totals[column] == value, column
+        else:
+            assert np.isclose(totals[column], value, **TOLERANCE_CLOSE), column
+
+    sectors = sectors.set_index('GICS Sector').loc[expected_sectors.index]
+    pd.testing.assert_frame_equal(sectors[expected_sectors.columns], expected_sectors, **TOLERANCE)
+
+    # The linked effects of the window add up to its compounded excess return
+    linked = sum(totals[effect] for effect in viz_data.EFFECT_COLUMNS)
+    assert np.isclose(linked, totals['Excess Return'], **TOLERANCE_CLOSE)
+
+def check_windows(run, totals, sectors, starts, ends):
+    # Every row of windows() against its block of rows of sector_windows(), one row per group and window
+    n_groups = len(sectors) // len(totals)
+    blocks = [sectors.iloc[i * n_groups:(i + 1) * n_groups] for i in range(len(totals))]
+    for (_, row), block, start, end in zip(totals.iterrows(), blocks, starts, ends):
+        assert (block['Start Date'] == row['Start Date']).all() and (block['End Date'] == row['End Date']).all()
+        check_window(run, row, block, start, end)
+
+@pytest.mark.parametrize('freq', ['M', 'Q', 'Y'])
+@pytest.mark.parametrize('as_of', [None, '2015-06-15', '2015-12-31', '2016-01-04'])
+def test_to_date(run, freq, as_of):
+    _, daily_level_data, period_attribution = run
+    totals = period_attribution.to_date(freq, as_of).iloc[0]
+    sectors = period_attribution.to_date(freq, as_of, by_sector=True)
+
+    as_of = daily_level_data.index[-1] if as_of is None else pd.Timestamp(as_of)
+    check_window(run, totals, sectors, pd.Period(as_of, freq).start_time, as_of)
+
+def test_arbitrary_windows(run):
+    _, daily_level_data, period_attribution = run
+    rng = np.random.default_rng(0)
+    dates = daily_level_data.index
+    bounds = np.sort(rng.choice(len(dates), (15, 2)), axis=1)
+    # Window bounds between trading dates as well as on them
+    starts = dates[bounds[:, 0]] - pd.to_timedelta(rng.integers(0, 2, len(bounds)), unit='D')
+    ends = dates[bounds[:, 1]] + pd.to_timedelta(rng.integers(0, 2, len(bounds)), unit='D')
+
+    check_windows(run, period_attribution.windows(starts, ends), period_attribution.sector_windows(starts, ends), starts, ends)
+
+    # The whole history by default
+    totals, sectors = period_attribution.window()
+    check_window(run, totals, sectors, dates[0], dates[-1])
+
+@pytest.mark.parametrize('freq', ['M', 'Q', 'Y'])
+def test_calendar(run, freq):
+    _, daily_level_data, period_attribution = run
+    totals = period_attribution.calendar(freq)
+    calendar_periods = daily_level_data.index.to_period(freq).unique()
+    assert list(totals['Period']) == list(calendar_periods.astype(str))
+    check_windows(run, totals, period_attribution.calendar(freq, by_sector=True), calendar_periods.start_time, calendar_periods.end_time)
+
+@pytest.mark.parametrize('months', [1, 3])
+def test_rolling(run, months):
+    _, daily_level_data, period_attribution = run
+    totals = period_attribution.rolling(months)
+    sectors = period_attribution.rolling(months, by_sector=True)
+    dates = daily_level_data.index
+    ends = dates[dates - pd.DateOffset(months=months) >= dates[0]]
+    assert list(totals['End Date']) == list(ends)
+
+    # A sample of the windows, the full set repeats the same check a few hundred times
+    sample = totals.iloc[::25]
+    sample_ends = ends[::25]
+    check_windows(run, sample, sectors[sectors['End Date'].isin(sample['End Date'])],
+                  sample_ends - pd.DateOffset(months=months) + pd.Timedelta(days=1), sample_ends)
@@ -0,0 +1,55 @@
+import pytest
+import numpy as np
+import pandas as pd
+import benchmark
+import data
+import security_attribution
+import visualization_data as viz_data
+
+# The chunked security level mode keeps only running aggregates, which must add up to the same results as a full run
+# over all dates, whatever the chunk size and whether the chunks come from prepared frames or a streamed workbook
+
+TOLERANCE = {'check_exact': False, 'rtol': 1e-9, 'atol': 1e-12}
+TOLERANCE_CLOSE = {'rtol': 1e-9, 'atol': 1e-12}
+
+ARGS = (80, 60, 11, 0.2, 2)
+
+@pytest.fixture(scope='module')
+def full_run():
+    prepared = benchmark.make_synthetic_prepared(*ARGS)
+    benchmark_df = data.get_benchmark_data(prepared)
+    combined_df, daily_level_data = data.get_attribution_data(prepared)
+
+    # Per-instrument selection contributions w_i * (r_i - R_b,sector) of every date at once
+    security_df = data.get_security_level_portfolio_data(prepared, benchmark_df)
+    security_df = security_df.merge(benchmark_df[['Date', 'GICS Sector', 'Return']], on=['Date', 'GICS Sector'], how='left', suffixes=('', '_Benchmark'))
+    security_df['Selection Contribution'] = security_df['Weight'] * (security_df['Return'] - security_df['Return_Benchmark'].fillna(0))
+    securities = security_df.groupby(['GICS Sector', 'Instrument']).agg(
+        **{'Average Weight': ('Weight', 'mean'), 'Days Held': ('Weight', lambda weight: int(weight.fillna(0).ne(0).sum())),
+           'Selection Contribution': ('Selection Contribution', 'sum')}).reset_index()
+
+    return prepared, benchmark_df, combined_df, daily_level_data, securities
+
+@pytest.mark.parametrize('chunk_days', [2, 7, 40, 1000])
+@pytest.mark.parametrize('source', ['prepared', 'prepared_benchmark', 'workbook'])
+def test_chunked_matches_full_run(full_run, chunk_days, source):
+    prepared, benchmark_df, combined_df, daily_level_data, securities = full_run
+    if source == 'workbook':
+        sectors, security_results = security_attribution.get_security_attribution(benchmark.make_synthetic_workbook(*ARGS), chunk_days)
+    else:
+        sectors, security_results = security_attribution.get_security_attribution(
+            prepared, chunk_days, benchmark_df if source == 'prepared_benchmark' else None)
+
+    # Compounded sector effects as in the app's sector chart
+    sectors = sectors.sort_values('GICS Sector', ignore_index=True)
+    expected = viz_data.get_compounded_sector_effects(combined_df).sort_values('GICS Sector', ignore_index=True)
+    pd.testing.assert_frame_equal(sectors[expected.columns], expected, **TOLERANCE)
+
+    # Carino linked effects add up to the linked totals of the last day
+    linked = viz_data.compounded_allocation_effects(daily_level_data.copy()).iloc[-1]
+    for effect in viz_data.EFFECT_COLUMNS:
+        assert np.isclose(sectors['Linked ' + effect].sum(), linked[effect], **TOLERANCE_CLOSE)
+    assert np.isclose(security_results['Linked Selection Contribution'].sum(), linked['Selection Effect'], **TOLERANCE_CLOSE)
+
+    security_results = security_results.sort_values(['GICS Sector', 'Instrument'], ignore_index=True)
+    pd.testing.assert_frame_equal(security_results[securities.columns], securities, **TOLERANCE)
@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+import pandas as pd
+import benchmark
+import data
+import significance
+import visualization_data as viz_data
+
+# Every batch of resamples has its own seed spawned from `seed`, so the results must not depend on the number of
+# workers. The point estimates are the compounded sector effects of visualization_data
+
+ARGS = (60, 120, 11, 0.1, 6)
+
+@pytest.fixture(scope='module')
+def attribution():
+    prepared = benchmark.make_synthetic_prepared(*ARGS)
+    combined_df, _ = data.get_attribution_data(prepared)
+    security_df = data.get_security_level_portfolio_data(prepared, data.get_benchmark_data(prepared))
+    return prepared, combined_df, security_df
+
+def check_point_estimates(results, combined_df, effects):
+    expected = viz_data.get_compounded_sector_effects(combined_df).set_index('GICS Sector')
+    results = results.set_index('GICS Sector').loc[expected.index]
+    pd.testing.assert_frame_equal(results[effects], expected[effects], check_exact=False, rtol=1e-9, atol=1e-12)
+
+def test_bootstrap_is_independent_of_the_workers(attribution):
+    _, combined_df, _ = attribution
+    # Several batches, so both workers get some
+    single = significance.bootstrap_sector_effects(combined_df, n_resamples=300, seed=3, workers=1, batch_size=70)
+    pooled = significance.bootstrap_sector_effects(combined_df, n_resamples=300, seed=3, workers=2, batch_size=70)
+    pd.testing.assert_frame_equal(single, pooled, check_exact=True)
+    check_point_estimates(single, combined_df, viz_data.EFFECT_COLUMNS)
+
+    other_seed = significance.bootstrap_sector_effects(combined_df, n_resamples=300, seed=4, workers=1, batch_size=70)
+    assert not other_seed['Allocation Effect Lower'].equals(single['Allocation Effect Lower'])
+    assert (single['Allocation Effect Lower'] <= single['Allocation Effect Upper']).all()
+
+def test_random_portfolios_are_independent_of_the_workers(attribution):
+    _, combined_df, security_df = attribution
+    single = significance.random_portfolio_sector_effects(combined_df, security_df, n_portfolios=300, seed=3, workers=1, batch_size=70)
+    pooled = significance.random_portfolio_sector_effects(combined_df, security_df, n_portfolios=300, seed=3, workers=2, batch_size=70)
+    pd.testing.assert_frame_equal(single, pooled, check_exact=True)
+    check_point_estimates(single, combined_df, viz_data.EFFECT_COLUMNS)
+
+    other_seed = significance.random_portfolio_sector_effects(combined_df, security_df, n_portfolios=300, seed=4, workers=1, batch_size=70)
+    assert not other_seed['Selection Effect Percentile'].equals(single['Selection Effect Percentile'])
+    assert single[['Allocation Effect Percentile', 'Selection Effect Percentile']].stack().between(0, 100).all()
+
+def test_resample_counts(attribution, monkeypatch):
+    prepared, combined_df, _ = attribution
+    run_resamples = significance.run_resamples
+    counts = []
+
+    def counting_run_resamples(func, shared, n_resamples, *args, **kwargs):
+        counts.append((func.__name__, n_resamples))
+        return run_resamples(func, shared, n_resamples, *args, **kwargs)
+
+    monkeypatch.setattr(significance, 'run_resamples', counting_run_resamples)
+    results = significance.get_sector_significance(prepared, n_resamples=120, workers=1, n_portfolios=40)
+    assert counts == [('bootstrap_batch', 120), ('random_allocation_batch', 40), ('random_selection_batch', 40)]
+    check_point_estimates(results, combined_df, viz_data.EFFECT_COLUMNS)
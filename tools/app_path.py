@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The tools import the app modules (data, cache, ...) as flat modules of the streamlit_app directory, like the app
+# itself does. Importing this module puts that directory on the path. The tools live outside streamlit_app so the
+# desktop build, which bundles that whole directory (npm run dump streamlit_app), does not ship them.
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'streamlit_app')
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import argparse
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import app_path
+import data
+import visualization_data as viz_data
+import utils
+
+# Headless batch runner: attributes many portfolio workbooks against the same benchmark on a process pool.
+# The benchmark sheets are parsed once in the parent process and handed to every worker when it starts.
+
+SUMMARY_COLUMNS = ['Portfolio', 'Status', 'Start Date', 'End Date', 'Portfolio Return', 'Benchmark Return', 'Excess Return',
+                   'Allocation Effect', 'Selection Effect', 'Parse (s)', 'Attribution (s)', 'Write (s)', 'Total (s)', 'Error', 'Path']
+
+_shared_benchmark = None
+
+def list_workbooks(source):
+    # source is either a directory of workbooks or a manifest file with one workbook path per line
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source))
+                if name.endswith('.xlsx') and not name.startswith('~$')]
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [path if os.path.isabs(path) else os.path.join(base_dir, path) for path in paths]
+
+def load_benchmark(benchmark_path):
+    sheets = data.read_performance_data(benchmark_path, sheet_names=data.BENCHMARK_SHEET_NAMES)
+    return data.prepare_performance_data(sheets)
+
+def init_worker(benchmark):
+    global _shared_benchmark
+    _shared_benchmark = benchmark
+
+def attribute(prepared, engine='pandas', sectors=None):
+    # Attribution data plus the compounded series written to the outputs
+    combined_df, daily_level_data = data.get_attribution_data(prepared, engine, sectors)
+    return {
+        'combined_df': combined_df,
+        'daily_level_data': daily_level_data,
+        'compounded_returns': viz_data.daily_compounded_returns(daily_level_data),
+        'attribution_effects': viz_data.compounded_allocation_effects(daily_level_data),
+        'sector_effects': viz_data.get_compounded_sector_effects(combined_df),
+    }
+
+def output_sheets(results):
+    return {
+        'Sector Level Data': results['combined_df'].set_index('Date'),
+        'Daily Data': results['daily_level_data'],
+        'Attribution Data': results['attribution_effects'],
+        'Sector Effects': results['sector_effects'].set_index('GICS Sector'),
+    }
+
+def write_outputs(output_path, results):
+    utils.write_excel_workbook(output_path, output_sheets(results))
+
+def run_job(path, output_dir, engine='pandas', compact=False):
+    # Runs in a worker process. Never raises, failures are reported in the returned summary row
+    name = os.path.splitext(os.path.basename(path))[0]
+    summary = {'Portfolio': name, 'Path': path, 'Status': 'ok', 'Error': None}
+    timings = {}
+
+    try:
+        start = time.perf_counter()
+        sheet_names = data.SHEET_NAMES if _shared_benchmark is None else data.PORTFOLIO_SHEET_NAMES
+        prepared = data.prepare_performance_data(data.read_performance_data(path, sheet_names=sheet_names))
+        if _shared_benchmark is not None:
+            prepared.update(_shared_benchmark)
+        if compact:
+            prepared = data.compact_prepared_data(prepared)
+        timings['Parse (s)'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = attribute(prepared, engine)
+        daily_level_data = results['daily_level_data']
+        timings['Attribution (s)'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        write_outputs(os.path.join(output_dir, name + '_attribution.xlsx'), results)
+        timings['Write (s)'] = time.perf_counter() - start
+
+        last_returns = results['compounded_returns'].iloc[-1]
+        last_effects = results['attribution_effects'].iloc[-1]
+        summary.update({
+            'Start Date': daily_level_data.index.min(),
+            'End Date': daily_level_data.index.max(),
+            'Portfolio Return': last_returns['Portfolio Compounded Returns'],
+            'Benchmark Return': last_returns['Benchmark Compounded Returns'],
+            'Excess Return': last_effects['Excess Returns'],
+            'Allocation Effect': last_effects['Allocation Effect'],
+            'Selection Effect': last_effects['Selection Effect'],
+        })
+    except Exception as e:
+        summary['Status'] = 'failed'
+        summary['Error'] = f"{type(e).__name__}: {e}"
+        summary['Traceback'] = traceback.format_exc()
+
+    summary.update(timings)
+    summary['Total (s)'] = sum(timings.values())
+    return summary
+
+def run_batch(source, output_dir, benchmark_path=None, workers=None, engine='pandas', compact=False):
+    os.makedirs(output_dir, exist_ok=True)
+    paths = list_workbooks(source)
+    benchmark = load_benchmark(benchmark_path) if benchmark_path else None
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(benchmark,)) as executor:
+        futures = {executor.submit(run_job, path, output_dir, engine, compact): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as e:
+                # The worker process itself died, e.g. out of memory
+                row = {'Portfolio': os.path.splitext(os.path.basename(futures[future]))[0], 'Path': futures[future],
+                       'Status': 'failed', 'Error': f"{type(e).__name__}: {e}"}
+            print(f"{row['Status']:<7} {row['Portfolio']}  {row.get('Total (s)', float('nan')):.2f}s  {row['Error'] or ''}")
+            if 'Traceback' in row:
+                print(row['Traceback'], file=sys.stderr)
+            rows.append(row)
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS).sort_values('Portfolio', ignore_index=True)
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run performance attribution for many portfolio workbooks.")
+    parser.add_argument('source', help="Directory of workbooks or a manifest file with one workbook path per line")
+    parser.add_argument('--output', default='attribution_output', help="Directory for per-portfolio outputs and summary.csv")
+    parser.add_argument('--benchmark', help="Workbook with the shared Benchmark Weights/Returns sheets. "
+                                            "Without it, each workbook's own benchmark sheets are used")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--engine', choices=['pandas', 'numpy'], default='pandas')
+    parser.add_argument('--compact', action='store_true', help="Categorical keys and float32 values, for large portfolios")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(args.source, args.output, args.benchmark, args.workers, args.engine, args.compact)
+    failed = (summary['Status'] != 'ok').sum()
+    print(f"{len(summary) - failed} succeeded, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
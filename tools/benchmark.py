@@ -0,0 +1,443 @@
+import io
+import os
+import sys
+import json
+import time
+import subprocess
+import argparse
+import inspect
+import platform
+import tracemalloc
+import numpy as np
+import pandas as pd
+import app_path
+import data
+import visualization_data as viz_data
+import cache
+import currency
+
+GICS_SECTORS = ['Communication Services', 'Consumer Discretionary', 'Consumer Staples', 'Energy', 'Financials',
+                'Health Care', 'Industrials', 'Information Technology', 'Materials', 'Real Estate', 'Utilities']
+
+#! ---------------------------- Synthetic workbook ----------------------------
+
+def make_synthetic_arrays(n_instruments=200, n_days=250, n_sectors=11, multi_industry_fraction=0.05, seed=0):
+    # Random but well formed inputs: weights sum to one per date and multi-industry instruments split over a few sectors
+    rng = np.random.default_rng(seed)
+    sectors = GICS_SECTORS[:n_sectors] if n_sectors <= len(GICS_SECTORS) else [f'Sector {i}' for i in range(n_sectors)]
+    dates = pd.bdate_range('2015-01-01', periods=n_days)
+    instruments = [f'INSTR{i:05d}' for i in range(n_instruments)]
+
+    n_multi = int(n_instruments * multi_industry_fraction)
+    instrument_sectors = rng.choice(sectors, size=n_instruments).astype(object)
+    instrument_sectors[:n_multi] = 'Multi-Industry'
+
+    weights = rng.random((n_days, n_instruments))
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    returns = rng.normal(0.0003, 0.015, (n_days, n_instruments))
+
+    benchmark_weights = rng.random((n_days, n_sectors))
+    benchmark_weights = benchmark_weights / benchmark_weights.sum(axis=1, keepdims=True)
+    benchmark_returns = rng.normal(0.0003, 0.01, (n_days, n_sectors))
+
+    multi_weights = np.zeros((n_multi, n_sectors))
+    for i in range(n_multi):
+        split = rng.choice(n_sectors, size=min(3, n_sectors), replace=False)
+        multi_weights[i, split] = rng.dirichlet(np.ones(len(split)))
+
+    return {
+        'sectors': sectors, 'dates': dates, 'instruments': instruments, 'instrument_sectors': instrument_sectors,
+        'weights': weights, 'returns': returns, 'benchmark_weights': benchmark_weights, 'benchmark_returns': benchmark_returns,
+        'multi_instruments': instruments[:n_multi], 'multi_weights': multi_weights,
+    }
+
+def make_synthetic_workbook(n_instruments=200, n_days=250, n_sectors=11, multi_industry_fraction=0.05, seed=0):
+    # Builds an in-memory workbook with the same sheet layout that data.get_data expects
+    arrays = make_synthetic_arrays(n_instruments, n_days, n_sectors, multi_industry_fraction, seed)
+    sectors, instruments = arrays['sectors'], arrays['instruments']
+    dates = arrays['dates'].strftime('%d.%m.%Y').tolist()
+
+    # Portfolio sheets: instruments as columns, id rows followed by one row per date and a total column
+    id_rows = pd.DataFrame([['Equity'] * n_instruments, list(arrays['instrument_sectors']), ['EUR'] * n_instruments], columns=instruments)
+
+    def portfolio_sheet(values):
+        sheet = pd.concat([id_rows, pd.DataFrame(values, columns=instruments)], ignore_index=True)
+        sheet.insert(0, 'Instrument', ['Instr. Type', 'Sector 1', 'Ccy'] + dates)
+        sheet['Total'] = [None] * 3 + list(values.sum(axis=1))
+        return sheet
+
+    # Benchmark sheets: one row per date, sectors as columns
+    def benchmark_sheet(values):
+        sheet = pd.DataFrame(values, columns=sectors)
+        sheet.insert(0, 'Date', dates)
+        return sheet
+
+    multi_industry = pd.DataFrame(arrays['multi_weights'], columns=sectors)
+    multi_industry.insert(0, 'Instrument', arrays['multi_instruments'])
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        portfolio_sheet(arrays['weights']).to_excel(writer, sheet_name='Portfolio Weights', index=False)
+        portfolio_sheet(arrays['returns']).to_excel(writer, sheet_name='Portfolio Returns', index=False)
+        benchmark_sheet(arrays['benchmark_weights']).to_excel(writer, sheet_name='Benchmark Weights', index=False)
+        benchmark_sheet(arrays['benchmark_returns']).to_excel(writer, sheet_name='Benchmark Returns', index=False)
+        multi_industry.to_excel(writer, sheet_name='Multi-Industry Weights', index=False)
+    output.seek(0)
+
+    return output
+
+def make_synthetic_prepared(n_instruments=200, n_days=250, n_sectors=11, multi_industry_fraction=0.05, seed=0):
+    # Same data as make_synthetic_workbook, but directly in the long format of data.prepare_performance_data.
+    # Skips writing and parsing XLSX, which is impractical at thousands of instruments over many years
+    arrays = make_synthetic_arrays(n_instruments, n_days, n_sectors, multi_industry_fraction, seed)
+    n_days, n_instruments = arrays['weights'].shape
+
+    # Melt order: all dates of the first instrument, then the next instrument
+    instrument_ids = pd.DataFrame({
+        'Instrument': np.repeat(np.array(arrays['instruments'], dtype=object), n_days),
+        'Instr. Type': 'Equity',
+        'Sector 1': np.repeat(arrays['instrument_sectors'], n_days),
+        'Ccy': 'EUR',
+        'Date': np.tile(arrays['dates'].values, n_instruments),
+    })
+
+    def benchmark_long(values, value_name):
+        return pd.DataFrame({
+            'Date': np.tile(arrays['dates'].values, len(arrays['sectors'])),
+            'GICS Sector': np.repeat(np.array(arrays['sectors'], dtype=object), n_days),
+            value_name: values.T.ravel(),
+        })
+
+    multi_industry = pd.DataFrame(arrays['multi_weights'], columns=arrays['sectors'])
+    multi_industry.insert(0, 'Instrument', pd.Series(arrays['multi_instruments'], dtype=object))
+
+    return {
+        'portfolio_weights': instrument_ids.assign(Weight=arrays['weights'].T.ravel()),
+        'portfolio_returns': instrument_ids.assign(Return=arrays['returns'].T.ravel()),
+        'benchmark_weights': benchmark_long(arrays['benchmark_weights'], 'Weight'),
+        'benchmark_returns': benchmark_long(arrays['benchmark_returns'], 'Return'),
+        'multi_industry_weights': data.prepare_multi_industry_weights(multi_industry),
+    }
+
+#! ---------------------------- Benchmarks ----------------------------
+
+def time_call(func, *args, repeat=3):
+    # Best of `repeat` runs, in seconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def time_stage(func, *args, repeat=3):
+    # Best of `repeat` runs in seconds, and the result of the last run to feed the next stage
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def read_sheets_separately(performance_data):
+    # The previous loading path: one read_excel call (and one workbook parse) per sheet
+    return {sheet_name: pd.read_excel(performance_data, sheet_name=sheet_name) for sheet_name in data.SHEET_NAMES}
+
+def benchmark_workbook_load(n_instruments=200, n_days=250, repeat=3):
+    workbook = make_synthetic_workbook(n_instruments=n_instruments, n_days=n_days)
+
+    separate = time_call(read_sheets_separately, workbook, repeat=repeat)
+    single_pass = time_call(data.read_performance_data, workbook, repeat=repeat)
+
+    return {'instruments': n_instruments, 'days': n_days, 'separate_reads_s': separate,
+            'single_pass_s': single_pass, 'speedup': separate / single_pass}
+
+def benchmark_engines(n_instruments=5000, n_days=2500, repeat=1):
+    prepared = make_synthetic_prepared(n_instruments=n_instruments, n_days=n_days)
+
+    pandas_engine = time_call(data.get_attribution_data, prepared, 'pandas', repeat=repeat)
+    numpy_engine = time_call(data.get_attribution_data, prepared, 'numpy', repeat=repeat)
+
+    return {'instruments': n_instruments, 'days': n_days, 'pandas_engine_s': pandas_engine,
+            'numpy_engine_s': numpy_engine, 'speedup': pandas_engine / numpy_engine}
+
+def last_compounded_effects_loop(df, effect_column):
+    # The previous per-sector implementation of visualization_data.get_last_compounded_effects
+    last_effects = {}
+    for sector in df['GICS Sector'].unique():
+        sector_df = df[df['GICS Sector'] == sector]
+        last_effects[sector] = (1 + sector_df[effect_column]).cumprod().iloc[-1] - 1
+    return last_effects
+
+def make_synthetic_effects(n_groups=160, n_days=2500, seed=0):
+    # Sector level frame with daily effects, sorted by date and group like combined_df
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=n_days)
+    groups = np.array([f'Group {i:03d}' for i in range(n_groups)], dtype=object)
+    return pd.DataFrame({
+        'Date': np.repeat(dates.values, n_groups),
+        'GICS Sector': np.tile(groups, n_days),
+        'Allocation Effect': rng.normal(0, 0.0005, n_groups * n_days),
+        'Selection Effect': rng.normal(0, 0.0005, n_groups * n_days),
+    })
+
+def benchmark_sector_effects(n_groups=160, n_days=2500, repeat=3):
+    df = make_synthetic_effects(n_groups, n_days)
+
+    def loop(df):
+        return {effect: last_compounded_effects_loop(df, effect) for effect in viz_data.EFFECT_COLUMNS}
+
+    looped = time_call(loop, df, repeat=repeat)
+    # Unmemoized, a memo hit would only time the cache
+    grouped = time_call(inspect.unwrap(viz_data.get_compounded_sector_effects), df, repeat=repeat)
+
+    return {'groups': n_groups, 'days': n_days, 'loop_s': looped, 'grouped_s': grouped, 'speedup': looped / grouped}
+
+def peak_memory(func, *args):
+    # Peak memory allocated during one call, in bytes. numpy (and so pandas) buffers are traced as well
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_memory(n_instruments=2000, n_days=2500, repeat=1):
+    # Default dtypes against the compact mode of data.compact_prepared_data
+    prepared = make_synthetic_prepared(n_instruments=n_instruments, n_days=n_days)
+    compact = data.compact_prepared_data(prepared)
+
+    default_peak = peak_memory(data.get_attribution_data, prepared)
+    compact_peak = peak_memory(data.get_attribution_data, compact)
+
+    mb = 1024 ** 2
+    return {'instruments': n_instruments, 'days': n_days,
+            'default_frames_mb': cache.estimate_size(prepared) / mb, 'compact_frames_mb': cache.estimate_size(compact) / mb,
+            'default_peak_mb': default_peak / mb, 'compact_peak_mb': compact_peak / mb,
+            'default_s': time_call(data.get_attribution_data, prepared, repeat=repeat),
+            'compact_s': time_call(data.get_attribution_data, compact, repeat=repeat)}
+
+def combine_and_clean(portfolio_df, benchmark_df):
+    return data.clean_combined_data(data.combine_portfolio_and_benchmark_data(portfolio_df, benchmark_df))
+
+def benchmark_stages(n_instruments=200, n_days=250, n_sectors=11, multi_industry_fraction=0.05, repeat=3, from_workbook=True):
+    # Every stage of data.get_data and of the chart data, timed separately. Without from_workbook the parse stage is
+    # skipped and the prepared frames are generated directly, for sizes too large to write as XLSX
+    results = {'instruments': n_instruments, 'days': n_days, 'sectors': n_sectors, 'multi_industry_fraction': multi_industry_fraction}
+
+    if from_workbook:
+        workbook = make_synthetic_workbook(n_instruments, n_days, n_sectors, multi_industry_fraction)
+        results['parse_s'], sheets = time_stage(data.read_performance_data, workbook, repeat=repeat)
+        results['prepare_s'], prepared = time_stage(data.prepare_performance_data, sheets, repeat=repeat)
+    else:
+        prepared = make_synthetic_prepared(n_instruments, n_days, n_sectors, multi_industry_fraction)
+
+    results['benchmark_data_s'], benchmark_df = time_stage(data.get_benchmark_data, prepared, repeat=repeat)
+    results['portfolio_data_s'], portfolio_df = time_stage(data.get_portfolio_data, prepared, benchmark_df, repeat=repeat)
+    results['combine_clean_s'], combined_df = time_stage(combine_and_clean, portfolio_df, benchmark_df, repeat=repeat)
+    results['effects_s'], combined_df = time_stage(data.get_attribution_effects, combined_df, repeat=repeat)
+    results['daily_level_s'], daily_level_data = time_stage(data.get_daily_level_data, combined_df, repeat=repeat)
+
+    # The unmemoized functions, a memo hit would only time the cache
+    for name, arg in [('daily_compounded_returns', daily_level_data), ('average_sector_weights', combined_df),
+                      ('get_compounded_sector_effects', combined_df), ('compounded_allocation_effects', daily_level_data)]:
+        results[name + '_s'], _ = time_stage(inspect.unwrap(getattr(viz_data, name)), arg, repeat=repeat)
+
+    results['total_s'] = sum(value for key, value in results.items() if key.endswith('_s'))
+    return results
+
+#! ---------------------------- Results ----------------------------
+
+def save_results(path, name, results):
+    # Timings plus the environment they were measured in, for comparison with later runs
+    record = {'benchmark': name, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'pandas': pd.__version__, 'numpy': np.__version__, 'machine': platform.machine(), 'results': results}
+    with open(path, 'w') as f:
+        json.dump(record, f, indent=2, default=float)
+
+def compare_results(baseline_path, results, threshold=1.1):
+    # Ratio of every timing to the baseline. Returns the timings that are more than `threshold` times slower
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = {}
+    for key, value in results.items():
+        if key.endswith('_s') and baseline.get(key):
+            ratio = value / baseline[key]
+            print(f"{key:<36} {baseline[key]:10.4f} -> {value:10.4f}  x{ratio:.2f}")
+            if ratio > threshold:
+                regressions[key] = ratio
+    return regressions
+
+def handle_multi_industry_assets_merge(portfolio_df, multi_ind_df, benchmark_df):
+    # The previous merge based implementation of data.handle_multi_industry_assets
+    multi_ind_df = multi_ind_df.assign(Instrument_GICS=multi_ind_df['Instrument'] + ' - ' + multi_ind_df['GICS Sector'])
+
+    multi_ind_df = multi_ind_df.merge(portfolio_df, on=['Instrument'], how='inner', suffixes=('', '_Portfolio'))
+    multi_ind_df['New Weights'] = multi_ind_df['Weight'] * multi_ind_df['BM Weight']
+
+    # Store the original instrument names to be deleted later
+    original_instruments = multi_ind_df['Instrument'].unique()
+
+    # Drop unecessary columns
+    multi_ind_df.drop(columns=['Instrument', 'BM Weight', 'Weight', 'Return', 'GICS Sector_Portfolio'], inplace=True)
+    multi_ind_df = multi_ind_df.merge(benchmark_df, on=['Date', 'GICS Sector'], how='inner')
+    multi_ind_df = (multi_ind_df.drop(columns=['Weight', 'Weighted Returns'])
+                 .rename(columns={'New Weights': 'Weight', 'Instrument_GICS':'Instrument'}))
+
+    # Delete the original tickers from portfolio_df and then concat multi_ind_df to it
+    portfolio_df = portfolio_df[portfolio_df['Instrument'].isin(original_instruments) == False]
+    new_portfolio_df = pd.concat([portfolio_df, multi_ind_df]).sort_values(by=['Date', 'GICS Sector'], ignore_index=True)
+
+    return new_portfolio_df
+
+def benchmark_multi_industry(n_instruments=2000, n_days=1000, repeat=3, fractions=(0.0, 0.05, 0.2, 0.5)):
+    # Merge based against the vectorized multi-industry decomposition at increasing shares of multi-industry instruments
+    rows = []
+    for fraction in fractions:
+        prepared = make_synthetic_prepared(n_instruments=n_instruments, n_days=n_days, multi_industry_fraction=fraction)
+        benchmark_df = data.get_benchmark_data(prepared)
+        portfolio_df = data.combine_portfolio_data(prepared['portfolio_weights'], prepared['portfolio_returns'])
+        mapping = prepared['multi_industry_weights']
+
+        merged = time_call(handle_multi_industry_assets_merge, portfolio_df, mapping, benchmark_df, repeat=repeat)
+        vectorized = time_call(data.handle_multi_industry_assets, portfolio_df, mapping, benchmark_df, repeat=repeat)
+
+        # The merge based version cannot handle categorical keys, the vectorized one is timed on compact frames as well
+        compact = data.compact_prepared_data(prepared)
+        compact_portfolio_df = data.combine_portfolio_data(compact['portfolio_weights'], compact['portfolio_returns'])
+        vectorized_compact = time_call(data.handle_multi_industry_assets, compact_portfolio_df, compact['multi_industry_weights'],
+                                       data.get_benchmark_data(compact), repeat=repeat)
+
+        output_rows = len(data.handle_multi_industry_assets(portfolio_df, mapping, benchmark_df))
+        rows.append({'multi_industry_fraction': fraction, 'output_rows': output_rows, 'merge_s': merged, 'vectorized_s': vectorized,
+                     'vectorized_compact_s': vectorized_compact, 'speedup': merged / vectorized})
+
+    return {'instruments': n_instruments, 'days': n_days, 'fractions': rows}
+
+def make_synthetic_currencies(prepared, n_currencies=5, seed=0):
+    # The synthetic prepared frames with instruments spread over n_currencies (the first is the base currency), and
+    # random walk FX rates for the others
+    rng = np.random.default_rng(seed)
+    names = ['EUR'] + [f'C{i:02d}' for i in range(1, n_currencies)]
+    instruments = prepared['portfolio_weights']['Instrument'].unique()
+    instrument_currency = dict(zip(instruments, rng.choice(names, len(instruments))))
+
+    prepared = dict(prepared)
+    for name in ('portfolio_weights', 'portfolio_returns'):
+        prepared[name] = prepared[name].assign(Ccy=prepared[name]['Instrument'].map(instrument_currency))
+    dates = np.sort(prepared['portfolio_returns']['Date'].unique())
+    prepared['fx_rates'] = pd.concat([pd.DataFrame({'Date': dates, 'Ccy': name, 'Rate': np.exp(np.cumsum(rng.normal(0, 0.005, len(dates))))})
+                                      for name in names[1:]], ignore_index=True)
+    return prepared
+
+def benchmark_currency(n_instruments=2000, n_days=1000, repeat=3, currency_counts=(2, 10, 40)):
+    # Regular pipeline against the currency mode, at an increasing number of currencies
+    prepared = make_synthetic_prepared(n_instruments=n_instruments, n_days=n_days)
+    rows = []
+    for n_currencies in currency_counts:
+        with_currencies = make_synthetic_currencies(prepared, n_currencies)
+        regular = time_call(data.get_attribution_data, with_currencies, repeat=repeat)
+        currency_mode = time_call(currency.get_currency_attribution_data, with_currencies, repeat=repeat)
+        rows.append({'currencies': n_currencies, 'regular_s': regular, 'currency_s': currency_mode, 'overhead': currency_mode / regular})
+    return {'instruments': n_instruments, 'days': n_days, 'currencies': rows}
+
+def benchmark_significance(n_instruments=500, n_days=2520, repeat=1, n_resamples=10000, workers=None):
+    # 10k resamples over 10 years of days by default, on all cores. Imported here so this module also loads under
+    # Pyodide, which has no process pools (see startup_benchmark)
+    import significance
+    prepared = make_synthetic_prepared(n_instruments=n_instruments, n_days=n_days)
+    combined_df, _ = data.get_attribution_data(prepared)
+    security_df = data.get_security_level_portfolio_data(prepared, data.get_benchmark_data(prepared))
+    return {'instruments': n_instruments, 'days': n_days, 'resamples': n_resamples,
+            'bootstrap_s': time_call(significance.bootstrap_sector_effects, combined_df, n_resamples, 20, 0.95, 0, workers, repeat=repeat),
+            'random_portfolios_s': time_call(significance.random_portfolio_sector_effects, combined_df, security_df, n_resamples, 0, workers, repeat=repeat)}
+
+#! ---------------------------- Cold start ----------------------------
+
+LIBRARY_MODULES = ['data', 'attribution', 'utils', 'visualization_data']
+HEAVY_MODULES = ['streamlit', 'plotly', 'xlsxwriter', 'openpyxl', 'scipy']
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {modules}
+print(time.perf_counter() - start)
+print(','.join(name for name in {heavy} if name in sys.modules))
+"""
+
+def cold_import(modules, repeat=5):
+    # Best import time of the modules in a fresh interpreter each run, and the heavy modules they pulled in
+    script = IMPORT_SCRIPT.format(modules=', '.join(modules), heavy=HEAVY_MODULES)
+    timings = []
+    for _ in range(repeat):
+        # Run next to the tools, with the app directory on the path as app_path puts it
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=dict(os.environ, PYTHONPATH=app_path.APP_DIR)).stdout.splitlines()
+        timings.append(float(output[0]))
+    return min(timings), [name for name in output[1].split(',') if name]
+
+def benchmark_import(n_instruments=None, n_days=None, repeat=5):
+    # Cold start of the library modules and of the CLI, the sizes do not apply
+    results = {}
+    for name, modules in [('pandas', ['pandas']), ('library', LIBRARY_MODULES), ('cli', ['cli'])]:
+        seconds, heavy = cold_import(modules, repeat)
+        results[name + '_s'] = seconds
+        results[name + '_heavy_modules'] = heavy
+    results['library_over_pandas_s'] = results['library_s'] - results['pandas_s']
+    return results
+
+BENCHMARKS = {
+    'load': (benchmark_workbook_load, 200, 250),
+    'engine': (benchmark_engines, 5000, 2500),
+    'sector_effects': (benchmark_sector_effects, 160, 2500),
+    'memory': (benchmark_memory, 2000, 2500),
+    'stages': (benchmark_stages, 200, 250),
+    'multi_industry': (benchmark_multi_industry, 2000, 1000),
+    'currency': (benchmark_currency, 2000, 1000),
+    'significance': (benchmark_significance, 500, 2520),
+    'import': (benchmark_import, None, None),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the attribution pipeline on synthetic data.")
+    parser.add_argument('name', choices=list(BENCHMARKS) + ['generate'], help="Benchmark to run, or 'generate' to write a synthetic workbook")
+    parser.add_argument('size', nargs='?', type=int, help="Number of instruments (groups for sector_effects)")
+    parser.add_argument('days', nargs='?', type=int, help="Number of days")
+    parser.add_argument('--sectors', type=int, default=11)
+    parser.add_argument('--multi-industry', type=float, default=0.05, help="Fraction of multi-industry instruments")
+    parser.add_argument('--repeat', type=int, default=None, help="Runs per timing, the best one is kept")
+    parser.add_argument('--no-workbook', action='store_true', help="stages: generate the prepared frames directly and skip the parse")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare the timings against")
+    parser.add_argument('--threshold', type=float, default=1.1, help="Slowdown ratio reported as a regression")
+    parser.add_argument('--output', default='synthetic_workbook.xlsx', help="generate: path of the workbook")
+    args = parser.parse_args(argv)
+
+    if args.name == 'generate':
+        workbook = make_synthetic_workbook(args.size or 200, args.days or 250, args.sectors, args.multi_industry)
+        with open(args.output, 'wb') as f:
+            f.write(workbook.getvalue())
+        print(f"Wrote {args.output}")
+        return 0
+
+    func, n_instruments, n_days = BENCHMARKS[args.name]
+    kwargs = {} if args.repeat is None else {'repeat': args.repeat}
+    if args.name == 'stages':
+        kwargs.update(n_sectors=args.sectors, multi_industry_fraction=args.multi_industry, from_workbook=not args.no_workbook)
+    results = func(args.size or n_instruments, args.days or n_days, **kwargs)
+    print(results)
+
+    if args.json:
+        save_results(args.json, args.name, results)
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} timings regressed by more than x{args.threshold}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    # python benchmark.py <benchmark> [instruments or groups] [days] [--json results.json] [--compare baseline.json]
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import argparse
+import app_path
+
+# Headless command line entry to the attribution, without Streamlit:
+#
+#     python cli.py run Performance_Data.xlsx --output results
+#     python cli.py run portfolio_weights=pw.parquet portfolio_returns=pr.parquet ... --format csv
+#
+# Only the standard library is imported at startup. pandas and the pipeline modules are imported by the command that
+# needs them, so `--help` and argument errors return immediately. The library modules (data, attribution, utils,
+# visualization_data) never import streamlit or plotly, see benchmark_import in benchmark.py for their cold start time.
+
+OUTPUT_FORMATS = ['xlsx', 'csv', 'parquet']
+
+def parse_inputs(inputs):
+    # One workbook path, or name=path pairs for the datasets of ingest.DATASETS
+    if len(inputs) == 1 and '=' not in inputs[0]:
+        return inputs[0], None
+
+    files = {}
+    for item in inputs:
+        name, sep, path = item.partition('=')
+        if not sep:
+            raise ValueError(f"Expected dataset=path, got {item}")
+        files[name] = path
+    return None, files
+
+def output_file_name(sheet_name, output_format):
+    return sheet_name.lower().replace(' ', '_') + '.' + output_format
+
+def write_results(output_dir, results, output_format='xlsx'):
+    # One workbook with a sheet per output, or one CSV / Parquet file per output. Returns the written paths
+    import batch
+
+    os.makedirs(output_dir, exist_ok=True)
+    if output_format == 'xlsx':
+        path = os.path.join(output_dir, 'attribution.xlsx')
+        batch.write_outputs(path, results)
+        return [path]
+
+    paths = []
+    for sheet_name, df in batch.output_sheets(results).items():
+        path = os.path.join(output_dir, output_file_name(sheet_name, output_format))
+        if output_format == 'csv':
+            df.to_csv(path)
+        else:
+            df.to_parquet(path)
+        paths.append(path)
+    return paths
+
+def run(inputs, output_dir, output_format='xlsx', engine='pandas', start_date=None, end_date=None, sectors=None, compact=False):
+    import data
+    import batch
+
+    workbook, files = parse_inputs(inputs)
+    if workbook is not None:
+        prepared = data.load_prepared_data(workbook, start_date=start_date, end_date=end_date, sectors=sectors, compact=compact)
+    else:
+        import ingest
+        prepared = ingest.load_datasets(files, start_date, end_date, sectors)
+        if compact:
+            prepared = data.compact_prepared_data(prepared)
+
+    results = batch.attribute(prepared, engine, sectors)
+    return results, write_results(output_dir, results, output_format)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Brinson performance attribution without the Streamlit app.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run the attribution for one portfolio and write the outputs")
+    run_parser.add_argument('inputs', nargs='+', help="Performance workbook, or dataset=path pairs of CSV / Parquet files "
+                                                      "(portfolio_weights, portfolio_returns, benchmark_weights, "
+                                                      "benchmark_returns, multi_industry_weights)")
+    run_parser.add_argument('--output', default='attribution_output', help="Directory for the outputs")
+    run_parser.add_argument('--format', choices=OUTPUT_FORMATS, default='xlsx', help="One workbook, or one file per output")
+    run_parser.add_argument('--engine', choices=['pandas', 'numpy'], default='pandas')
+    run_parser.add_argument('--start', help="First date of the period, YYYY-MM-DD")
+    run_parser.add_argument('--end', help="Last date of the period, YYYY-MM-DD")
+    run_parser.add_argument('--sectors', nargs='+', help="GICS sectors to keep")
+    run_parser.add_argument('--compact', action='store_true', help="Categorical keys and float32 values, for large portfolios")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        results, paths = run(args.inputs, args.output, args.format, args.engine, args.start, args.end, args.sectors, args.compact)
+    except (ValueError, KeyError, OSError) as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+
+    last_effects = results['attribution_effects'].iloc[-1]
+    print(f"Excess return {last_effects['Excess Returns']:.4%}, allocation {last_effects['Allocation Effect']:.4%}, "
+          f"selection {last_effects['Selection Effect']:.4%} ({time.perf_counter() - start:.2f}s)")
+    for path in paths:
+        print(f"Wrote {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
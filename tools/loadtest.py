@@ -0,0 +1,101 @@
+import sys
+import json
+import time
+import argparse
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import app_path
+
+# Load test of service.py on localhost. Every client thread posts the workbook with one of a few parameter sets, so
+# the run exercises the cold computations, the coalescing of concurrent identical requests and the response cache.
+#
+#     python service.py --workers 4 &
+#     python loadtest.py Performance_Data.xlsx --requests 200 --concurrency 16
+#
+# Without a workbook a synthetic one is generated (benchmark.make_synthetic_workbook).
+
+def default_variants(n_variants):
+    # Parameter sets that produce different results: all sectors, then growing subsets of the synthetic sectors
+    import benchmark
+    variants = [{}]
+    for i in range(1, n_variants):
+        variants.append({'sectors': ','.join(benchmark.GICS_SECTORS[:i])})
+    return variants
+
+def post(host, port, content, params, timeout=600):
+    # One request on its own connection. Returns (status, seconds, response bytes)
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('POST', '/attribution?' + urllib.parse.urlencode(params), body=content,
+                           headers={'Content-Type': 'application/octet-stream'})
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, time.perf_counter() - start, len(body)
+    finally:
+        connection.close()
+
+def get_json(host, port, path):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+def run_load_test(content, host='127.0.0.1', port=8765, n_requests=100, concurrency=8, variants=None):
+    variants = variants or [{}]
+    stats_before = get_json(host, port, '/stats')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(lambda i: post(host, port, content, variants[i % len(variants)]), range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    stats_after = get_json(host, port, '/stats')
+    latencies = np.array([seconds for _, seconds, _ in responses])
+    return {
+        'requests': n_requests,
+        'concurrency': concurrency,
+        'variants': len(variants),
+        'failed': sum(status != 200 for status, _, _ in responses),
+        'elapsed_s': elapsed,
+        'requests_per_s': n_requests / elapsed,
+        'p50_s': float(np.percentile(latencies, 50)),
+        'p95_s': float(np.percentile(latencies, 95)),
+        'max_s': float(latencies.max()),
+        # Server side: how many requests were computed, coalesced onto a running computation or served from cache
+        **{key: stats_after[key] - stats_before[key] for key in ('computed', 'coalesced', 'cache_hits')},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the local attribution service.")
+    parser.add_argument('workbook', nargs='?', help="Workbook to post (default: a synthetic workbook)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--variants', type=int, default=4, help="Number of distinct parameter sets")
+    parser.add_argument('--size', type=int, default=200, help="Instruments of the synthetic workbook")
+    parser.add_argument('--days', type=int, default=250, help="Days of the synthetic workbook")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.workbook:
+        with open(args.workbook, 'rb') as f:
+            content = f.read()
+    else:
+        import benchmark
+        content = benchmark.make_synthetic_workbook(args.size, args.days).getvalue()
+
+    results = run_load_test(content, args.host, args.port, args.requests, args.concurrency, default_variants(args.variants))
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if results['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import app_path
+import data
+import cache
+import batch
+
+# Local HTTP service for tools that need attribution results without running their own pandas process.
+#
+#     python service.py --benchmark benchmark.xlsx --workers 4
+#     curl --data-binary @portfolio.xlsx "http://127.0.0.1:8765/attribution?start=2023-01-01&sectors=Energy,Financials"
+#
+# The event loop only parses requests and serves cached responses. The attribution runs in a process pool whose
+# workers are started and warmed up with the service, each holding the parsed benchmark (when --benchmark is given)
+# and the last parsed workbooks. Uploads are hashed on a thread, and on a cache miss written to a temporary file whose
+# path goes to the worker instead of the bytes. A worker that already parsed the workbook never reads it. Responses are cached by workbook hash and parameters, and concurrent requests for
+# the same key wait on the one computation already running instead of starting another.
+#
+# Endpoints:
+#   POST /attribution  workbook bytes as the body; query: engine, start, end, sectors (comma separated), compact,
+#                      outputs (comma separated names of OUTPUTS). Returns {name: frame in pandas 'split' orient}
+#   GET  /stats        request, cache and coalescing counters
+#   GET  /health
+
+OUTPUTS = ['compounded_returns', 'attribution_effects', 'sector_effects', 'daily_level_data', 'combined_df']
+DEFAULT_OUTPUTS = ['compounded_returns', 'attribution_effects', 'sector_effects']
+
+MAX_BODY_BYTES = 256 * 1024 ** 2
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+               500: 'Internal Server Error'}
+
+#! ---------------------------- Worker processes ----------------------------
+
+_shared_benchmark = None
+
+# Parsed workbooks by content hash, per worker. A repeated workbook with other parameters skips the Excel parse
+_prepared_cache = cache.ResultCache(max_entries=4, max_bytes=1024 ** 3)
+
+def init_worker(benchmark):
+    global _shared_benchmark
+    _shared_benchmark = benchmark
+
+def warm_up():
+    # Runs once in every worker at startup so the first request does not pay for the process start and imports
+    return True
+
+def get_prepared(path, key):
+    prepared = _prepared_cache.get(key)
+    if prepared is None:
+        sheet_names = data.SHEET_NAMES if _shared_benchmark is None else data.PORTFOLIO_SHEET_NAMES
+        prepared = data.prepare_performance_data(data.read_performance_data(path, sheet_names=sheet_names))
+        if _shared_benchmark is not None:
+            prepared.update(_shared_benchmark)
+        _prepared_cache.put(key, prepared)
+    return prepared
+
+def compute(path, key, params):
+    # Runs in a worker process. Returns the JSON response body, so the serialization stays off the event loop too
+    prepared = data.filter_prepared_data(get_prepared(path, key), params['start'], params['end'], params['sectors'])
+    if params['compact']:
+        prepared = data.compact_prepared_data(prepared)
+    results = batch.attribute(prepared, params['engine'], params['sectors'])
+
+    parts = [f'{json.dumps(name)}: {results[name].to_json(orient="split", date_format="iso", double_precision=15)}' for name in params['outputs']]
+    return ('{' + ', '.join(parts) + '}').encode()
+
+#! ---------------------------- Service ----------------------------
+
+def spool(content):
+    # The upload in a temporary file, for the worker to read only when it needs to parse it
+    fd, path = tempfile.mkstemp(prefix='attribution_', suffix='.xlsx')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    return path
+
+def parse_params(query):
+    # Attribution parameters from the query string, in a canonical form so equal requests get equal keys
+    values = {name: value[-1] for name, value in urllib.parse.parse_qs(query).items()}
+
+    def split(name):
+        return sorted({item.strip() for item in values[name].split(',') if item.strip()}) if values.get(name) else None
+
+    params = {
+        'engine': values.get('engine', 'pandas'),
+        'start': values.get('start') or None,
+        'end': values.get('end') or None,
+        'sectors': split('sectors'),
+        'compact': values.get('compact', '0').lower() in ('1', 'true', 'yes'),
+        'outputs': split('outputs') or DEFAULT_OUTPUTS,
+    }
+    if params['engine'] not in ('pandas', 'numpy'):
+        raise ValueError(f"Unknown engine: {params['engine']}")
+    unknown = set(params['outputs']) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f"Unknown outputs: {', '.join(sorted(unknown))}")
+    for name in ('start', 'end'):
+        if params[name] is not None:
+            params[name] = str(pd.Timestamp(params[name]).date())
+    return params
+
+class AttributionService:
+    """
+    Response cache and coalescing of identical requests in front of the worker pool. Only used from the event loop.
+    """
+    def __init__(self, executor, result_cache=None):
+        self.executor = executor
+        self.result_cache = cache.ResultCache(max_entries=64, max_bytes=512 * 1024 ** 2) if result_cache is None else result_cache
+        self.in_flight = {}
+        self.stats = {'requests': 0, 'computed': 0, 'cache_hits': 0, 'coalesced': 0, 'failed': 0}
+
+    async def attribution(self, content, params):
+        self.stats['requests'] += 1
+        # hashlib releases the GIL on large buffers, so hashing on a thread keeps the loop serving other requests
+        file_key = await asyncio.get_running_loop().run_in_executor(None, cache.hash_bytes, content)
+        key = (file_key, json.dumps(params, sort_keys=True))
+
+        body = self.result_cache.get(key)
+        if body is not None:
+            self.stats['cache_hits'] += 1
+            return body
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.ensure_future(self.compute(content, file_key, params))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self.finish(key, done))
+        # A cancelled waiter must not cancel the computation the other waiters share
+        return await asyncio.shield(future)
+
+    async def compute(self, content, file_key, params):
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(None, spool, content)
+        try:
+            return await loop.run_in_executor(self.executor, compute, path, file_key, params)
+        finally:
+            os.remove(path)
+
+    def finish(self, key, future):
+        del self.in_flight[key]
+        if future.cancelled() or future.exception() is not None:
+            self.stats['failed'] += 1
+            return
+        self.stats['computed'] += 1
+        self.result_cache.put(key, future.result())
+
+    def get_stats(self):
+        return dict(self.stats, in_flight=len(self.in_flight), cached=len(self.result_cache),
+                    cached_mb=self.result_cache.total_bytes / 1024 ** 2)
+
+    async def dispatch(self, method, target, body):
+        # Returns (status, JSON body)
+        path, _, query = target.partition('?')
+        if path == '/health':
+            return 200, b'{"status": "ok"}'
+        if path == '/stats':
+            return 200, json.dumps(self.get_stats()).encode()
+        if path != '/attribution':
+            return 404, json.dumps({'error': f"No route {path}"}).encode()
+        if method != 'POST':
+            return 405, json.dumps({'error': "POST the workbook to /attribution"}).encode()
+
+        try:
+            params = parse_params(query)
+        except ValueError as e:
+            return 400, json.dumps({'error': str(e)}).encode()
+        if not body:
+            return 400, json.dumps({'error': "Empty request body, expected a workbook"}).encode()
+
+        try:
+            return 200, await self.attribution(body, params)
+        except Exception as e:
+            return 500, json.dumps({'error': f"{type(e).__name__}: {e}"}).encode()
+
+    async def handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1: Content-Length bodies and keep-alive connections
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, json.dumps({'error': f"Body over {MAX_BODY_BYTES} bytes"}).encode()
+                    keep_alive = False
+                else:
+                    status, payload = await self.dispatch(method, target, await reader.readexactly(length))
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode())
+                writer.write(payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host='127.0.0.1', port=8765, workers=None, benchmark_path=None):
+    benchmark = batch.load_benchmark(benchmark_path) if benchmark_path else None
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(benchmark,)) as executor:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, warm_up) for _ in range(workers)])
+
+        service = AttributionService(executor)
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f"Serving attribution on http://{host}:{port} with {workers} workers", flush=True)
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP service for performance attribution.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--benchmark', help="Workbook with the shared Benchmark Weights/Returns sheets, parsed once at startup. "
+                                            "Without it, each posted workbook's own benchmark sheets are used")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.benchmark))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import io
+import sys
+import json
+import time
+import inspect
+import argparse
+import importlib
+import tempfile
+import app_path
+
+# Startup and attribution timings of the app in one fresh interpreter: the imports the app does before anything is
+# uploaded, the imports it defers to the first upload, chart or download, and then every step of an analysis. Runs
+# under CPython from the tools directory
+#
+#     python startup_benchmark.py [workbook.xlsx] --json startup.json
+#
+# and under Pyodide in Node, with the Pyodide version of the desktop build, from the repository root
+#
+#     npm run bench:pyodide -- [workbook.xlsx] --json startup.json
+#
+# Only the standard library is imported at the top of this module, the other imports are what is being timed.
+# Without a workbook a synthetic one is generated (benchmark.make_synthetic_workbook).
+
+# The modules streamlit_app.py imports before anything is uploaded, except streamlit itself which is not part of the
+# Pyodide harness
+STARTUP_MODULES = ['data', 'visualization_data', 'utils', 'cache', 'store', 'ingest', 'profiling', 'periods', 'downsampling']
+
+# Package -> module importing it. openpyxl is imported by the first workbook upload (pandas.read_excel), plotly with
+# the first chart and xlsxwriter by the first Excel download
+DEFERRED_MODULES = {'openpyxl': 'openpyxl', 'plotly': 'visualizations', 'xlsxwriter': 'xlsxwriter'}
+
+CHARTS = [('daily_compounded_returns', 'daily_level_data', 'plot_daily_compounded_returns'),
+          ('get_compounded_sector_effects', 'combined_df', 'plot_allocation_effects_per_sector'),
+          ('average_sector_weights', 'combined_df', 'plot_sector_weights_comparison'),
+          ('compounded_allocation_effects', 'daily_level_data', 'plot_attribution_effects')]
+
+def time_import(modules):
+    # Seconds to import the modules, only meaningful the first time in an interpreter
+    start = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    return time.perf_counter() - start
+
+def time_imports():
+    results = {'python': sys.version.split()[0], 'platform': sys.platform}
+    results['pandas_import_s'] = time_import(['numpy', 'pandas'])
+    results['startup_import_s'] = time_import(STARTUP_MODULES)
+    # Should stay empty, anything listed here is paid for at startup
+    results['eagerly_imported'] = [name for name in DEFERRED_MODULES if name in sys.modules]
+
+    for name, module in DEFERRED_MODULES.items():
+        try:
+            results[name + '_import_s'] = time_import([module])
+        except ImportError:
+            results[name + '_import_s'] = None
+    return results
+
+def time_analysis(content, repeat=3):
+    # Every step from the uploaded bytes to the charts and the Excel download, best of `repeat` runs
+    import data
+    import utils
+    import store
+    import visualization_data as viz_data
+    from benchmark import time_stage
+
+    results = {'workbook_bytes': len(content)}
+    results['parse_s'], sheets = time_stage(lambda: data.read_performance_data(io.BytesIO(content)), repeat=repeat)
+    results['prepare_s'], prepared = time_stage(data.prepare_performance_data, sheets, repeat=repeat)
+
+    # The store round trip a repeated upload of the same workbook takes instead of the two steps above
+    with tempfile.TemporaryDirectory() as root:
+        frame_store = store.FrameStore(root)
+        results['store_format'] = frame_store.file_format
+        results['store_put_s'], _ = time_stage(frame_store.put, 'workbook', prepared, repeat=repeat)
+        results['store_get_s'], _ = time_stage(frame_store.get, 'workbook', repeat=repeat)
+
+    results['attribution_s'], (combined_df, daily_level_data) = time_stage(data.get_attribution_data, prepared, repeat=repeat)
+    frames = {'combined_df': combined_df, 'daily_level_data': daily_level_data}
+
+    # The unmemoized chart data functions, a memo hit would only time the cache
+    chart_data = {}
+    start = time.perf_counter()
+    for name, argument, _ in CHARTS:
+        chart_data[name] = inspect.unwrap(getattr(viz_data, name))(frames[argument])
+    results['chart_data_s'] = time.perf_counter() - start
+
+    if 'visualizations' in sys.modules:
+        viz = sys.modules['visualizations']
+        results['figures_s'], _ = time_stage(lambda: [getattr(viz, plot)(chart_data[name]) for name, _, plot in CHARTS], repeat=repeat)
+
+    if 'xlsxwriter' in sys.modules:
+        sheets = {'Daily Level Data': daily_level_data, 'Sector Level Data': combined_df}
+        results['excel_export_s'], _ = time_stage(lambda: utils.write_excel_workbook(io.BytesIO(), sheets), repeat=repeat)
+
+    return results
+
+def run(workbook=None, n_instruments=200, n_days=250, repeat=3):
+    # Imports first, anything imported before them would not be timed
+    results = time_imports()
+    if workbook is None:
+        import benchmark
+        results.update(instruments=n_instruments, days=n_days)
+        content = benchmark.make_synthetic_workbook(n_instruments, n_days).getvalue()
+    else:
+        with open(workbook, 'rb') as f:
+            content = f.read()
+    results.update(time_analysis(content, repeat))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup and attribution timings of the app in a fresh interpreter.")
+    parser.add_argument('workbook', nargs='?', help="Workbook to analyse (default: a synthetic workbook)")
+    parser.add_argument('--size', type=int, default=200, help="Instruments of the synthetic workbook")
+    parser.add_argument('--days', type=int, default=250, help="Days of the synthetic workbook")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run(args.workbook, args.size, args.days, args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())